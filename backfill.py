@@ -0,0 +1,104 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import Timeout
+
+
+# What nodes say when a getLogs range has too many results to return
+# e.g. Infura: "query returned more than 10000 results"
+TOO_MANY_RESULTS = (
+        'more than',
+        'too many',
+        'limit exceeded',
+        'response size',
+    )
+
+
+def _is_too_many_results(error: Exception) -> bool:
+    if isinstance(error, Timeout):
+        return True  # Probably too much work for the node as well
+    message = str(error).lower()
+    return any(m in message for m in TOO_MANY_RESULTS)
+
+
+class Backfill:
+    """
+    Fetches all logs matching a filter over a block range
+
+    The range is split into chunks that are fetched concurrently in a bounded
+    thread pool, then delivered in (block, log index) order. When the node
+    rejects a chunk for having too many results, the chunk is split in half
+    and the chunk size used from then on is halved; it grows back slowly
+    while chunks succeed.
+    """
+    def __init__(self, w3, log_filter: dict, decode=None,
+            chunk_size: int=5000, max_chunk_size: int=100000, workers: int=4):
+        self._w3 = w3
+        self._filter = log_filter
+        self._decode = decode
+        self.chunk_size = chunk_size
+        self._max_chunk_size = max_chunk_size
+        self._workers = workers
+        self._lock = threading.Lock()
+        # Statistics for the last run
+        self.logs = 0
+        self.requests = 0
+        self.elapsed = 0.0
+
+    @property
+    def logs_per_sec(self) -> float:
+        return self.logs / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self) -> str:
+        return "Fetched {} logs in {} requests over {:.2f}s ({:.1f} logs/sec)".format(
+                self.logs, self.requests, self.elapsed, self.logs_per_sec
+            )
+
+    def _fetch(self, from_block: int, to_block: int, split: bool=False) -> list:
+        params = dict(self._filter, fromBlock=from_block, toBlock=to_block)
+        with self._lock:
+            self.requests += 1
+        try:
+            logs = self._w3.eth.getLogs(params)
+        except (ValueError, Timeout) as e:
+            if from_block == to_block or not _is_too_many_results(e):
+                raise
+            mid = (from_block + to_block) // 2
+            # Chunks scheduled after this one should be smaller too
+            with self._lock:
+                self.chunk_size = min(self.chunk_size, mid - from_block + 1)
+            return self._fetch(from_block, mid, True) + self._fetch(mid + 1, to_block, True)
+
+        with self._lock:
+            if not split and to_block - from_block + 1 >= self.chunk_size:
+                self.chunk_size = min(self.chunk_size * 5 // 4 + 1, self._max_chunk_size)
+
+        logs = sorted(logs, key=lambda l: (l['blockNumber'], l['logIndex']))
+        if self._decode is not None:
+            logs = [self._decode(l) for l in logs]
+        return logs
+
+    def run(self, from_block: int, to_block: int):
+        """
+        Yields every log in [from_block, to_block] in (block, log index) order
+        """
+        self.logs = 0
+        self.requests = 0
+        start = time.perf_counter()
+        pending = deque()  # Chunks in block order
+        next_block = from_block
+        with ThreadPoolExecutor(self._workers) as pool:
+            while next_block <= to_block or pending:
+                # Keep a bounded number of chunks in flight, so that
+                # completed chunks don't pile up behind a slow one
+                while next_block <= to_block and len(pending) < 2 * self._workers:
+                    end = min(next_block + self.chunk_size - 1, to_block)
+                    pending.append(pool.submit(self._fetch, next_block, end))
+                    next_block = end + 1
+
+                for log in pending.popleft().result():
+                    self.logs += 1
+                    yield log
+                self.elapsed = time.perf_counter() - start
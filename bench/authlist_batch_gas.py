@@ -0,0 +1,118 @@
+"""
+Gas per account for authlist updates on eth-tester: one at a time with
+`authorize`/`authorizeCompressed`, versus batches of 1 to 256 with `setBatch`
+
+    $ python bench/authlist_batch_gas.py [--existing 1000]
+"""
+import sys
+import random
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+
+from eth_tester import EthereumTester, PyEVMBackend
+from eth_utils import to_checksum_address
+from vyper.compiler import compile as vyc
+from vyper.compiler import mk_full_signature as vya
+from web3 import Web3
+from web3.providers.eth_tester import EthereumTesterProvider
+
+from smt import SparseMerkleTree
+
+
+CONTRACTS = Path(__file__).resolve().parents[1] / 'contracts'
+GAS_LIMIT = 100000000  # Room for the largest batches
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+AUTHORIZED = (1).to_bytes(32, byteorder='big')
+
+
+def tester():
+    try:
+        params = PyEVMBackend._generate_genesis_params(overrides={'gas_limit': GAS_LIMIT})
+        return EthereumTester(PyEVMBackend(genesis_parameters=params))
+    except (AttributeError, TypeError):
+        # Older eth-tester can't raise the block gas limit
+        return EthereumTester(PyEVMBackend())
+
+
+def block_gas(w3):
+    """
+    Gas for a transaction to take all of the next block (eth-tester mines a
+    block per transaction, and the block gas limit drifts down from genesis)
+    """
+    return w3.eth.getBlock('pending')['gasLimit']
+
+
+def deploy(w3, name, *args, contracts=CONTRACTS):
+    with open(Path(contracts) / (name + '.vy'), 'r') as f:
+        code = f.read()
+    interface = {
+        'abi': vya(code),
+        'bytecode': vyc(code),
+        'bytecode_runtime': vyc(code, bytecode_runtime=True)
+    }
+    txn_hash = w3.eth.contract(**interface).constructor(*args).transact()
+    address = w3.eth.waitForTransactionReceipt(txn_hash)['contractAddress']
+    return w3.eth.contract(address, **interface)
+
+
+def set_batch(w3, authlist, smt, keys):
+    keys = sorted(keys)
+    defaults, siblings = smt.multiproof(keys)
+    txn_hash = authlist.functions.setBatch(
+            b''.join(k.rjust(32, b'\x00') for k in keys),
+            [1] * 256,
+            len(keys),
+            defaults,
+            b''.join(siblings),
+        ).transact({'from':w3.eth.accounts[0], 'gas':block_gas(w3)})
+    smt.set_many((k, AUTHORIZED) for k in keys)
+    return w3.eth.waitForTransactionReceipt(txn_hash)['gasUsed']
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser("Benchmark gas per account of authlist updates")
+    ap.add_argument("--existing", type=int, default=1000,
+            help="Accounts to authorize before measuring (tree density)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    new_key = lambda: rng.getrandbits(160).to_bytes(20, byteorder='big')
+
+    w3 = Web3(EthereumTesterProvider(tester()))
+    authlist = deploy(w3, 'auth-list')
+    smt = SparseMerkleTree()
+
+    # Fill up the tree, so proofs look like they would in production
+    for start in range(0, args.existing, 256):
+        set_batch(w3, authlist, smt, [new_key() for _ in range(min(256, args.existing - start))])
+    assert authlist.functions.root().call() == smt.root_hash
+
+    results = []
+    for method in ('authorize', 'authorizeCompressed'):
+        gas = []
+        for _ in range(8):
+            key = new_key()
+            if method == 'authorize':
+                fn = authlist.functions.authorize(to_checksum_address(key), smt.branch(key))
+            else:
+                bitmap, siblings = smt.compressed_branch(key)
+                fn = authlist.functions.authorizeCompressed(to_checksum_address(key), bitmap, b''.join(siblings))
+            txn_hash = fn.transact({'from':w3.eth.accounts[0], 'gas':block_gas(w3)})
+            gas.append(w3.eth.waitForTransactionReceipt(txn_hash)['gasUsed'])
+            smt.set(key, AUTHORIZED)
+        results.append((method, 1, sum(gas) // len(gas)))
+
+    for size in BATCH_SIZES:
+        try:
+            gas = set_batch(w3, authlist, smt, [new_key() for _ in range(size)])
+        except Exception as e:
+            print("setBatch({}) failed: {}".format(size, e), file=sys.stderr)
+            continue
+        results.append(('setBatch', size, gas))
+    assert authlist.functions.root().call() == smt.root_hash
+
+    print("{:<20} {:>6} {:>12} {:>12}".format('method', 'size', 'gas', 'gas/account'))
+    for method, size, gas in results:
+        print("{:<20} {:>6} {:>12} {:>12}".format(method, size, gas, gas // size))
@@ -0,0 +1,107 @@
+"""
+Side-by-side cost of the two single update event encodings on eth-tester:
+`TreeUpdate` (all 160 node updates, from `authorize`) versus `CompactUpdate`
+(the compressed proof only, from `authorizeCompressed`)
+
+Reports gas and log size per update, and how fast a listener can turn the
+logs back into node updates (decode + reconstruction for `CompactUpdate`)
+
+    $ python bench/authlist_events.py [--existing 1000] [--updates 50]
+"""
+import sys
+import time
+import random
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+
+from eth_utils import to_canonical_address, to_checksum_address
+from web3 import Web3
+from web3.providers.eth_tester import EthereumTesterProvider
+from web3.utils.events import get_event_data
+
+from authlist_batch_gas import AUTHORIZED, block_gas, tester, deploy, set_batch
+from smt import SparseMerkleTree, calc_node_updates, expand_branch
+from listener import TREE_EVENTS
+
+
+def tree_update(args):
+    return list(args.nodes)
+
+
+def compact_update(args):
+    siblings = args.siblings
+    siblings = [siblings[i:i+32] for i in range(0, len(siblings), 32)]
+    branch = expand_branch(args.bitmap, siblings)
+    return calc_node_updates(to_canonical_address(args.account), args.status.to_bytes(32, 'big'), branch)
+
+
+MODES = [
+        ('TreeUpdate', 'authorize', tree_update),
+        ('CompactUpdate', 'authorizeCompressed', compact_update),
+    ]
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser("Benchmark gas and decode throughput of authlist update events")
+    ap.add_argument("--existing", type=int, default=1000,
+            help="Accounts to authorize before measuring (tree density)")
+    ap.add_argument("--updates", type=int, default=50,
+            help="Updates to measure with each encoding")
+    ap.add_argument("--repeat", type=int, default=5,
+            help="Times to decode the logs when timing")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    new_key = lambda: rng.getrandbits(160).to_bytes(20, byteorder='big')
+
+    w3 = Web3(EthereumTesterProvider(tester()))
+    authlist = deploy(w3, 'auth-list')
+    smt = SparseMerkleTree()
+
+    # Fill up the tree, so proofs look like they would in production
+    for start in range(0, args.existing, 256):
+        set_batch(w3, authlist, smt, [new_key() for _ in range(min(256, args.existing - start))])
+
+    abis = {abi['name']: (topic, abi) for topic, abi in TREE_EVENTS.items()}
+    results = []
+    for event, method, reconstruct in MODES:
+        gas = []
+        expected = []
+        from_block = w3.eth.blockNumber + 1
+        for _ in range(args.updates):
+            key = new_key()
+            if method == 'authorize':
+                fn = authlist.functions.authorize(to_checksum_address(key), smt.branch(key))
+            else:
+                bitmap, siblings = smt.compressed_branch(key)
+                fn = authlist.functions.authorizeCompressed(to_checksum_address(key), bitmap, b''.join(siblings))
+            txn_hash = fn.transact({'from':w3.eth.accounts[0], 'gas':block_gas(w3)})
+            gas.append(w3.eth.waitForTransactionReceipt(txn_hash)['gasUsed'])
+            expected.append(smt.set(key, AUTHORIZED))
+        assert authlist.functions.root().call() == smt.root_hash
+
+        topic, abi = abis[event]
+        logs = w3.eth.getLogs({
+                'address': authlist.address,
+                'fromBlock': from_block,
+                'toBlock': 'latest',
+                'topics': [topic],
+            })
+        assert len(logs) == args.updates
+        size = sum(len(Web3.toBytes(hexstr=log['data']) if isinstance(log['data'], str) else log['data'])
+                for log in logs) // len(logs)
+
+        # Both encodings must give back exactly the same node updates
+        assert [reconstruct(get_event_data(abi, log).args) for log in logs] == expected
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for log in logs:
+                reconstruct(get_event_data(abi, log).args)
+        elapsed = time.perf_counter() - start
+        results.append((event, sum(gas) // len(gas), size, args.repeat * len(logs) / elapsed))
+
+    print("{:<15} {:>10} {:>12} {:>12}".format('event', 'gas', 'log bytes', 'logs/sec'))
+    for event, gas, size, rate in results:
+        print("{:<15} {:>10} {:>12} {:>12.0f}".format(event, gas, size, rate))
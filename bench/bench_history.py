@@ -0,0 +1,48 @@
+"""
+History depth (`keep_roots`) against memory, and branch lookups at earlier roots
+"""
+import random
+
+import pytest
+
+from smt import SparseMerkleTree
+from conftest import AUTHORIZED, SEED, random_keys
+
+
+UPDATES = 1000  # Updates applied before measuring, so there is history to keep
+OPS = 100  # Lookups per benchmark round
+
+DEPTHS = [1, 4, 16, 64, 256, None]  # None keeps every root
+
+
+def db_bytes(db):
+    return sum(len(h) + len(n) for h, n in db.items())
+
+
+@pytest.mark.parametrize('keep_roots', DEPTHS, ids=lambda k: 'all' if k is None else str(k))
+def test_history(benchmark, size, keep_roots):
+    keys = random_keys(size)
+    smt = SparseMerkleTree.from_leaves(((k, AUTHORIZED) for k in keys), sort=True, keep_roots=keep_roots)
+    base_nodes, base_bytes = len(smt.db), db_bytes(smt.db)
+
+    rng = random.Random(SEED)
+    roots = [smt.root_hash]
+    for i in range(UPDATES):
+        smt.set(rng.choice(keys), (i + 2).to_bytes(32, byteorder='big'))
+        roots.append(smt.root_hash)
+    smt.prune()
+
+    benchmark.extra_info['tree_nodes'] = base_nodes
+    benchmark.extra_info['db_nodes'] = len(smt.db)
+    benchmark.extra_info['db_bytes'] = db_bytes(smt.db)
+    benchmark.extra_info['bytes_per_root'] = (db_bytes(smt.db) - base_bytes) // len(roots)
+
+    # Branches at the oldest root still kept
+    oldest = smt.at(roots[-(keep_roots or len(roots))])
+    lookups = rng.sample(keys, OPS)
+
+    def branches():
+        for key in lookups:
+            oldest.branch(key)
+
+    benchmark(branches)
@@ -0,0 +1,71 @@
+"""
+Listener replay from scratch and incremental sync against eth-tester
+"""
+import random
+
+import pytest
+from eth_utils import to_checksum_address
+from web3 import Web3
+from web3.providers.eth_tester import EthereumTesterProvider
+
+from authlist_batch_gas import block_gas, tester, deploy
+from conftest import AUTHORIZED, SEED
+from smt import SparseMerkleTree
+from listener import Listener
+
+
+SYNC_LOGS = 10  # New logs per incremental sync
+
+
+class Chain:
+    """
+    Deployed authlist with a mirror, that authorizes fresh keys on demand
+    (one `TreeUpdate` log each)
+    """
+    def __init__(self):
+        self.w3 = Web3(EthereumTesterProvider(tester()))
+        self.authlist = deploy(self.w3, 'auth-list')
+        self.smt = SparseMerkleTree()
+        self.logs = 0
+        self._rng = random.Random(SEED)
+
+    def authorize(self, n):
+        for _ in range(n):
+            key = self._rng.getrandbits(160).to_bytes(20, byteorder='big')
+            self.authlist.functions.authorize(to_checksum_address(key), self.smt.branch(key)).\
+                    transact({'from':self.w3.eth.accounts[0], 'gas':block_gas(self.w3)})
+            self.smt.set(key, AUTHORIZED)
+            self.logs += 1
+
+
+@pytest.fixture(scope='module')
+def chain(request):
+    chain = Chain()
+    chain.authorize(request.config.getoption('listener_logs'))
+    return chain
+
+
+def test_cold_replay(benchmark, peak_memory, chain):
+    accounts = chain.w3.eth.accounts[:4]
+
+    def replay():
+        listener = Listener(chain.w3, chain.authlist.address, accounts)
+        assert listener.tree.root_hash == chain.smt.root_hash
+
+    benchmark.extra_info['logs'] = chain.logs
+    benchmark.pedantic(replay, rounds=3, iterations=1)
+    peak_memory(replay)
+
+
+def test_incremental_sync(benchmark, peak_memory, chain):
+    listener = Listener(chain.w3, chain.authlist.address, chain.w3.eth.accounts[:4])
+
+    def sync():
+        listener.sync()
+        assert listener.tree.root_hash == chain.smt.root_hash
+
+    benchmark.extra_info['logs'] = SYNC_LOGS
+    # New logs arrive between every sync, only the sync itself is timed
+    benchmark.pedantic(sync, setup=lambda: chain.authorize(SYNC_LOGS), rounds=5, iterations=1)
+    chain.authorize(SYNC_LOGS)
+    peak_memory(sync)
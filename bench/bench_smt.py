@@ -0,0 +1,81 @@
+"""
+SparseMerkleTree operations at different tree sizes, and proof verification
+"""
+import random
+
+import pytest
+
+from smt import SparseMerkleTree, calc_root
+from conftest import AUTHORIZED, SEED, random_keys
+
+
+OPS = 100  # Operations per benchmark round
+
+_trees = {}
+
+
+@pytest.fixture(scope='session')
+def tree(size):
+    # Building the big trees takes a while, so share them between benchmarks
+    if size not in _trees:
+        keys = random_keys(size)
+        smt = SparseMerkleTree.from_leaves(((k, AUTHORIZED) for k in keys), sort=True)
+        _trees[size] = smt, keys
+    return _trees[size]
+
+
+@pytest.fixture
+def lookups(tree):
+    # Half of the lookups are for keys that are set, half for keys that aren't
+    smt, keys = tree
+    rng = random.Random(SEED)
+    return rng.sample(keys, OPS // 2) + random_keys(OPS // 2, seed=SEED + 1)
+
+
+def _run(fn, keys):
+    for key in keys:
+        fn(key)
+
+
+@pytest.mark.parametrize('op', ['get', 'branch', 'exists'])
+def test_lookup(benchmark, peak_memory, tree, lookups, op):
+    smt, _ = tree
+    benchmark.extra_info['tree_nodes'] = len(smt.db)
+    fn = getattr(smt, op)
+    benchmark(_run, fn, lookups)
+    peak_memory(_run, fn, lookups)
+
+
+def test_set(benchmark, peak_memory, tree, lookups):
+    smt, _ = tree
+    benchmark.extra_info['tree_nodes'] = len(smt.db)
+    # Alternate between two values, so the tree doesn't keep growing
+    values = [(2).to_bytes(32, byteorder='big'), AUTHORIZED]
+
+    def set_all():
+        values.reverse()
+        for key in lookups:
+            smt.set(key, values[0])
+
+    benchmark(set_all)
+    peak_memory(set_all)
+
+
+def test_from_leaves(benchmark, peak_memory, size):
+    keys = sorted(random_keys(size))
+    build = lambda: SparseMerkleTree.from_leaves((k, AUTHORIZED) for k in keys)
+    benchmark.pedantic(build, rounds=1, iterations=1)
+    peak_memory(build)
+
+
+def test_calc_root(benchmark, peak_memory, tree, lookups):
+    smt, _ = tree
+    proofs = [(key, smt.get(key), smt.branch(key)) for key in lookups]
+
+    def verify_all():
+        for key, value, branch in proofs:
+            assert calc_root(key, value, branch) == smt.root_hash
+
+    benchmark(verify_all)
+    peak_memory(verify_all)
+    benchmark.extra_info['proofs_per_round'] = len(proofs)
@@ -0,0 +1,53 @@
+"""
+Shared fixtures for the pytest-benchmark suite (`bench_*.py`)
+
+    $ python -m pytest bench/bench_*.py --benchmark-autosave
+    $ python -m pytest bench/bench_*.py --benchmark-compare
+
+Everything is generated from fixed seeds, so runs on different commits
+measure exactly the same work
+"""
+import random
+import tracemalloc
+
+import pytest
+
+
+SEED = 0
+AUTHORIZED = (1).to_bytes(32, byteorder='big')
+
+
+def pytest_addoption(parser):
+    parser.addoption("--smt-sizes", default="1000,100000",
+            help="Comma separated tree sizes to benchmark (e.g. 1000,100000,1000000)")
+    parser.addoption("--listener-logs", type=int, default=100,
+            help="Number of TreeUpdate logs to replay in the Listener benchmarks")
+
+
+def pytest_generate_tests(metafunc):
+    if 'size' in metafunc.fixturenames:
+        sizes = [int(s) for s in metafunc.config.getoption('smt_sizes').split(',')]
+        metafunc.parametrize('size', sizes, scope='session')
+
+
+def random_keys(n, seed=SEED):
+    rng = random.Random(seed)
+    return [rng.getrandbits(160).to_bytes(20, byteorder='big') for _ in range(n)]
+
+
+@pytest.fixture
+def peak_memory(benchmark):
+    """
+    Runs the function once more with tracemalloc, recording its peak memory
+    alongside the timings
+    """
+    def measure(fn, *args):
+        tracemalloc.start()
+        try:
+            fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory'] = peak
+        return peak
+    return measure
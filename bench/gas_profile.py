@@ -0,0 +1,246 @@
+"""
+Per-function gas profile of all the contracts on eth-tester, using scripted
+workloads (fixed seed) for each contract
+
+Prints a table of min/median/max gas per function, and can compare it
+against the committed baseline (exits non-zero if any function got more
+expensive, or isn't measured anymore)
+
+    $ python bench/gas_profile.py --check
+    $ python bench/gas_profile.py --update-baseline  # After an intended change
+
+Contracts listed in `DRAFTS` can't be profiled yet, and are reported as
+skipped. With `--contracts`, other versions of the contracts are profiled
+(functions they don't have are left out of their workloads).
+"""
+import sys
+import json
+import random
+import statistics
+from collections import defaultdict
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+
+from eth_utils import to_checksum_address
+from vyper.exceptions import ParserException
+from web3 import Web3
+from web3.providers.eth_tester import EthereumTesterProvider
+
+from authlist_batch_gas import CONTRACTS, AUTHORIZED, block_gas, tester, deploy
+from smt import SparseMerkleTree
+
+
+BASELINE = Path(__file__).resolve().parent / 'gas_baseline.json'
+# Contracts that are known not to compile, so their workload is skipped
+DRAFTS = {
+    'root-chain': "unfinished draft, doesn't compile yet",
+}
+REVIEW_PERIOD = 2592000  # 30 days, see `auth-list.vy`
+SYNC_PERIOD = 604800  # 7 days, see `root-chain.vy`
+
+
+class GasProfile:
+    """
+    Sends transactions and records the gas used, per contract function
+    """
+    def __init__(self, w3, contracts=CONTRACTS):
+        self.w3 = w3
+        self.contracts = contracts
+        self.gas = defaultdict(list)
+        self.skipped = {}  # Contract -> reason
+
+    def deploy(self, name, *args):
+        """
+        Deploys a contract, or returns None if it is a draft that can't be
+        compiled (which is recorded as skipped)
+        """
+        try:
+            return deploy(self.w3, name, *args, contracts=self.contracts)
+        except (ParserException, SyntaxError) as e:
+            if name not in DRAFTS:
+                raise
+            self.skipped[name] = DRAFTS[name]
+            print("Skipping {} ({}): {}".format(name, DRAFTS[name], e), file=sys.stderr)
+            return None
+
+    def transact(self, name, fn, sender):
+        txn_hash = fn.transact({'from':sender, 'gas':block_gas(self.w3)})
+        receipt = self.w3.eth.waitForTransactionReceipt(txn_hash)
+        assert receipt['status'] == 1, "{}.{} failed".format(name, fn.fn_name)
+        self.gas['{}.{}'.format(name, fn.fn_name)].append(receipt['gasUsed'])
+
+    def time_travel(self, seconds):
+        now = self.w3.eth.getBlock('latest')['timestamp']
+        self.w3.testing.timeTravel(now + seconds)
+        self.w3.testing.mine(1)
+
+    def table(self):
+        return dict(
+                (fn, {'calls': len(gas), 'min': min(gas),
+                    'median': int(statistics.median(gas)), 'max': max(gas)})
+                for fn, gas in sorted(self.gas.items())
+            )
+
+
+def gun_token(profile, rng):
+    w3 = profile.w3
+    authority, *users = w3.eth.accounts[:6]
+    token = profile.deploy('gun-token')
+    p = lambda fn, sender: profile.transact('gun-token', fn, sender)
+
+    owners = {}
+    for _ in range(20):
+        token_id = rng.getrandbits(160)
+        owners[token_id] = rng.choice(users)
+        p(token.functions.mint(owners[token_id], token_id), authority)
+    for _ in range(40):
+        token_id = rng.choice(sorted(owners))
+        to = rng.choice([u for u in users if u != owners[token_id]])
+        p(token.functions.safeTransferFrom(owners[token_id], to, token_id), owners[token_id])
+        owners[token_id] = to
+    for token_id in rng.sample(sorted(owners), 10):
+        p(token.functions.burn(token_id), owners.pop(token_id))
+
+    p(token.functions.nominateAuthority(users[0]), authority)
+    p(token.functions.acceptNomination(), users[0])
+
+
+def auth_list(profile, rng):
+    w3 = profile.w3
+    operator, nominee = w3.eth.accounts[:2]
+    authlist = profile.deploy('auth-list')
+    smt = SparseMerkleTree()
+    p = lambda fn: profile.transact('auth-list', fn, operator)
+
+    def update(method, key, status):
+        if method.endswith('Compressed'):
+            bitmap, siblings = smt.compressed_branch(key)
+            args = (bitmap, b''.join(siblings))
+        else:
+            args = (smt.branch(key),)
+        p(getattr(authlist.functions, method)(to_checksum_address(key), *args))
+        smt.set(key, status.to_bytes(32, byteorder='big'))
+
+    # Some accounts already on the list, so the proofs aren't all default hashes
+    for _ in range(20):
+        update('authorize', rng.getrandbits(160).to_bytes(20, byteorder='big'), 1)
+
+    # Full authorize -> review -> remove cycles
+    keys = [rng.getrandbits(160).to_bytes(20, byteorder='big') for _ in range(10)]
+    for key in keys:
+        update('authorize', key, 1)
+    for key in keys:
+        update('review', key, 2)
+    profile.time_travel(REVIEW_PERIOD + 1)
+    for key in keys:
+        update('remove', key, 3)
+
+    # Older versions of the contract (like the baseline's) lack these
+    functions = set(f['name'] for f in authlist.abi if f['type'] == 'function')
+    if 'authorizeCompressed' in functions:
+        for _ in range(10):
+            update('authorizeCompressed', rng.getrandbits(160).to_bytes(20, byteorder='big'), 1)
+    if 'setBatch' in functions:
+        for size in (1, 16, 64):
+            keys = sorted(rng.getrandbits(160).to_bytes(20, byteorder='big') for _ in range(size))
+            defaults, siblings = smt.multiproof(keys)
+            p(authlist.functions.setBatch(
+                    b''.join(k.rjust(32, b'\x00') for k in keys),
+                    [1] * 256,
+                    size,
+                    defaults,
+                    b''.join(siblings),
+                ))
+            smt.set_many((k, AUTHORIZED) for k in keys)
+    assert authlist.functions.root().call() == smt.root_hash
+
+    profile.transact('auth-list', authlist.functions.nominateOperator(nominee), operator)
+    profile.transact('auth-list', authlist.functions.acceptOperatorNominee(), nominee)
+    return authlist
+
+
+def root_chain(profile, rng, authlist):
+    w3 = profile.w3
+    chain = profile.deploy('root-chain', authlist.address)
+    if chain is None:
+        return
+    for _ in range(6):
+        root = rng.getrandbits(256).to_bytes(32, byteorder='big')
+        profile.transact('root-chain', chain.functions.addBlock(root), w3.eth.accounts[0])
+        profile.time_travel(SYNC_PERIOD)
+
+
+def operator_pool(profile, rng):
+    w3 = profile.w3
+    owner, nominee, *operators = w3.eth.accounts[:6]
+    pool = profile.deploy('operator-pool')
+    for operator in operators:
+        profile.transact('operator-pool', pool.functions.addOperator(operator), owner)
+    for operator in rng.sample(operators, 2):
+        profile.transact('operator-pool', pool.functions.remOperator(operator), owner)
+    profile.transact('operator-pool', pool.functions.nominateOwner(nominee), owner)
+    profile.transact('operator-pool', pool.functions.acceptOwnerNominee(), nominee)
+
+
+def compare(table, baseline, tolerance=0):
+    """
+    Returns the functions (and stats) that used more gas than the baseline
+    """
+    regressions = []
+    for fn, stats in table.items():
+        if fn not in baseline:
+            continue  # New function, nothing to compare against
+        for stat in ('min', 'median', 'max'):
+            if stats[stat] > baseline[fn][stat] * (1 + tolerance):
+                regressions.append((fn, stat, baseline[fn][stat], stats[stat]))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser("Profile gas per contract function")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", type=Path, help="Also write the table as JSON")
+    ap.add_argument("--baseline", type=Path, default=BASELINE)
+    ap.add_argument("--contracts", type=Path, default=CONTRACTS,
+            help="Directory of the contracts to profile")
+    ap.add_argument("--tolerance", type=float, default=0,
+            help="Allowed increase over the baseline (fraction, e.g. 0.01)")
+    group = ap.add_mutually_exclusive_group()
+    group.add_argument("--check", action='store_true',
+            help="Exit non-zero if any function uses more gas than the baseline")
+    group.add_argument("--update-baseline", action='store_true',
+            help="Store this run as the new baseline")
+    args = ap.parse_args()
+
+    # Every workload draws from its own generator, so a workload that does
+    # more on newer contracts doesn't change what the others do
+    rng = lambda name: random.Random('{}:{}'.format(args.seed, name))
+    profile = GasProfile(Web3(EthereumTesterProvider(tester())), args.contracts)
+    gun_token(profile, rng('gun-token'))
+    authlist = auth_list(profile, rng('auth-list'))
+    root_chain(profile, rng('root-chain'), authlist)
+    operator_pool(profile, rng('operator-pool'))
+
+    table = profile.table()
+    print("{:<40} {:>6} {:>10} {:>10} {:>10}".format('function', 'calls', 'min', 'median', 'max'))
+    for fn, stats in table.items():
+        print("{:<40} {calls:>6} {min:>10} {median:>10} {max:>10}".format(fn, **stats))
+    if args.output:
+        args.output.write_text(json.dumps(table, indent=2, sort_keys=True))
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(table, indent=2, sort_keys=True) + '\n')
+        print("Baseline written to {}".format(args.baseline), file=sys.stderr)
+    elif args.check:
+        if not args.baseline.exists():
+            sys.exit("No baseline at {}, create one with --update-baseline".format(args.baseline))
+        baseline = json.loads(args.baseline.read_text())
+        missing = sorted(set(baseline) - set(table))
+        if missing:
+            print("Not measured anymore: {}".format(', '.join(missing)), file=sys.stderr)
+        regressions = compare(table, baseline, args.tolerance)
+        for fn, stat, old, new in regressions:
+            print("{} {} gas went up: {} -> {} (+{})".format(fn, stat, old, new, new - old), file=sys.stderr)
+        if missing or regressions:
+            sys.exit(1)
@@ -0,0 +1,86 @@
+"""
+Load generator for the Plasma Cash block builder (`plasma.py`)
+
+Signs a period's worth of transfers up front (client work, not measured),
+then streams them encoded through `BlockBuilder` and reports how fast they
+are accepted (signature recovery, double-transfer checks, tree updates),
+how long the root and proofs take, and the headroom over the design rate of
+`root-chain.vy` (4 tps, 2,419,200 transactions per 7 day period)
+
+    $ python bench/plasma_load.py [--transactions 10000] [--duplicates 0.05]
+"""
+import sys
+import time
+import random
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+
+from eth_keys import keys
+
+from plasma import BlockBuilder, Transaction, verify
+
+
+DESIGN_TPS = 4
+PERIOD_TRANSACTIONS = 2419200
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser("Benchmark the Plasma Cash block builder")
+    ap.add_argument("--transactions", type=int, default=10000,
+            help="Distinct tokens transferred in the period")
+    ap.add_argument("--duplicates", type=float, default=0.05,
+            help="Fraction of extra transfers of already transferred tokens (rejected)")
+    ap.add_argument("--accounts", type=int, default=100)
+    ap.add_argument("--proofs", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    accounts = []
+    for _ in range(args.accounts):
+        key = rng.getrandbits(256).to_bytes(32, byteorder='big')
+        accounts.append((key, keys.PrivateKey(key).public_key.to_canonical_address()))
+
+    owners = {}
+    stream = []
+    start = time.perf_counter()
+    for _ in range(args.transactions):
+        token_id = rng.getrandbits(160).to_bytes(20, byteorder='big')
+        key, owners[token_id] = rng.choice(accounts)
+        stream.append(Transaction(token_id, rng.choice(accounts)[1], 0).sign(key).encode())
+    for token_id in rng.sample(sorted(owners), int(args.transactions * args.duplicates)):
+        key = [k for k, a in accounts if a == owners[token_id]][0]
+        stream.insert(rng.randrange(len(stream) + 1),
+                Transaction(token_id, rng.choice(accounts)[1], 0).sign(key).encode())
+    print("Signed {} transactions in {:.1f}s".format(len(stream), time.perf_counter() - start),
+            file=sys.stderr)
+
+    builder = BlockBuilder(owners=dict(owners))
+    start = time.perf_counter()
+    rejected = builder.extend(Transaction.decode(data) for data in stream)
+    accept_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    block = builder.seal()
+    seal_time = time.perf_counter() - start
+
+    # Duplicates are only rejected if they come after the first transfer
+    assert len(block.transactions) + len(rejected) == len(stream)
+
+    tokens = rng.sample(sorted(owners), min(args.proofs, len(owners)))
+    start = time.perf_counter()
+    proofs = [(token_id, block.proof(token_id)) for token_id in tokens]
+    proof_time = time.perf_counter() - start
+    assert all(verify(block.root, t, tx_hash, branch) for t, (tx_hash, branch) in proofs)
+
+    # Only the transfers that made it into the block count towards the rate
+    tps = len(block.transactions) / accept_time
+    print("{:<28} {:>12}".format('transactions', len(stream)))
+    print("{:<28} {:>12}".format('rejected', len(rejected)))
+    print("{:<28} {:>12.0f}".format('accepted tps', tps))
+    print("{:<28} {:>11.0f}x".format('headroom over 4 tps', tps / DESIGN_TPS))
+    print("{:<28} {:>12.3f}".format('seal (s)', seal_time))
+    print("{:<28} {:>12.1f}".format('proofs/sec', len(proofs) / proof_time))
+    print("{:<28} {:>12.0f}".format('full period (s, estimated)', PERIOD_TRANSACTIONS / tps))
+    print("root 0x{}".format(block.root.hex()))
@@ -0,0 +1,52 @@
+"""
+Scaling of the sharded tree build from 1 to N cores, against the serial build:
+the root only (`calc_leaves_root`), and the whole tree (`from_leaves`,
+where the workers also send back every node)
+
+Every build must give exactly the same root as the serial one
+
+    $ python bench/shard_scaling.py [--leaves 100000] [--max-workers 8]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+
+from smt import SparseMerkleTree, calc_leaves_root
+from conftest import AUTHORIZED, random_keys
+
+
+BUILDS = [
+        ('root', calc_leaves_root),
+        ('tree', lambda leaves, **kwargs: SparseMerkleTree.from_leaves(leaves, **kwargs).root_hash),
+    ]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser("Benchmark the sharded tree build against the serial one")
+    ap.add_argument("--leaves", type=int, default=100000)
+    ap.add_argument("--max-workers", type=int, default=os.cpu_count())
+    ap.add_argument("--shard-bits", type=int, default=None,
+            help="Split the keys by this many top bits (default: ~8 subtrees per worker)")
+    args = ap.parse_args()
+
+    leaves = [(key, AUTHORIZED) for key in sorted(random_keys(args.leaves))]
+    # Powers of 2, and the maximum
+    counts = sorted(set([2 ** i for i in range(args.max_workers.bit_length())] + [args.max_workers]))
+
+    print("{:<6} {:<10} {:>10} {:>10}".format('build', 'workers', 'seconds', 'speedup'))
+    for name, build in BUILDS:
+        root, serial = timed(build, leaves)
+        print("{:<6} {:<10} {:>10.2f} {:>10}".format(name, 'serial', serial, '1.00x'))
+        for workers in counts:
+            sharded_root, elapsed = timed(build, leaves, workers=workers, shard_bits=args.shard_bits)
+            assert sharded_root == root, "Sharded root differs from the serial one!"
+            print("{:<6} {:<10} {:>10.2f} {:>9.2f}x".format(name, workers, elapsed, serial / elapsed))
@@ -0,0 +1,4 @@
+"""
+Puts the repo root on the path, so the tests can import the modules at the
+top level (`smt`, `listener`...) with a plain `pytest`
+"""
@@ -9,6 +9,26 @@ TreeUpdate: event({
         nodes: bytes32[160]  # Hash updates for account as key (len 160 bits)
     })
 
+# Slim version of `TreeUpdate` used by the compressed updates: only the compressed proof
+# the update was validated against, listeners recompute the node updates themselves
+# (see `_setCompressed` for the format)
+CompactUpdate: event({
+        account: indexed(address),
+        status: indexed(uint256),
+        bitmap: uint256,
+        siblings: bytes[5120]
+    })
+
+# Events for batch updates, one per account and then the new root
+# (listeners recompute the node updates for these themselves)
+StatusUpdate: event({
+        account: indexed(address),
+        status: indexed(uint256)
+    })
+BatchRoot: event({
+        root: bytes32
+    })
+
 
 # Operator
 operator: public(address)
@@ -131,3 +151,193 @@ def remove(_account: address, _proof: bytes32[160]):
     assert self.status[_account] == 2
     assert block.timestamp > self.review_started[_account] + 2592000
     self._set(_account, 3, _proof)
+
+
+# Same as `authorize`, with a compressed proof
+# _bitmap: bit (159-lvl) is set if the sibling at `lvl` is a default (empty subtree) hash
+#          (same bit order as the keypath, MSB:root->LSB:leaf)
+# _siblings: all non-default siblings packed in root->leaf order (32 bytes each)
+#            A default hash may also be sent as a sibling with its bit clear: the
+#            proof is the same, and the listener expands it the same way
+# NOTE: Merklizes in place rather than expanding the proof for `_set` (or sharing a
+#       private function with `review`/`remove` versions): private calls copy every
+#       argument and local one word at a time, which costs several KB of bytecode
+#       per call site here, and the contract must stay under the EIP-170 size limit
+@public
+def authorizeCompressed(_account: address, _bitmap: uint256, _siblings: bytes[5120]):
+    assert msg.sender == self.operator
+    self.review_started[_account] = 0  # Just reset back to zero to recover gas from review
+
+    node_hash: bytes32 = keccak256(convert(self.status[_account], bytes32))
+    node_update: bytes32 = keccak256(convert(1, bytes32))
+    sibling: bytes32
+
+    # Siblings are packed root->leaf, but we merklize leaf->root,
+    # so unpack from the end of the list (whole siblings only)
+    assert len(_siblings) % 32 == 0
+    j: int128 = len(_siblings) / 32
+    empty_node: bytes32 = keccak256(convert(0, bytes32))  # Default status
+    for i in range(160):
+        if bitwise_and(_bitmap, shift(1, i)) > 0:
+            sibling = empty_node
+        else:
+            j -= 1
+            sibling = extract32(_siblings, j * 32)
+        empty_node = keccak256(concat(empty_node, empty_node))
+
+        # Same traversal as `_set` (leaf is bit0 and root is bit159)
+        if bitwise_and(convert(_account, uint256), shift(1, i)) > 0:
+            node_hash = keccak256(concat(sibling, node_hash))
+            node_update = keccak256(concat(sibling, node_update))
+        else:
+            node_hash = keccak256(concat(node_hash, sibling))
+            node_update = keccak256(concat(node_update, sibling))
+
+    # Every packed sibling must be used by the bitmap
+    assert j == 0
+    assert self.root == node_hash
+    self.root = node_update
+
+    # Only if proof validates can we update the account's status
+    self.status[_account] = 1
+
+    # Logging the compressed proof is much cheaper than all the node updates
+    log.CompactUpdate(_account, 1, _bitmap, _siblings)
+
+
+# The operator can update up to 256 accounts at once with a single multiproof
+# Statuses follow the same rules as `authorize` (1), `review` (2) and `remove` (3)
+# _accounts: `_count` accounts, strictly increasing (sorted and unique), packed
+#            (left-padded to 32 bytes each) rather than an `address[256]`, which
+#            vyper range checks in full on every call with unrolled code (~5KB)
+# _defaults: one bit per sibling needed (MSB-first), set if it is a default hash
+#            Siblings are needed level by level (leaf->root), in account order
+#            within a level, except where both children are being updated
+# _proof: all non-default siblings packed in the order they are needed (32 bytes each)
+@public
+def setBatch(
+        _accounts: bytes[8192],
+        _statuses: uint256[256],
+        _count: int128,
+        _defaults: bytes[5120],
+        _proof: bytes[98304]
+    ):
+    assert msg.sender == self.operator
+    assert _count > 0
+    assert _count <= 256
+    assert len(_accounts) == _count * 32
+
+    # Nodes being updated at the current level (identified by their path prefix)
+    # with their hashes before and after the update
+    prefixes: uint256[256]
+    old_nodes: bytes32[256]
+    new_nodes: bytes32[256]
+    account: address
+
+    # Start at the leaves
+    for i in range(256):
+        if i >= _count:
+            break
+        account = extract32(_accounts, i * 32, type=address)
+        prefixes[i] = convert(account, uint256)
+        if i > 0:
+            assert prefixes[i] > prefixes[i-1]
+
+        if _statuses[i] == 1:
+            self.review_started[account] = 0  # Just reset back to zero to recover gas from review
+        elif _statuses[i] == 2:
+            assert self.status[account] == 1
+            self.review_started[account] = block.timestamp
+        else:
+            assert _statuses[i] == 3
+            assert self.status[account] == 2
+            assert block.timestamp > self.review_started[account] + 2592000
+
+        old_nodes[i] = keccak256(convert(self.status[account], bytes32))
+        new_nodes[i] = keccak256(convert(_statuses[i], bytes32))
+
+    count: int128 = _count
+    empty_node: bytes32 = keccak256(convert(0, bytes32))  # Default status
+    bit: int128 = 0  # Next bit in _defaults
+    word: uint256 = 0  # Word of _defaults that `bit` is in
+    sibling: int128 = 0  # Next sibling in _proof
+    j: int128
+    skip: bool
+    paired: bool
+    sibling_node: bytes32
+    left_old: bytes32
+    right_old: bytes32
+    left_new: bytes32
+    right_new: bytes32
+
+    # Merklize all the updated nodes up to the root, one level at a time
+    for lvl in range(160):
+        j = 0  # Nodes at the next level up (written in place)
+        skip = False
+        for k in range(256):
+            if k >= count:
+                break
+            if skip:
+                # Already merged with its sibling
+                skip = False
+                continue
+
+            # Is the sibling being updated too? (then it is next in the list)
+            paired = False
+            if bitwise_and(prefixes[k], 1) == 0:
+                if k + 1 < count:
+                    if prefixes[k+1] == prefixes[k] + 1:
+                        paired = True
+
+            if paired:
+                left_old = old_nodes[k]
+                left_new = new_nodes[k]
+                right_old = old_nodes[k+1]
+                right_new = new_nodes[k+1]
+                skip = True
+            else:
+                if bit % 256 == 0:
+                    word = convert(extract32(_defaults, (bit / 256) * 32), uint256)
+                if bitwise_and(word, shift(1, 255 - bit % 256)) > 0:
+                    sibling_node = empty_node
+                else:
+                    sibling_node = extract32(_proof, sibling * 32)
+                    sibling += 1
+                bit += 1
+
+                if bitwise_and(prefixes[k], 1) > 0:
+                    # Path goes to the right, so sibling is to our left
+                    left_old = sibling_node
+                    left_new = sibling_node
+                    right_old = old_nodes[k]
+                    right_new = new_nodes[k]
+                else:
+                    # Path goes to the left, so sibling is to our right
+                    left_old = old_nodes[k]
+                    left_new = new_nodes[k]
+                    right_old = sibling_node
+                    right_new = sibling_node
+
+            prefixes[j] = shift(prefixes[k], -1)
+            old_nodes[j] = keccak256(concat(left_old, right_old))
+            new_nodes[j] = keccak256(concat(left_new, right_new))
+            j += 1
+
+        count = j
+        empty_node = keccak256(concat(empty_node, empty_node))
+
+    # Every sibling in the proof must be used, and it must validate
+    assert sibling * 32 == len(_proof)
+    assert old_nodes[0] == self.root
+    self.root = new_nodes[0]
+
+    # Only if proof validates can we update the accounts' statuses
+    for m in range(256):
+        if m >= _count:
+            break
+        account = extract32(_accounts, m * 32, type=address)
+        self.status[account] = _statuses[m]
+        log.StatusUpdate(account, _statuses[m])
+
+    # Make sure we emit the new root for anyone listening along to validate against
+    log.BatchRoot(self.root)
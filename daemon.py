@@ -1,144 +1,6 @@
 from pathlib import Path
-import IPython
-from web3.auto.infura.ropsten import w3
-from eth_utils import keccak, to_int
-
-
-class ValidationError(Exception):
-    pass
-
-
-TREE_HEIGHT=160
-EMPTY_VALUE=b'\x00' * 32
-# keccak(EMPTY_VALUE)
-EMPTY_LEAF_NODE_HASH = b')\r\xec\xd9T\x8bb\xa8\xd6\x03E\xa9\x888o\xc8K\xa6\xbc\x95H@\x08\xf66/\x93\x16\x0e\xf3\xe5c'
-
-
-# sanity check
-assert EMPTY_LEAF_NODE_HASH == keccak(EMPTY_VALUE)
-EMPTY_NODE_HASHES = [EMPTY_LEAF_NODE_HASH]
-
-
-hash_duplicate = lambda h: keccak(h + h)
-# Branch for any value in an empty tree in root->leaf order
-for _ in range(TREE_HEIGHT-1):
-    EMPTY_NODE_HASHES.insert(0, hash_duplicate(EMPTY_NODE_HASHES[0]))
-
-
-def validate_is_bytes(value):
-    if not isinstance(value, bytes):
-        raise ValidationError("Value is not of type `bytes`: got '{0}'".format(type(value)))
-
-
-def validate_length(value, length):
-    if len(value) != length:
-        raise ValidationError("Value is of length {0}.  Must be {1}".format(len(value), length))
-
-
-class SparseMerkleTree:
-    def __init__(self, db={}):
-        self.db = db
-        # Initialize an empty tree with one branch
-        self.root_hash = hash_duplicate(EMPTY_NODE_HASHES[0])
-        self.db[self.root_hash] = EMPTY_NODE_HASHES[0] + EMPTY_NODE_HASHES[0]
-        for i in range(TREE_HEIGHT - 1):
-            self.db[EMPTY_NODE_HASHES[i]] = EMPTY_NODE_HASHES[i+1] + EMPTY_NODE_HASHES[i+1]
-        self.db[EMPTY_LEAF_NODE_HASH] = EMPTY_VALUE
-
-    def get(self, key):
-        value, _ = self._get(key)
-        return value
-    
-    def branch(self, key):
-        _, branch = self._get(key)
-        return branch
-
-    def _get(self, key):
-        """
-        Returns db value and branch in root->leaf order
-        """
-        validate_is_bytes(key)
-        validate_length(key, 20)
-        branch = []
-
-        target_bit = 1 << (TREE_HEIGHT - 1)
-        path = to_int(key)
-        node_hash = self.root_hash
-        # Append the sibling to the branch
-        # Iterate on the parent
-        for i in range(TREE_HEIGHT):
-            if path & target_bit:
-                branch.append(self.db[node_hash][:32])
-                node_hash = self.db[node_hash][32:]
-            else:
-                branch.append(self.db[node_hash][32:])
-                node_hash = self.db[node_hash][:32]
-            target_bit >>= 1
-
-        return self.db[node_hash], branch
-
-    def set(self, key, value):
-        """
-        Returns all updated hashes in root->leaf order
-        """
-        validate_is_bytes(key)
-        validate_length(key, 20)
-        validate_is_bytes(value)
-
-        path = to_int(key)
-        branch = self.branch(key)
-        node = value
-        proof_update = []
-
-        target_bit = 1
-        # branch is in root->leaf order, so flip
-        for sibling in reversed(branch):
-            # Set
-            node_hash = keccak(node)
-            proof_update.append(node_hash)
-            self.db[node_hash] = node
-
-            # Update
-            if (path & target_bit):
-                node = sibling + node_hash
-            else:
-                node = node_hash + sibling
-
-            target_bit <<= 1
-
-        self.root_hash = keccak(node)
-        self.db[self.root_hash] = node
-        # updates need to be in root->leaf order, so flip back
-        return list(reversed(proof_update))
-
-    def exists(self, key):
-        validate_is_bytes(key)
-        validate_length(key, 20)
-        return (self.get(key) != EMPTY_VALUE)
-
-    def delete(self, key):
-        """
-        Equals to setting the value to None
-        """
-        validate_is_bytes(key)
-        validate_length(key, 20)
-
-        self.set(key, EMPTY_VALUE)
-
-    #
-    # Dictionary API
-    #
-    def __getitem__(self, key):
-        return self.get(key)
-
-    def __setitem__(self, key, value):
-        return self.set(key, value)
-
-    def __delitem__(self, key):
-        return self.delete(key)
-
-    def __contains__(self, key):
-        return self.exists(key)
+# NOTE: web3 and IPython are slow to import, so they are only loaded for the modes that use them
+from smt import SparseMerkleTree, SqliteDB
 
 
 def _keyfile_middleware(keyfile_path):
@@ -178,7 +40,311 @@ def _loader(name, w3, contract_interface):
         
 
 
-def console(interfaces):
+class BranchService:
+    """
+    Serves branches, statuses and the root of a Listener's mirrored tree
+    over local HTTP, following new updates in the background:
+
+        GET /root
+        GET /branch/<account>             (?compressed for bitmap + siblings)
+        GET /status/<account>
+        GET /branch/<account>?root=0x...  (also /status, at an earlier root)
+        GET /stats                        (size of the mirror and pruning)
+
+    Responses are cached until the root changes
+    """
+    def __init__(self, listener):
+        self.listener = listener
+        self._cache = {}
+        self._cache_root = None
+
+    def _read(self, lookup, root_hash=None):
+        # Lookups race with `sync` running in another thread, so retry if the
+        # root moved while reading (nodes of the old root may even be pruned)
+        tree = self.listener.tree
+        if root_hash is not None:
+            return root_hash, lookup(tree.at(root_hash))
+        while True:
+            root_hash = tree.root_hash
+            try:
+                result = lookup(tree)
+            except KeyError:
+                if tree.root_hash == root_hash:
+                    raise
+                continue
+            if tree.root_hash == root_hash:
+                return root_hash, result
+
+    def _route(self, path):
+        from urllib.parse import parse_qs
+        from eth_utils import decode_hex, to_canonical_address, to_checksum_address
+        route, _, query = path.partition('?')
+        query = parse_qs(query, keep_blank_values=True)
+        parts = route.strip('/').split('/')
+
+        if parts == ['root']:
+            root_hash, _ = self._read(lambda tree: None)
+            return 200, {'root': '0x' + root_hash.hex()}
+
+        if parts == ['stats']:
+            tree = self.listener.tree
+            return 200, {
+                    'root': '0x' + tree.root_hash.hex(),
+                    'nodes': len(tree.db),
+                    'pruned_nodes': tree.pruned_nodes,
+                    'prunable_nodes': tree.prunable_nodes,
+                    'reclaimed_bytes': tree.reclaimed_bytes,
+                }
+
+        if len(parts) != 2 or parts[0] not in ('branch', 'status'):
+            return 404, {'error': 'Not found'}
+
+        try:
+            key = to_canonical_address(parts[1])
+        except ValueError:
+            return 400, {'error': "Invalid account '{}'".format(parts[1])}
+
+        root_hash = None
+        if 'root' in query:
+            try:
+                root_hash = decode_hex(query['root'][0])
+            except ValueError:
+                root_hash = b''
+            if len(root_hash) != 32:
+                return 400, {'error': "Invalid root '{}'".format(query['root'][0])}
+
+        response = {'account': to_checksum_address(key)}
+        try:
+            if parts[0] == 'status':
+                root_hash, value = self._read(lambda tree: tree.get(key), root_hash)
+                response['status'] = int.from_bytes(value, byteorder='big')
+            elif 'compressed' in query:
+                root_hash, (bitmap, siblings) = self._read(lambda tree: tree.compressed_branch(key), root_hash)
+                response['bitmap'] = '0x' + bitmap.to_bytes(20, byteorder='big').hex()
+                response['siblings'] = ['0x' + node.hex() for node in siblings]
+            else:
+                root_hash, branch = self._read(lambda tree: tree.branch(key), root_hash)
+                response['branch'] = ['0x' + node.hex() for node in branch]
+        except KeyError:
+            if root_hash is None:
+                raise
+            # The earlier root was pruned, or never seen
+            return 404, {'error': "Unknown root '0x{}'".format(root_hash.hex())}
+        response['root'] = '0x' + root_hash.hex()
+        return 200, response
+
+    def respond(self, path):
+        """
+        Returns the full HTTP response for a GET of `path`
+        """
+        import json
+        root_hash = self.listener.tree.root_hash
+        if root_hash != self._cache_root:
+            self._cache = {}
+            self._cache_root = root_hash
+        if path in self._cache:
+            return self._cache[path]
+
+        code, body = self._route(path)
+        body = json.dumps(body).encode()
+        response = (
+                "HTTP/1.1 {} {}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "\r\n"
+            ).format(code, {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}[code], len(body))
+        response = response.encode() + body
+        # Only cache if the answer is for the root we cached against
+        if code == 200 and self.listener.tree.root_hash == root_hash:
+            self._cache[path] = response
+        return response
+
+    async def _handle(self, reader, writer):
+        try:
+            # Connections are kept alive for as many requests as the client sends
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                # Headers are not needed
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                method, path, _ = request.decode('latin-1').split(' ', 2)
+                if method != 'GET':
+                    writer.write(b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    writer.write(self.respond(path))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _follow(self, poll_interval):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                # Fetching logs blocks, so keep it off the event loop
+                await loop.run_in_executor(None, self.listener.sync)
+            except Exception as e:
+                # Keep serving the last good state, and try again next time
+                print("Sync failed: {}".format(e))
+
+    def serve(self, host='127.0.0.1', port=8080, poll_interval=15):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(self._handle, host, port))
+        print("Serving branches on http://{}:{}".format(host, port))
+        loop.create_task(self._follow(poll_interval))
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+
+class OperatorService:
+    """
+    Runs operator commands in one warm process: the key is decrypted once,
+    the node connection is reused (web3's HTTP provider keeps its session
+    alive), and contract objects and authlist mirrors are kept between commands
+
+    Commands are one per line, with one JSON reply per line:
+
+        deploy <contract> [args...]
+        mint <token> <token id> <recipient>
+        authorize <authlist> <account> [compressed]
+        root <authlist>
+        status <authlist> <account>
+    """
+    COMMANDS = ('deploy', 'mint', 'authorize', 'root', 'status')
+
+    def __init__(self, w3, interfaces, account):
+        import threading
+        self._w3 = w3
+        self._interfaces = interfaces
+        self.account = account
+        self._contracts = {}
+        self._listeners = {}
+        # Commands from different clients run one at a time (nonces, mirrors)
+        self._lock = threading.Lock()
+
+    def _contract(self, name, address):
+        if (name, address) not in self._contracts:
+            self._contracts[(name, address)] = self._w3.eth.contract(address, **self._interfaces[name])
+        return self._contracts[(name, address)]
+
+    def _listener(self, address):
+        if address not in self._listeners:
+            from listener import Listener
+            self._listeners[address] = Listener(self._w3, address)
+        else:
+            self._listeners[address].sync()
+        return self._listeners[address]
+
+    def _transact(self, fn):
+        txn_hash = fn.transact({'from':self.account.address})
+        receipt = self._w3.eth.waitForTransactionReceipt(txn_hash)
+        if receipt.status != 1:
+            raise ValueError("Transaction {} failed".format(txn_hash.hex()))
+        return receipt
+
+    def deploy(self, name, *args):
+        receipt = self._transact(self._w3.eth.contract(**self._interfaces[name]).constructor(*args))
+        return receipt.contractAddress
+
+    def mint(self, address, token_id, recipient):
+        token = self._contract('gun-token', address)
+        return self._transact(token.functions.mint(recipient, int(token_id, 0))).transactionHash.hex()
+
+    def authorize(self, address, account, compressed=None):
+        from eth_utils import to_canonical_address
+        authlist = self._contract('auth-list', address)
+        listener = self._listener(address)
+        assert listener.updated, "Mirror is behind the contract!"
+        key = to_canonical_address(account)
+        if compressed == 'compressed':
+            bitmap, siblings = listener.tree.compressed_branch(key)
+            fn = authlist.functions.authorizeCompressed(account, bitmap, b''.join(siblings))
+        elif compressed is None:
+            fn = authlist.functions.authorize(account, listener.tree.branch(key))
+        else:
+            raise ValueError("Unknown option '{}'".format(compressed))
+        return self._transact(fn).transactionHash.hex()
+
+    def root(self, address):
+        return '0x' + self._contract('auth-list', address).functions.root().call().hex()
+
+    def status(self, address, account):
+        return self._contract('auth-list', address).functions.status(account).call()
+
+    def execute(self, line):
+        """
+        Runs one command line, returning the reply (None for blank lines)
+        """
+        parts = line.split()
+        if not parts:
+            return None
+        command, args = parts[0], parts[1:]
+        if command not in self.COMMANDS:
+            return {'error': "Unknown command '{}'".format(command)}
+        try:
+            with self._lock:
+                return {'result': getattr(self, command)(*args)}
+        except Exception as e:
+            return {'error': "{}: {}".format(type(e).__name__, e)}
+
+    def run(self, lines, out):
+        """
+        Replies to every command in `lines` (e.g. stdin) on `out`
+        """
+        import json
+        for line in lines:
+            reply = self.execute(line)
+            if reply is not None:
+                out.write(json.dumps(reply) + '\n')
+                out.flush()
+
+    async def _handle(self, reader, writer):
+        import asyncio
+        import json
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # Commands block on the node, so keep them off the event loop
+                reply = await loop.run_in_executor(None, self.execute, line.decode())
+                if reply is not None:
+                    writer.write(json.dumps(reply).encode() + b'\n')
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def serve(self, path):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_unix_server(self._handle, path))
+        print("Taking operator commands on {}".format(path))
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+
+def console(interfaces, db_path=None):
+    import IPython
+    from web3.auto.infura.ropsten import w3
     dev, _middleware = _keyfile_middleware(Path.home() / '.eth-dev.key')
     w3.middleware_stack.add(_middleware)
 
@@ -195,7 +361,7 @@ def console(interfaces):
                 'deploy': deployers,
                 'load': loaders,
                 'dev': dev,
-                'smt': SparseMerkleTree()
+                'smt': SparseMerkleTree(None if db_path is None else SqliteDB(db_path))
             },
             banner1="""
 Available contracts:
@@ -211,9 +377,53 @@ if __name__ == '__main__':
     ap = argparse.ArgumentParser(description="""
 Daemon to work with web3py and interact with contracts, including deployment.
     """)
-    ap.add_argument('contracts', help='Contract assets file (JSON)')
+    ap.add_argument('contracts', nargs='?', help='Contract assets file (JSON)')
+    ap.add_argument('--db', default=None, help='File to persist the SMT in (SQLite)')
+    ap.add_argument('--serve', metavar='AUTHLIST', default=None,
+            help='Serve branches for the authlist at this address instead of the console')
+    ap.add_argument('--network', default='ropsten', choices=['ropsten', 'kovan', 'mainnet'],
+            help='Network to connect to (with --serve or --operator)')
+    ap.add_argument('--port', type=int, default=8080, help='Port to serve on (with --serve)')
+    ap.add_argument('--checkpoint', default=None,
+            help='File to keep the mirror in and resume the listener from (SQLite, with --serve)')
+    # The root chain's checkpoint window (28 days of ~15s blocks)
+    ap.add_argument('--keep-blocks', type=int, default=161280,
+            help='Keep branches for every root the authlist had in this many blocks (with --serve)')
+    ap.add_argument('--confirmations', type=int, default=6,
+            help='Blocks to stay behind the chain head, so short re-orgs are not served (with --serve)')
+    ap.add_argument('--operator', action='store_true',
+            help='Take operator commands (deploy, mint, authorize...) instead of the console')
+    ap.add_argument('--socket', default=None,
+            help='Unix socket to take operator commands on (with --operator, default stdin)')
     args = ap.parse_args()
-    with open(args.contracts, 'r') as f:
-        interfaces = json.loads(f.read())['contracts']
 
-    console(interfaces)()
+    if args.serve:
+        import importlib
+        from listener import Listener
+        w3 = importlib.import_module("web3.auto.infura."+args.network).w3
+        listener = Listener(w3, args.serve, checkpoint=args.checkpoint, keep_blocks=args.keep_blocks,
+                confirmations=args.confirmations)
+        print(listener.backfill.report())
+        BranchService(listener).serve(port=args.port)
+    elif args.operator:
+        import sys
+        import importlib
+        if args.contracts is None:
+            ap.error("Contract assets file is required for operator commands")
+        with open(args.contracts, 'r') as f:
+            interfaces = json.loads(f.read())['contracts']
+        w3 = importlib.import_module("web3.auto.infura."+args.network).w3
+        dev, _middleware = _keyfile_middleware(Path.home() / '.eth-dev.key')
+        w3.middleware_stack.add(_middleware)
+        operator = OperatorService(w3, interfaces, dev)
+        if args.socket:
+            operator.serve(args.socket)
+        else:
+            operator.run(sys.stdin, sys.stdout)
+    else:
+        if args.contracts is None:
+            ap.error("Contract assets file is required for the console")
+        with open(args.contracts, 'r') as f:
+            interfaces = json.loads(f.read())['contracts']
+
+        console(interfaces, db_path=args.db)()
@@ -33,6 +33,8 @@ ap.add_argument("account", type=str, \
         help="Account address to authorize")
 ap.add_argument("branch", type=str, nargs='*', \
         help="List of hashes in Merkle Branch Proof")
+ap.add_argument("--compressed", action="store_true", \
+        help="Branch is compressed (bitmap, then non-default hashes)")
 
 args = ap.parse_args()
 
@@ -48,6 +50,7 @@ assert authlist.functions.status(args.account).call() == 0, "Account onboarded p
 
 from eth_utils import (
         to_bytes,
+        to_int,
         to_canonical_address,
     )
 
@@ -57,14 +60,25 @@ def int_to_bytes32(value: int) -> bytes:
 
 branch = [to_bytes(hexstr=n) for n in args.branch]
 
-from trie.smt import calc_root
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+from smt import calc_root, expand_branch
+
+if args.compressed:
+    bitmap, siblings = to_int(branch[0]), branch[1:]
+    branch = expand_branch(bitmap, siblings)
+
 assert calc_root(to_canonical_address(args.account), int_to_bytes32(0), branch) == authlist.functions.root().call(), \
         "Do not have up-to-date branch to perform operation!"
 
 import click
 if click.confirm("Do you want to authorize '{}'?".format(args.account), err=True):
-    txn_hash = authlist.functions.authorize(args.account, branch).\
-            transact({'from':dev.address})
+    if args.compressed:
+        txn_hash = authlist.functions.authorizeCompressed(args.account, bitmap, b''.join(siblings)).\
+                transact({'from':dev.address})
+    else:
+        txn_hash = authlist.functions.authorize(args.account, branch).\
+                transact({'from':dev.address})
     click.echo("https://"+("" if args.network is "mainnet" else args.network+".")+\
             "etherscan.io/tx/"+txn_hash.hex(), err=True)
     receipt = w3.eth.waitForTransactionReceipt(txn_hash)
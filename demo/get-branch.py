@@ -1,105 +1,9 @@
-from eth_typing import (
-        Address,
-    )
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
 
-from eth_utils import (
-        keccak,
-        to_bytes,
-        to_int,
-        to_canonical_address,
-    )
-
-from trie.smt import SparseMerkleProof
-
-from web3 import Web3
-
-
-def int_to_bytes32(value: int) -> bytes:
-    v = to_bytes(value).rjust(32, b'\x00')
-    return v
-
-
-EMPTY_NODE_HASHES = []
-node = keccak(int_to_bytes32(0))
-for _ in range(160):  # Tree depth
-    EMPTY_NODE_HASHES.insert(0, node)
-    node = keccak(EMPTY_NODE_HASHES[0] + EMPTY_NODE_HASHES[0])
-
-authlist_abi = [
-        {
-            'name': 'TreeUpdate',
-            'inputs': [
-                {'type': 'address', 'name': 'account', 'indexed': True},
-                {'type': 'uint256', 'name': 'status', 'indexed': True},
-                {'type': 'bytes32[160]', 'name': 'nodes', 'indexed': False}
-            ],
-            'anonymous': False,
-            'type': 'event',
-        },{
-            'name': 'status',
-            'outputs': [{'type': 'uint256', 'name': 'out'}],
-            'inputs': [{'type': 'address', 'name': 'arg0'}],
-            'constant': True,
-            'payable': False,
-            'type': 'function',
-        },{
-            'name': 'root',
-            'outputs': [{'type': 'bytes32', 'name': 'out'}],
-            'inputs': [],
-            'constant': True,
-            'payable': False,
-            'type': 'function'
-        }
-    ]
-
-
-class Listener:
-    """
-    The Listener listens for updates and synchronizes their
-    proof and value accordingly
-    """
-    def __init__(self, w3: Web3, acct: Address, tree_address: Address):
-        self._tree = w3.eth.contract(tree_address, abi=authlist_abi)
-        self.acct = acct
-        self._proof = SparseMerkleProof(
-                to_canonical_address(acct),
-                int_to_bytes32(0),
-                EMPTY_NODE_HASHES
-            )
-        self._filter = self._tree.events.TreeUpdate().createFilter(fromBlock=0)
-        # Iterate over all previously logged entries
-        for log in self._filter.get_all_entries():
-            self._proof.update(
-                    to_canonical_address(log.args.account),
-                    int_to_bytes32(log.args.status),
-                    log.args.nodes
-                )
-
-    def sync(self):
-        # Iterate over last unchecked logs, update proof for them
-        for log in self._filter.get_new_entries():
-            self._proof.update(
-                    to_canonical_address(log.args.account),
-                    int_to_bytes32(log.args.status),
-                    log.args.nodes
-                )
-
-    @property
-    def branch(self) -> list:
-        return self._proof.branch[:]  # shallow copy
-
-    @property
-    def updated(self) -> bool:
-        return self._proof.root_hash == self._tree.functions.root().call()
-
-    @property
-    def status(self) -> int:
-        self.sync()  # Validate that the value is up-to-date
-
-        # Validate that the proof is correct (and therefore matches tree)
-        status = to_int(self._proof.value)
-        assert self._tree.functions.status(self.acct).call() == status
-        return status
+from smt import compress_branch
+from listener import Listener
 
 
 import json
@@ -116,14 +20,23 @@ ap.add_argument("authlist", type=str, \
         help="Authorization list address")
 ap.add_argument("account", type=str, \
         help="Account address to get Merkle Branch Proof for")
+ap.add_argument("--compressed", action="store_true", \
+        help="Print the default-sibling bitmap, then only the non-default siblings")
+ap.add_argument("--checkpoint", type=str, default=None, \
+        help="File to keep the mirrored tree in and resume the listener from (SQLite)")
 
 args = ap.parse_args()
 
 import importlib
 w3 = importlib.import_module("web3.auto.infura."+args.network).w3
 
-listener = Listener(w3, args.account, args.authlist)
+listener = Listener(w3, args.authlist, [args.account], checkpoint=args.checkpoint)
+print(listener.backfill.report(), file=sys.stderr)
+
+branch = listener.branch(args.account)
 
-branch = listener.branch
+if args.compressed:
+    bitmap, branch = compress_branch(branch)
+    print('0x'+bitmap.to_bytes(20, byteorder='big').hex())
 
 [print('0x'+node.hex()) for node in branch]  # Print in list format
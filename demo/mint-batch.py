@@ -0,0 +1,71 @@
+import csv
+import json
+import argparse
+import click
+import importlib
+
+
+def _keyfile_account(keyfile_path):
+    with open(keyfile_path, 'r') as f:
+        keyfile = json.loads(f.read())
+
+    from sys import stderr
+    from getpass import getpass
+    password = getpass("Please Input Keyfile Password ({}): ".format(keyfile_path), stderr)
+
+    from eth_account import Account
+    privateKey = Account.decrypt(keyfile, password)
+    return Account.privateKeyToAccount(privateKey)
+
+
+if __name__ == '__main__':
+    with open('../contracts.json', 'r') as f:
+        abi = json.loads(f.read())['contracts']['gun-token']['abi']
+
+    ap = argparse.ArgumentParser("Mint a batch of tokens")
+    # NOTE Rinkeby doesn't work with web3py
+    ap.add_argument("--network",  default="ropsten", \
+            choices=["ropsten", "kovan", "mainnet"], \
+            help="Network to deploy to")
+    ap.add_argument("address", type=str, \
+            help="Token contract address")
+    ap.add_argument("tokens", type=argparse.FileType('r'), \
+            help="CSV file of token UID (256 bit integer), recipient address")
+    ap.add_argument("--results", type=str, default="mint-results.jsonl", \
+            help="File to append the result of each transaction to")
+    ap.add_argument("--gas-price", type=int, default=None, \
+            help="Gas price to start with (wei, defaults to the node's suggestion)")
+    ap.add_argument("--max-gas-price", type=int, default=None, \
+            help="Stuck transactions are re-sent with higher gas prices up to this (wei)")
+    ap.add_argument("--max-pending", type=int, default=50, \
+            help="Maximum number of transactions waiting to be mined")
+
+    args = ap.parse_args()
+    tokens = [(int(tokenid), recipient.strip()) for tokenid, recipient in csv.reader(args.tokens)]
+
+    w3 = importlib.import_module("web3.auto.infura."+args.network).w3
+
+    from pathlib import Path
+    dev = _keyfile_account(Path.home() / '.eth-dev.key')
+
+    import sys
+    sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+    from pipeline import TxPipeline
+
+    token = w3.eth.contract(args.address, abi=abi)
+    if click.confirm("Do you want to mint {} tokens?".format(len(tokens)), err=True):
+        pipeline = TxPipeline(w3, dev,
+                gas_price=args.gas_price,
+                max_gas_price=args.max_gas_price,
+                max_pending=args.max_pending,
+                results=args.results,
+            )
+        for tokenid, recipient in tokens:
+            sub = pipeline.submit(token.functions.mint(recipient, tokenid), label=tokenid)
+            click.echo("{} -> {}: {}".format(tokenid, recipient,
+                sub.hashes[0].hex() if sub.hashes else sub.error), err=True)
+        results = pipeline.wait()
+        pipeline.close()
+        failed = [r.label for r in results if not r.success]
+        print("SUCCESS!" if not failed else "FAIL! ({} of {}, see {})".format(
+                len(failed), len(results), args.results))
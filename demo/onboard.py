@@ -0,0 +1,77 @@
+import csv
+import json
+import argparse
+import click
+import importlib
+
+
+def _keyfile_account(keyfile_path):
+    with open(keyfile_path, 'r') as f:
+        keyfile = json.loads(f.read())
+
+    from sys import stderr
+    from getpass import getpass
+    password = getpass("Please Input Keyfile Password ({}): ".format(keyfile_path), stderr)
+
+    from eth_account import Account
+    privateKey = Account.decrypt(keyfile, password)
+    return Account.privateKeyToAccount(privateKey)
+
+
+if __name__ == '__main__':
+    with open('../contracts.json', 'r') as f:
+        interface = json.loads(f.read())['contracts']['auth-list']
+
+    ap = argparse.ArgumentParser("Authorize a list of accounts")
+    # NOTE Rinkeby doesn't work with web3py
+    ap.add_argument("--network",  default="ropsten", \
+            choices=["ropsten", "kovan", "mainnet"], \
+            help="Network to deploy to")
+    ap.add_argument("authlist", type=str, \
+            help="Authorization list address")
+    ap.add_argument("accounts", type=argparse.FileType('r'), \
+            help="CSV file with the account addresses to authorize (first column)")
+    ap.add_argument("--checkpoint", type=str, default="onboard.json", \
+            help="Progress file, re-run with the same one to resume")
+    ap.add_argument("--results", type=str, default="onboard-results.jsonl", \
+            help="File to append the result of each transaction to")
+    ap.add_argument("--compressed", action="store_true", \
+            help="Send compressed proofs (less calldata)")
+    ap.add_argument("--retries", type=int, default=1, \
+            help="Times to retry an account whose authorization failed")
+    ap.add_argument("--max-gas-price", type=int, default=None, \
+            help="Stuck transactions are re-sent with higher gas prices up to this (wei)")
+
+    args = ap.parse_args()
+    accounts = [row[0].strip() for row in csv.reader(args.accounts) if row]
+
+    w3 = importlib.import_module("web3.auto.infura."+args.network).w3
+
+    from pathlib import Path
+    dev = _keyfile_account(Path.home() / '.eth-dev.key')
+
+    import sys
+    sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+    from listener import Listener
+    from onboarding import Onboarding
+    from pipeline import TxPipeline
+
+    checkpoint = Path(args.checkpoint)
+    # One replay (or resume) for the whole list, instead of one per account
+    listener = Listener(w3, args.authlist, checkpoint=checkpoint.with_suffix('.listener.db'))
+    print(listener.backfill.report(), file=sys.stderr)
+
+    authlist = w3.eth.contract(address=args.authlist, **interface)
+    if click.confirm("Do you want to authorize {} accounts?".format(len(accounts)), err=True):
+        pipeline = TxPipeline(w3, dev, max_gas_price=args.max_gas_price, results=args.results)
+        onboarding = Onboarding(listener, authlist, pipeline,
+                checkpoint=checkpoint,
+                compressed=args.compressed,
+                retries=args.retries,
+            )
+        onboarding.run(accounts)
+        pipeline.close()
+        for acct, reason in onboarding.failed.items():
+            click.echo("{}: {}".format(acct, reason), err=True)
+        print("SUCCESS!" if not onboarding.failed else "FAIL! ({} of {}, see {})".format(
+                len(onboarding.failed), len(accounts), args.results))
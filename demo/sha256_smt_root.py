@@ -1,19 +1,43 @@
 from typing import Sequence
-from hashlib import sha3_256
 
-def sha256(val: bytes) -> bytes:
-    return sha3_256(val).digest()
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+
+# NOTE: This must be Keccak-256 (not hashlib's SHA3-256) to match auth-list.vy
+from hashing import keccak
 
 def calc_root(keypath: int, value: bytes, branch: Sequence[bytes]) -> bytes:
     target_bit = 1
     # traverse the path in leaf->root order
     # branch is in root->leaf order (key is in MSB to LSB order)
-    node_hash = sha256(value)
+    node_hash = keccak(value)
     for sibling_node in reversed(branch):
         if keypath & target_bit:
-            node_hash = sha256(sibling_node + node_hash)
+            node_hash = keccak(sibling_node + node_hash)
+        else:
+            node_hash = keccak(node_hash + sibling_node)
+        target_bit <<= 1
+
+    return node_hash
+
+def calc_root_compressed(keypath: int, value: bytes, bitmap: int, siblings: Sequence[bytes]) -> bytes:
+    # bit n of bitmap is set if the sibling at that height is a default hash,
+    # in which case it is computed here instead of being provided in siblings
+    # siblings are the remaining (non-default) hashes in root->leaf order
+    assert bin(bitmap).count('1') + len(siblings) == 160, "Bitmap doesn't match siblings"
+    target_bit = 1
+    # traverse the path in leaf->root order
+    node_hash = keccak(value)
+    empty_node = keccak(bytes(32))  # Default value
+    siblings = iter(reversed(siblings))
+    for _ in range(160):
+        sibling_node = empty_node if bitmap & target_bit else next(siblings)
+        if keypath & target_bit:
+            node_hash = keccak(sibling_node + node_hash)
         else:
-            node_hash = sha256(node_hash + sibling_node)
+            node_hash = keccak(node_hash + sibling_node)
+        empty_node = keccak(empty_node + empty_node)
         target_bit <<= 1
 
     return node_hash
@@ -27,8 +51,14 @@ if __name__ == '__main__':
             help="Status of account")
     ap.add_argument("branch", type=str, nargs='*', \
             help="List of hashes in Merkle Branch Proof (hex[160])")
+    ap.add_argument("--compressed", action="store_true", \
+            help="Branch is compressed (bitmap, then non-default hashes)")
     args = ap.parse_args()
     key = int(args.account, 16)
     value = args.status.to_bytes(32, byteorder='big')
     branch = [bytearray.fromhex(n[2:]) for n in args.branch]
-    print('0x'+calc_root(key, value, branch).hex())
+    if args.compressed:
+        bitmap = int.from_bytes(branch[0], byteorder='big')
+        print('0x'+calc_root_compressed(key, value, bitmap, branch[1:]).hex())
+    else:
+        print('0x'+calc_root(key, value, branch).hex())
@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Shared tooling is at the repo root
+
+from token_index import TokenIndex
+
+
+import argparse
+ap = argparse.ArgumentParser("List the tokens held by accounts")
+# NOTE Rinkeby doesn't work with web3py
+ap.add_argument("--network",  default="ropsten", \
+        choices=["ropsten", "kovan", "mainnet"], \
+        help="Network to deploy to")
+ap.add_argument("token", type=str, \
+        help="Token address")
+ap.add_argument("accounts", type=str, nargs='*', \
+        help="Account addresses to list the tokens of")
+ap.add_argument("--checkpoint", type=str, default="tokens.json", \
+        help="File to resume the index from (and save it to)")
+ap.add_argument("--reconcile", type=int, default=0, metavar="N", \
+        help="Check N random tokens and owners against the contract")
+
+args = ap.parse_args()
+
+import importlib
+w3 = importlib.import_module("web3.auto.infura."+args.network).w3
+
+index = TokenIndex(w3, args.token, checkpoint=args.checkpoint)
+print(index.backfill.report(), file=sys.stderr)
+print("{} tokens as of block {}".format(len(index), index.block_number), file=sys.stderr)
+
+for acct in args.accounts:
+    print(acct, *index.tokens_of(acct))
+
+if args.reconcile:
+    mismatches = index.reconcile(args.reconcile)
+    for fn, arg, indexed, onchain in mismatches:
+        print("{}({}): index has {}, contract has {}".format(fn, arg, indexed, onchain), file=sys.stderr)
+    sys.exit(1 if mismatches else 0)
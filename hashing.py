@@ -0,0 +1,77 @@
+"""
+Keccak-256 provider for all of the SMT code (tree, proofs and listener)
+
+The fastest backend that is installed is used, unless one is picked with
+the SMT_KECCAK_BACKEND environment variable. NOTE: `hashlib.sha3_256` is the
+standardized SHA3-256, which is *not* the Keccak-256 used by the EVM.
+"""
+import os
+
+
+def _pysha3():
+    import sha3
+    new = sha3.keccak_256
+    return lambda data: new(data).digest()
+
+
+def _pycryptodome():
+    from Crypto.Hash import keccak
+    new = keccak.new
+    return lambda data: new(data=data, digest_bits=256).digest()
+
+
+def _eth_hash():
+    # Wraps one of the above, with some overhead per call
+    from eth_hash.auto import keccak
+    return keccak
+
+
+# Fastest first
+BACKENDS = [
+        ('pysha3', _pysha3),
+        ('pycryptodome', _pycryptodome),
+        ('eth-hash', _eth_hash),
+    ]
+
+
+def _load_backend(name=None):
+    for backend, load in BACKENDS:
+        if name is not None and backend != name:
+            continue
+        try:
+            return backend, load()
+        except ImportError:
+            pass
+    raise ImportError("No Keccak-256 backend available{}".format(
+            "" if name is None else " named '{}'".format(name)
+        ))
+
+
+BACKEND, keccak = _load_backend(os.environ.get('SMT_KECCAK_BACKEND'))
+
+
+# Empty root of the auth-list.vy tree: keccak256 of the default status,
+# hashed with itself up 160 levels
+CONTRACT_EMPTY_ROOT = bytes.fromhex('29f985e9bca8963a35e283a877798aeb3542ba486714d3bfb48e0e49c06ca7cb')
+
+# Keccak-256 of the empty string (SHA3-256 gives a7ffc6f8...)
+KECCAK_EMPTY = bytes.fromhex('c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470')
+
+
+def _check_backend():
+    # The known answer catches the wrong hash function (SHA3-256), the empty
+    # root also catches a backend that is wrong for 64 byte node inputs
+    if keccak(b'') != KECCAK_EMPTY:
+        raise RuntimeError(
+                "Hash backend '{}' is not Keccak-256".format(BACKEND)
+            )
+    node = keccak(b'\x00' * 32)
+    for _ in range(160):
+        node = keccak(node + node)
+    if node != CONTRACT_EMPTY_ROOT:
+        raise RuntimeError(
+                "Keccak-256 backend '{}' does not reproduce the contract's empty root".format(BACKEND)
+            )
+
+
+_check_backend()
@@ -0,0 +1,334 @@
+from pathlib import Path
+
+from eth_typing import (
+        Address,
+    )
+
+from eth_utils import (
+        event_abi_to_log_topic,
+        to_bytes,
+        to_int,
+        to_canonical_address,
+    )
+
+from web3 import Web3
+from web3.utils.events import get_event_data
+
+from smt import (
+        EMPTY_ROOT_HASH,
+        SparseMerkleTree,
+        SparseMerkleProof,
+        SqliteDB,
+        calc_multiroot,
+        calc_node_updates,
+        expand_branch,
+    )
+from backfill import Backfill
+from reader import BatchReader
+
+
+def int_to_bytes32(value: int) -> bytes:
+    v = to_bytes(value).rjust(32, b'\x00')
+    return v
+
+
+authlist_abi = [
+        {
+            'name': 'TreeUpdate',
+            'inputs': [
+                {'type': 'address', 'name': 'account', 'indexed': True},
+                {'type': 'uint256', 'name': 'status', 'indexed': True},
+                {'type': 'bytes32[160]', 'name': 'nodes', 'indexed': False}
+            ],
+            'anonymous': False,
+            'type': 'event',
+        },{
+            'name': 'CompactUpdate',
+            'inputs': [
+                {'type': 'address', 'name': 'account', 'indexed': True},
+                {'type': 'uint256', 'name': 'status', 'indexed': True},
+                {'type': 'uint256', 'name': 'bitmap', 'indexed': False},
+                {'type': 'bytes', 'name': 'siblings', 'indexed': False}
+            ],
+            'anonymous': False,
+            'type': 'event',
+        },{
+            'name': 'StatusUpdate',
+            'inputs': [
+                {'type': 'address', 'name': 'account', 'indexed': True},
+                {'type': 'uint256', 'name': 'status', 'indexed': True},
+            ],
+            'anonymous': False,
+            'type': 'event',
+        },{
+            'name': 'BatchRoot',
+            'inputs': [
+                {'type': 'bytes32', 'name': 'root', 'indexed': False},
+            ],
+            'anonymous': False,
+            'type': 'event',
+        },{
+            'name': 'status',
+            'outputs': [{'type': 'uint256', 'name': 'out'}],
+            'inputs': [{'type': 'address', 'name': 'arg0'}],
+            'constant': True,
+            'payable': False,
+            'type': 'function',
+        },{
+            'name': 'root',
+            'outputs': [{'type': 'bytes32', 'name': 'out'}],
+            'inputs': [],
+            'constant': True,
+            'payable': False,
+            'type': 'function'
+        }
+    ]
+
+
+# Events that update the tree, by topic
+TREE_EVENTS = dict(
+        ('0x' + event_abi_to_log_topic(e).hex(), e)
+        for e in authlist_abi if e['type'] == 'event'
+    )
+
+
+def _decode(log):
+    topic = log['topics'][0]
+    topic = topic if isinstance(topic, str) else '0x' + bytes(topic).hex()
+    return get_event_data(TREE_EVENTS[topic], log)
+
+
+class Listener:
+    """
+    The Listener listens for updates and synchronizes the proof and value
+    of every tracked account accordingly
+
+    A mirror of the whole tree is kept so that accounts can be added at any
+    time. The tracked proofs are kept up to date with the node updates of
+    every sync, so they never walk the mirror again once added. The root of
+    every on-chain update is kept in the mirror (see `SparseMerkleTree.at`),
+    so branches can be served for any root the contract had
+
+    Each sync fetches the whole block range first, and replays it on an
+    overlay of the mirror (checking every update against the logged nodes
+    and roots). The mirror only moves once the whole range checked out, so a
+    failed or bad sync leaves it at the last good block. The sync stays
+    `confirmations` blocks behind the head, and replays the whole history if
+    the last synced block was re-organized away (the same way, so the
+    mirror stays at its last good state until the replay succeeds).
+
+    If a checkpoint file is given, the mirror is kept in it (see `SqliteDB`)
+    along with the last processed block, both written in one transaction
+    with every sync, and a new Listener reopens it at that block instead of
+    replaying the whole history (tracked accounts aren't saved, pass them
+    again)
+
+    Logs are fetched in parallel chunks of blocks (see `Backfill`)
+
+    With `keep_roots`, the mirror only keeps the nodes of its last few roots
+    (see `SparseMerkleTree`), so it doesn't grow with every update. With
+    `keep_blocks`, it keeps the roots the contract had in the last that many
+    blocks (of the synced ones) instead, however many updates that was
+    """
+    def __init__(self, w3: Web3, tree_address: Address, accounts: list=(),
+            checkpoint: Path=None, chunk_size: int=5000, workers: int=4,
+            keep_roots: int=None, keep_blocks: int=None, confirmations: int=0):
+        self._w3 = w3
+        self.confirmations = confirmations
+        self._tree = w3.eth.contract(tree_address, abi=authlist_abi)
+        self._db = None if checkpoint is None else SqliteDB(checkpoint)
+        self._smt = SparseMerkleTree(self._db, keep_roots=keep_roots, keep_age=keep_blocks)
+        self._proofs = {}
+        self.backfill = Backfill(
+                w3,
+                {
+                    'address': self._tree.address,
+                    'topics': [list(TREE_EVENTS.keys())],  # Any of them
+                },
+                decode=_decode,
+                chunk_size=chunk_size,
+                workers=workers,
+            )
+        # Last block that has been processed
+        self.block_number = -1
+        self.block_hash = None
+        if self._db is not None and self._db.get_meta('block_hash') is not None:
+            # Written with the mirror, so it is at the same block
+            self.block_number = int.from_bytes(self._db.get_meta('block_number'), 'big')
+            self.block_hash = self._db.get_meta('block_hash')
+        for acct in accounts:
+            self.add(acct)
+        # Iterate over all logged entries since the checkpoint
+        self.sync()
+
+    def _save(self, block_number, block_hash):
+        self._db.set_meta('block_number', block_number.to_bytes(8, 'big'))
+        self._db.set_meta('block_hash', bytes(block_hash))
+
+    def add(self, acct: Address) -> SparseMerkleProof:
+        """
+        Track the given account, catching up from the mirrored tree (O(160))
+        """
+        key = to_canonical_address(acct)
+        if key not in self._proofs:
+            self._proofs[key] = SparseMerkleProof(
+                    key,
+                    self._smt.get(key),
+                    self._smt.branch(key)
+                )
+        return self._proofs[key]
+
+    def _process(self, tree, logs) -> tuple:
+        """
+        Replays the logs on `tree` (an overlay of the mirror), checking each
+        update before applying it
+
+        Returns the root after every on-chain update and the block it was
+        made in, and the new status and node updates of every account that
+        changed (in the order they did)
+        """
+        roots = []
+        blocks = []
+        updates = []
+        batch = {}  # Batch updates waiting for their root
+        for log in logs:
+            if log.event == 'StatusUpdate':
+                batch[to_canonical_address(log.args.account)] = log.args.status
+                continue
+
+            if log.event == 'BatchRoot':
+                # The whole batch must give the logged root
+                keys = sorted(batch)
+                values = [int_to_bytes32(batch[key]) for key in keys]
+                defaults, siblings = tree.multiproof(keys)
+                assert calc_multiroot(keys, values, defaults, siblings) == log.args.root, \
+                        "Mirror doesn't match batch update!"
+                root_hash, node_updates = tree.set_many(zip(keys, values))
+                # These are the final nodes of the whole batch, so they can
+                # be applied to a proof in any order
+                updates.extend((key, batch[key], node_updates[key]) for key in keys)
+                roots.append(root_hash)
+                blocks.append(log.blockNumber)
+                batch = {}
+                continue
+
+            key = to_canonical_address(log.args.account)
+            value = int_to_bytes32(log.args.status)
+            branch = tree.branch(key)
+            if log.event == 'CompactUpdate':
+                # Mirror must agree with the proof the contract validated, which
+                # may spell out default siblings (so compare it expanded)
+                siblings = log.args.siblings
+                siblings = [siblings[i:i+32] for i in range(0, len(siblings), 32)]
+                assert expand_branch(log.args.bitmap, siblings) == branch, \
+                        "Mirror doesn't match compact update!"
+            else:
+                # Mirror must agree with the contract's update
+                assert calc_node_updates(key, value, branch) == list(log.args.nodes), \
+                        "Mirror doesn't match tree update!"
+            updates.append((key, log.args.status, tree.set(key, value)))
+            roots.append(tree.root_hash)
+            blocks.append(log.blockNumber)
+
+        # A batch is always logged in one transaction, so it can't be split
+        assert not batch, "Batch update without a root!"
+        return roots, blocks, updates
+
+    def sync(self):
+        # Chain was re-organized from under the last sync, so replay it all
+        # from the empty tree (the mirror keeps its last good state until
+        # the replay is done)
+        replay = False
+        if self.block_number >= 0:
+            block = self._w3.eth.getBlock(self.block_number)
+            replay = block is None or block['hash'] != self.block_hash
+        start = 0 if replay else self.block_number + 1
+
+        latest = self._w3.eth.blockNumber - self.confirmations
+        if latest < start:
+            return
+
+        # Fetch the whole range before touching anything
+        logs = list(self.backfill.run(start, latest))
+        overlay = self._smt.overlay(EMPTY_ROOT_HASH if replay else None)
+        roots, blocks, updates = self._process(overlay, logs)
+        block_hash = self._w3.eth.getBlock(latest)['hash']
+
+        if self._db is None:
+            self._advance(overlay, roots, blocks, updates, replay)
+        else:
+            # The block is committed with the mirror, so they always match
+            with self._db.transaction():
+                self._save(latest, block_hash)
+                self._advance(overlay, roots, blocks, updates, replay)
+        self.block_number = latest
+        self.block_hash = block_hash
+
+    def _advance(self, overlay, roots, blocks, updates, replay):
+        """
+        Moves the mirror and the tracked proofs to the synced overlay
+        """
+        if replay:
+            # Swap in the replayed tree, even if it is empty, and catch the
+            # tracked accounts up from it
+            if roots:
+                self._smt.merge(overlay, roots, blocks)
+            else:
+                self._smt.merge(overlay, [overlay.root_hash])
+            accounts = self.accounts
+            self._proofs = {}
+            for key in accounts:
+                self.add(key)
+        elif roots:
+            # Move the mirror to the final state of the range in one batch,
+            # keeping every root the contract went through
+            self._smt.merge(overlay, roots, blocks)
+            for key, status, node_updates in updates:
+                for proof in self._proofs.values():
+                    proof.update(key, int_to_bytes32(status), node_updates)
+
+    @property
+    def accounts(self) -> list:
+        return list(self._proofs.keys())
+
+    @property
+    def tree(self) -> SparseMerkleTree:
+        """
+        Mirror of the whole tree (do not modify)
+        """
+        return self._smt
+
+    def branch(self, acct: Address) -> list:
+        return self.add(acct).branch[:]  # shallow copy
+
+    @property
+    def updated(self) -> bool:
+        return self._smt.root_hash == self._tree.functions.root().call()
+
+    def audit(self, accounts: list, **kwargs) -> dict:
+        """
+        Checks the mirrored status of many accounts against the contract, as
+        of the last synced block, in batched reads (see `BatchReader`)
+
+        Returns the accounts whose status doesn't match, as (mirror, on-chain)
+        """
+        reader = BatchReader(self._w3, block_number=self.block_number, **kwargs)
+        functions = self._tree.functions
+        root_hash, *statuses = reader.call(
+                [functions.root()] + [functions.status(acct) for acct in accounts])
+        assert root_hash == self._smt.root_hash, "Mirror doesn't match root!"
+
+        mismatches = {}
+        for acct, status in zip(accounts, statuses):
+            mirrored = to_int(self._smt.get(to_canonical_address(acct)))
+            if status != mirrored:
+                mismatches[acct] = (mirrored, status)
+        return mismatches
+
+    def status(self, acct: Address) -> int:
+        self.sync()  # Validate that the value is up-to-date
+
+        # Validate that the proof is correct (and therefore matches tree)
+        status = to_int(self.add(acct).value)
+        assert self._tree.functions.status(acct).call() == status
+        return status
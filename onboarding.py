@@ -0,0 +1,175 @@
+import os
+import json
+import time
+from pathlib import Path
+
+from eth_utils import to_canonical_address, to_checksum_address
+
+from smt import EMPTY_VALUE, TREE_HEIGHT
+from listener import Listener, int_to_bytes32
+from pipeline import Submission
+
+
+AUTHORIZED = int_to_bytes32(1)
+
+# Extra gas over the estimate of the first update of a round
+GAS_HEADROOM = 1.25
+# Pre-Istanbul price of a non-zero calldata byte, for compressed proofs
+# later in a round that carry more siblings than the estimated one
+CALLDATA_GAS = 68
+
+
+class Onboarding:
+    """
+    Authorizes many accounts in one go
+
+    The proof of each account is taken from a copy of the Listener's mirror,
+    which is advanced with every planned update so the next proof is valid
+    against the root the previous update leaves behind. All the updates are
+    then submitted back-to-back through a `TxPipeline`.
+
+    The gas limit can't be estimated for each update, as the proofs depend on
+    unmined updates. Unless `gas` is given, the first update of every round
+    (which is valid against the chain) is estimated, with some headroom, and
+    used for the whole round. If that estimate fails, the round fails at
+    that account, like a failed update would.
+
+    When an update fails, the ones after it were planned on top of it and fail
+    too. So no more updates are submitted in that round once a failure is
+    seen (with at most `window` updates in flight), and the rest are planned
+    again from the chain's state in the next round. The failed account is
+    retried up to `retries` times before it is given up on. Progress is saved
+    to the checkpoint file after every round, so an interrupted run can be
+    resumed (accounts already authorized on chain are always skipped).
+    """
+    def __init__(self, listener: Listener, authlist, pipeline,
+            checkpoint: Path=None, compressed: bool=False, gas: int=None, retries: int=1,
+            window: int=16):
+        self.listener = listener
+        self._authlist = authlist
+        self._pipeline = pipeline
+        self._checkpoint = None if checkpoint is None else Path(checkpoint)
+        self.compressed = compressed
+        self.gas = gas
+        self.retries = retries
+        self.window = window
+        self.done = []
+        self.failed = {}  # Account -> reason
+        self._attempts = {}
+        if self._checkpoint is not None and self._checkpoint.exists():
+            self._load()
+
+    def _load(self):
+        with open(self._checkpoint, 'r') as f:
+            checkpoint = json.loads(f.read())
+        self.done = checkpoint['done']
+        self.failed = checkpoint['failed']
+        self._attempts = checkpoint['attempts']
+
+    def _save(self):
+        checkpoint = {
+            'done': self.done,
+            'failed': self.failed,
+            'attempts': self._attempts,
+        }
+        # Write to the side and swap in, so a crash never leaves half a file
+        tmp = self._checkpoint.with_name(self._checkpoint.name + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(checkpoint))
+        os.replace(tmp, self._checkpoint)
+
+    def _plan(self, accounts: list):
+        """
+        Yields (account, contract call) for every account that still needs
+        to be authorized, in order
+        """
+        self.listener.sync()
+        smt = self.listener.tree.overlay()
+        for acct in accounts:
+            key = to_canonical_address(acct)
+            status = smt.get(key)
+            if status == AUTHORIZED:
+                self.done.append(acct)
+                continue
+            if status != EMPTY_VALUE:
+                self.failed[acct] = "Account has status {}".format(int.from_bytes(status, 'big'))
+                continue
+
+            if self.compressed:
+                bitmap, siblings = smt.compressed_branch(key)
+                call = self._authlist.functions.authorizeCompressed(acct, bitmap, b''.join(siblings))
+            else:
+                call = self._authlist.functions.authorize(acct, smt.branch(key))
+            smt.set(key, AUTHORIZED)
+            yield acct, call
+
+    def _estimate(self, call) -> int:
+        gas = call.estimateGas({'from': self._pipeline.address})
+        if self.compressed:
+            # Later proofs in the round may have more non-default siblings
+            gas += CALLDATA_GAS * 32 * (TREE_HEIGHT - len(call.args[-1]) // 32)
+        return int(gas * GAS_HEADROOM)
+
+    def _wait_window(self, subs: list) -> bool:
+        """
+        Waits until fewer than `window` updates are in flight, returning
+        whether any update of the round has failed
+        """
+        while True:
+            self._pipeline.poll()
+            if any(sub.done and not sub.success for _, sub in subs):
+                return True
+            if len(self._pipeline.pending) < self.window:
+                return False
+            time.sleep(self._pipeline.poll_interval)
+
+    def run(self, accounts: list) -> list:
+        """
+        Authorizes all of the given accounts that aren't done or failed yet,
+        returning the ones that were authorized
+        """
+        # Without duplicates, a repeat would look authorized once planned
+        accounts = list(dict.fromkeys(to_checksum_address(acct) for acct in accounts))
+
+        def remaining():
+            finished = set(self.done).union(self.failed)
+            return [a for a in accounts if a not in finished]
+
+        todo = remaining()
+        while todo:
+            subs = []
+            gas = self.gas
+            for acct, call in self._plan(todo):
+                if gas is None:
+                    try:
+                        gas = self._estimate(call)
+                    except Exception as e:
+                        # Fails the round like a failed update, not the run
+                        sub = Submission(acct, {})
+                        sub.error = "Gas estimate failed ({})".format(e)
+                        subs.append((acct, sub))
+                        break
+                subs.append((acct, self._pipeline.submit(call, label=acct, gas=gas)))
+                if self._wait_window(subs):
+                    break  # Everything planned after a failure would fail too
+            self._pipeline.wait()
+
+            first_failure = True
+            for acct, sub in subs:  # In nonce order
+                if sub.success:
+                    self.done.append(acct)
+                elif first_failure:
+                    # Everything before it went through, so its proof was valid
+                    first_failure = False
+                    self._attempts[acct] = self._attempts.get(acct, 0) + 1
+                    if self._attempts[acct] > self.retries:
+                        self.failed[acct] = sub.error or "Transaction failed ({})".format(
+                                sub.receipt['transactionHash'].hex())
+                # Otherwise it was planned on top of a failed update, try again
+
+            if self._checkpoint is not None:
+                self._save()
+            todo = remaining()
+
+        done = set(self.done)
+        return [a for a in accounts if a in done]
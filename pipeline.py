@@ -0,0 +1,183 @@
+import json
+import time
+
+
+class Submission:
+    """
+    A transaction going through the pipeline, with every version of it that
+    was broadcast (gas price bumps re-use the nonce, so any of them can be mined)
+    """
+    def __init__(self, label, tx: dict):
+        self.label = label
+        self.tx = tx
+        self.hashes = []
+        self.sent_at = None
+        self.receipt = None
+        self.error = None
+
+    @property
+    def done(self) -> bool:
+        return self.receipt is not None or self.error is not None
+
+    @property
+    def success(self) -> bool:
+        return self.receipt is not None and self.receipt['status'] == 1
+
+    def result(self) -> dict:
+        result = {
+                'label': self.label,
+                'nonce': self.tx.get('nonce'),
+                'hashes': [h.hex() for h in self.hashes],
+                'gasPrice': self.tx.get('gasPrice'),
+            }
+        if self.receipt is not None:
+            result['transactionHash'] = self.receipt['transactionHash'].hex()
+            result['blockNumber'] = self.receipt['blockNumber']
+            result['gasUsed'] = self.receipt['gasUsed']
+            result['status'] = 'SUCCESS' if self.success else 'FAIL'
+        else:
+            result['status'] = 'ERROR'
+            result['error'] = self.error
+        return result
+
+
+class TxPipeline:
+    """
+    Sends many transactions from one account back-to-back, instead of
+    waiting for each receipt before sending the next
+
+    Nonces are assigned locally (starting from the account's pending count)
+    and transactions are signed locally and broadcast right away. Receipts
+    are checked while more transactions are submitted, with at most
+    `max_pending` in flight. A transaction that hasn't been mined after
+    `bump_after` seconds is re-sent with the same nonce and a higher gas
+    price (by `bump_factor`, up to `max_gas_price`).
+
+    The result of every transaction is appended to the `results` file
+    (JSON lines) as soon as it is known.
+    """
+    def __init__(self, w3, account, gas_price: int=None, max_pending: int=50,
+            bump_after: float=180, bump_factor: float=1.125, max_gas_price: int=None,
+            poll_interval: float=1, results=None):
+        self._w3 = w3
+        self._account = account
+        self.gas_price = gas_price
+        self.max_pending = max_pending
+        self.bump_after = bump_after
+        self.bump_factor = bump_factor
+        self.max_gas_price = max_gas_price
+        self.poll_interval = poll_interval
+        self._results = None if results is None else open(results, 'a')
+        self.nonce = w3.eth.getTransactionCount(account.address, 'pending')
+        self.pending = []
+        self.results = []
+        self.bumps = 0
+
+    @property
+    def address(self):
+        return self._account.address
+
+    def _build(self, call, gas: int=None) -> dict:
+        params = {
+                'from': self._account.address,
+                'nonce': self.nonce,
+                'gasPrice': self.gas_price or self._w3.eth.gasPrice,
+            }
+        if gas is not None:
+            params['gas'] = gas
+        if hasattr(call, 'buildTransaction'):
+            # Contract function call (or constructor)
+            return call.buildTransaction(params)
+        tx = dict(call, **params)
+        if 'gas' not in tx:
+            tx['gas'] = self._w3.eth.estimateGas(tx)
+        return tx
+
+    def _send(self, sub: Submission, tx: dict):
+        signed = self._account.signTransaction(tx)
+        sub.hashes.append(self._w3.eth.sendRawTransaction(signed.rawTransaction))
+        # Only what was broadcast is recorded
+        sub.tx = tx
+        sub.sent_at = time.time()
+
+    def _finish(self, sub: Submission):
+        self.results.append(sub)
+        if self._results is not None:
+            self._results.write(json.dumps(sub.result()) + '\n')
+            self._results.flush()
+
+    def submit(self, call, label=None, gas: int=None) -> Submission:
+        """
+        Sends a contract function call (or a transaction dict) without
+        waiting for it to be mined
+        """
+        while len(self.pending) >= self.max_pending:
+            self.poll()
+            if len(self.pending) >= self.max_pending:
+                time.sleep(self.poll_interval)
+
+        sub = Submission(label, {})
+        try:
+            sub.tx = self._build(call, gas=gas)
+            self._send(sub, sub.tx)
+        except Exception as e:
+            # Nothing was broadcast, so the nonce is still free
+            sub.error = str(e)
+            self._finish(sub)
+            return sub
+
+        self.nonce += 1
+        self.pending.append(sub)
+        return sub
+
+    def _bump(self, sub: Submission):
+        gas_price = int(sub.tx['gasPrice'] * self.bump_factor) + 1
+        if self.max_gas_price is not None:
+            gas_price = min(gas_price, self.max_gas_price)
+        if gas_price <= sub.tx['gasPrice']:
+            return  # Already at the limit, keep waiting
+        try:
+            self._send(sub, dict(sub.tx, gasPrice=gas_price))
+            self.bumps += 1
+        except Exception:
+            # e.g. "nonce too low" if an earlier version just got mined,
+            # which the receipts will tell us about
+            sub.sent_at = time.time()
+
+    def poll(self):
+        """
+        Checks for receipts of all pending transactions, and bumps the gas
+        price of the ones that have been waiting too long
+        """
+        still_pending = []
+        for sub in self.pending:
+            for txn_hash in sub.hashes:
+                receipt = self._w3.eth.getTransactionReceipt(txn_hash)
+                if receipt is not None:
+                    sub.receipt = receipt
+                    break
+            if sub.receipt is not None:
+                self._finish(sub)
+                continue
+            if time.time() - sub.sent_at >= self.bump_after:
+                self._bump(sub)
+            still_pending.append(sub)
+        self.pending = still_pending
+
+    def wait(self, timeout: float=None) -> list:
+        """
+        Waits until every submitted transaction is mined, returning the
+        results in the order they completed
+        """
+        start = time.time()
+        self.poll()
+        while self.pending:
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError("{} transactions still pending".format(len(self.pending)))
+            time.sleep(self.poll_interval)
+            self.poll()
+        return self.results
+
+    def close(self):
+        if self._results is not None:
+            self._results.close()
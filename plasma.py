@@ -0,0 +1,189 @@
+"""
+Plasma Cash block building for `root-chain.vy`
+
+Every sync period (7 days) the operator publishes one root: a sparse Merkle
+tree of tokenId -> hash of the transaction that transferred it in that
+period. A token can only be transferred once per period, so its leaf is
+either the one transaction or empty, and every owner can get a proof of
+either from the published block.
+"""
+from eth_keys import keys
+from eth_keys.exceptions import BadSignature
+
+from hashing import keccak
+from smt import SparseMerkleTree, calc_root
+
+
+class InvalidTransaction(Exception):
+    pass
+
+
+class Transaction:
+    """
+    Transfer of a token to `new_owner`, valid only in the given sync `period`
+    (so it can't be replayed in a later one), signed by the current owner
+    """
+    def __init__(self, token_id: bytes, new_owner: bytes, period: int, signature: bytes=None):
+        if len(token_id) != 20 or len(new_owner) != 20:
+            raise InvalidTransaction("Token ids and owners are 20 bytes")
+        self.token_id = token_id
+        self.new_owner = new_owner
+        self.period = period
+        self.signature = signature
+
+    @property
+    def hash(self) -> bytes:
+        return keccak(self.token_id + self.new_owner + self.period.to_bytes(32, byteorder='big'))
+
+    def sign(self, private_key: bytes):
+        self.signature = keys.PrivateKey(private_key).sign_msg_hash(self.hash).to_bytes()
+        return self
+
+    @property
+    def sender(self) -> bytes:
+        """
+        Address that signed the transaction
+        """
+        if self.signature is None:
+            raise InvalidTransaction("Transaction is not signed")
+        try:
+            public_key = keys.Signature(self.signature).recover_public_key_from_msg_hash(self.hash)
+        except (BadSignature, ValueError) as e:
+            raise InvalidTransaction("Invalid signature: {}".format(e))
+        return public_key.to_canonical_address()
+
+    def encode(self) -> bytes:
+        return self.token_id + self.new_owner + self.period.to_bytes(32, byteorder='big') + \
+                (self.signature or b'')
+
+    @classmethod
+    def decode(cls, data: bytes):
+        if len(data) != 137:
+            raise InvalidTransaction("Encoded transactions are 137 bytes")
+        return cls(data[:20], data[20:40], int.from_bytes(data[40:72], byteorder='big'), data[72:])
+
+
+class Block:
+    """
+    A sealed sync period: the root to publish, and the transactions in it
+    """
+    def __init__(self, period: int, tree: SparseMerkleTree, transactions: dict):
+        self.period = period
+        self.tree = tree
+        self.transactions = transactions  # Token id -> transaction
+
+    @property
+    def root(self) -> bytes:
+        return self.tree.root_hash
+
+    def proof(self, token_id: bytes) -> tuple:
+        """
+        Returns (transaction hash, branch) for the token, which proves the
+        token was not transferred in this period if the hash is empty (zero)
+        """
+        return self.tree.get(token_id), self.tree.branch(token_id)
+
+
+class BlockBuilder:
+    """
+    Takes a stream of signed transfers for the current sync period, and
+    builds the tree of the ones it accepts
+
+    Transfers are rejected (`InvalidTransaction`) if they are for another
+    period, badly signed, for a token that was already transferred in this
+    period, or (if the current `owners` of the tokens are given) not signed
+    by the owner of the token. The tree is updated in batches of `batch_size`
+    accepted transfers, and once more when the period is sealed. Only the
+    nodes of the latest root are kept, the sealed block needs no history.
+    """
+    def __init__(self, period: int=0, owners: dict=None, batch_size: int=1000):
+        self.period = period
+        self.owners = owners  # Token id -> owner, updated as transfers are accepted
+        self.batch_size = batch_size
+        self._start()
+
+    def _start(self):
+        self._tree = SparseMerkleTree(keep_roots=1)
+        self._transactions = {}  # Token id -> transaction, this period
+        self._pending = []  # Accepted, not in the tree yet
+        self.rejected = 0
+
+    def add(self, tx: Transaction) -> bytes:
+        """
+        Accepts the transfer into the current period, returning its hash
+        """
+        try:
+            if tx.period != self.period:
+                raise InvalidTransaction("Transaction is for period {}, not {}".format(tx.period, self.period))
+            if tx.token_id in self._transactions:
+                raise InvalidTransaction("Token 0x{} was already transferred in period {}".format(
+                        tx.token_id.hex(), self.period))
+            sender = tx.sender
+            if self.owners is not None and self.owners.get(tx.token_id) != sender:
+                raise InvalidTransaction("Token 0x{} is not owned by 0x{}".format(
+                        tx.token_id.hex(), sender.hex()))
+        except InvalidTransaction:
+            self.rejected += 1
+            raise
+
+        if self.owners is not None:
+            self.owners[tx.token_id] = tx.new_owner
+        self._transactions[tx.token_id] = tx
+        self._pending.append(tx)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        return tx.hash
+
+    def extend(self, txs) -> list:
+        """
+        Adds every transfer from a stream, returning the ones that were
+        rejected along with the reason
+        """
+        rejected = []
+        for tx in txs:
+            try:
+                self.add(tx)
+            except InvalidTransaction as e:
+                rejected.append((tx, str(e)))
+        return rejected
+
+    def _flush(self):
+        self._tree.set_many((tx.token_id, tx.hash) for tx in self._pending)
+        self._pending = []
+
+    def __len__(self):
+        return len(self._transactions)
+
+    @property
+    def root(self) -> bytes:
+        """
+        Root of the transfers accepted so far
+        """
+        self._flush()
+        return self._tree.root_hash
+
+    def seal(self) -> Block:
+        """
+        Closes the current period, returning its block, and starts the next
+        """
+        self._flush()
+        self._tree.prune()
+        block = Block(self.period, self._tree, self._transactions)
+        self.period += 1
+        self._start()
+        return block
+
+
+def verify(root: bytes, token_id: bytes, tx_hash: bytes, branch: list) -> bool:
+    """
+    Checks a proof from `Block.proof`
+    """
+    return calc_root(token_id, tx_hash, branch) == root
+
+
+def publish(block: Block, root_chain, pipeline):
+    """
+    Submits the block's root to `root-chain.vy` through a `TxPipeline`
+    """
+    return pipeline.submit(root_chain.functions.addBlock(block.root),
+            label='period {}'.format(block.period))
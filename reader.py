@@ -0,0 +1,159 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from eth_abi import decode_abi, encode_abi
+from eth_utils import to_bytes, to_checksum_address
+
+
+# `aggregate((address,bytes)[])` of the Multicall contract deployed on most
+# networks (github.com/makerdao/multicall), returns (block number, bytes[])
+AGGREGATE_SELECTOR = bytes.fromhex('252dba42')
+
+# How nodes word the JSON-RPC error for a call that failed while executing
+REVERT_MESSAGES = ('revert', 'invalid opcode', 'bad instruction', 'vm execution error')
+
+
+def _is_revert(error) -> bool:
+    """
+    Whether an `eth_call` failed because the call itself reverted, rather than
+    because the node couldn't run it (transport errors, rate limits, "missing
+    trie node" on nodes that pruned the block's state...)
+    """
+    if type(error).__name__ == 'TransactionFailed':
+        return True  # eth-tester
+    if isinstance(error, ValueError) and error.args and isinstance(error.args[0], dict):
+        error = error.args[0]  # web3 raises the JSON-RPC error object
+    if not isinstance(error, dict):
+        return False
+    if error.get('code') == 3:
+        return True  # "execution reverted", with revert data
+    message = str(error.get('message', '')).lower()
+    return any(m in message for m in REVERT_MESSAGES)
+
+
+def _decode(fn, data: bytes):
+    """
+    Decodes the return data of a contract function call like `fn.call()` does,
+    or None if the call reverted
+    """
+    if not data:
+        return None  # Some nodes answer reverted calls with empty data
+    types = [o['type'] for o in fn.abi['outputs']]
+    values = [
+            to_checksum_address(v) if t == 'address' else v
+            for t, v in zip(types, decode_abi(types, data))
+        ]
+    return values[0] if len(values) == 1 else values
+
+
+class BatchReader:
+    """
+    Reads many contract calls (e.g. `status`, `root`, `ownerOf`), all at the
+    same block so the results are consistent with each other
+
+    Calls are split into chunks of `batch_size`, with at most `workers` chunks
+    in flight. Each chunk is one JSON-RPC batch request (one round-trip for
+    the whole chunk), or a single `eth_call` if a `multicall` contract is
+    given (falling back to a batch if any call in the chunk reverts).
+    Providers that don't talk HTTP get one `eth_call` per call instead.
+    """
+    def __init__(self, w3, block_number: int=None, batch_size: int=100, workers: int=4,
+            multicall=None, endpoint_uri: str=None):
+        self._w3 = w3
+        self.block_number = w3.eth.blockNumber if block_number is None else block_number
+        self.batch_size = batch_size
+        self._workers = workers
+        self._multicall = None if multicall is None else to_bytes(hexstr=multicall)
+        provider = w3.providers[0]
+        self._endpoint_uri = endpoint_uri or getattr(provider, 'endpoint_uri', None)
+        self._request_kwargs = getattr(provider, 'get_request_kwargs', dict)()
+        self._session = requests.Session()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        # Statistics
+        self.requests = 0
+        self.multicalls = 0
+
+    def _post(self, payload):
+        with self._lock:
+            self.requests += 1
+        response = self._session.post(self._endpoint_uri, json=payload, **self._request_kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def _eth_calls(self, calls: list) -> list:
+        """
+        Returns the return data of each (to, data) call, or None if it reverted
+
+        Any other error is raised, since it says nothing about the call.
+        """
+        if self._endpoint_uri is None:
+            results = []
+            for to, data in calls:
+                with self._lock:
+                    self.requests += 1
+                try:
+                    results.append(bytes(self._w3.eth.call(
+                            {'to': to_checksum_address(to), 'data': '0x' + data.hex()}, self.block_number)))
+                except Exception as e:
+                    if not _is_revert(e):
+                        raise
+                    results.append(None)
+            return results
+
+        with self._lock:
+            ids = [next(self._ids) for _ in calls]
+        responses = self._post([
+                {
+                    'jsonrpc': '2.0',
+                    'id': i,
+                    'method': 'eth_call',
+                    'params': [{'to': '0x' + to.hex(), 'data': '0x' + data.hex()}, hex(self.block_number)],
+                }
+                for i, (to, data) in zip(ids, calls)
+            ])
+        if isinstance(responses, dict):
+            # The whole batch was rejected (e.g. batches not supported)
+            raise ValueError(responses.get('error', responses))
+        # Responses to a batch can come back in any order
+        responses = dict((r.get('id'), r) for r in responses)
+        results = []
+        for i in ids:
+            if i not in responses:
+                raise ValueError('No response to eth_call {}'.format(i))
+            response = responses[i]
+            if 'error' in response:
+                if not _is_revert(response['error']):
+                    raise ValueError(response['error'])
+                results.append(None)
+            else:
+                results.append(to_bytes(hexstr=response['result']))
+        return results
+
+    def _read_chunk(self, fns: list) -> list:
+        calls = [(to_bytes(hexstr=fn.address), to_bytes(hexstr=fn._encode_transaction_data()))
+                for fn in fns]
+        if self._multicall is not None:
+            data = AGGREGATE_SELECTOR + encode_abi(['(address,bytes)[]'], [calls])
+            result, = self._eth_calls([(self._multicall, data)])
+            if result:
+                with self._lock:
+                    self.multicalls += 1
+                _, returned = decode_abi(['uint256', 'bytes[]'], result)
+                return [_decode(fn, data) for fn, data in zip(fns, returned)]
+        return [_decode(fn, data) for fn, data in zip(fns, self._eth_calls(calls))]
+
+    def call(self, fns: list) -> list:
+        """
+        Returns the result of each contract function call, in the same order
+        (None for calls that reverted)
+
+        Raises if the node fails to answer any call, so that a node error is
+        never mistaken for a revert.
+        """
+        fns = list(fns)
+        chunks = [fns[i:i + self.batch_size] for i in range(0, len(fns), self.batch_size)]
+        with ThreadPoolExecutor(self._workers) as pool:
+            return [r for results in pool.map(self._read_chunk, chunks) for r in results]
@@ -0,0 +1,1447 @@
+"""
+Sparse Merkle tree (keccak, 160 bit keys) matching the authlist contract,
+with its proofs and storage
+
+Only needs the Keccak provider, so it is cheap to import from workers,
+tests and tools that don't talk to a node
+"""
+from bisect import bisect_left
+from collections import ChainMap, deque
+from contextlib import contextmanager
+import sqlite3
+from hashing import keccak
+
+
+class ValidationError(Exception):
+    pass
+
+
+TREE_HEIGHT=160
+EMPTY_VALUE=b'\x00' * 32
+
+# Hash of an empty subtree at each depth (root is depth 0, leaf is TREE_HEIGHT):
+# keccak(EMPTY_VALUE) at the leaf, then keccak of the child hashed with itself.
+# Precomputed so importing doesn't have to hash, see `test_empty_subtree_hashes`.
+# These are never stored in the db, they are known implicitly
+EMPTY_SUBTREE_HASHES = [bytes.fromhex(h) for h in (
+        '29f985e9bca8963a35e283a877798aeb3542ba486714d3bfb48e0e49c06ca7cb',  # root
+        '4b529be809997a3bb9e6aac629611bfe00c51044f4cb112a8b9b4ac7eab5c19a',
+        '1af4414e2867c09a324a0b0e84a0dbd40bbf15b3efa69b52ca8ca11b340ee095',
+        '7a01c5479954635b2d676e0cf1151a204b08576d437b8600f179f38eeb3e5e22',
+        '9d8666bfb31334525d66e56a10948add1bd0dd90d73161583d8e13d8b8fbeeaf',
+        '5c9ade151a9f637f0ce3b3eb11fb0f83082fd22aa1952d0cd24ba2a73670bba7',
+        '07fb644c4fdba075e861dc75105d8dfa7fe9a618c0aaad728cee06ae7e6c0c77',
+        '02ce1bfb1fee99120a21d0b2a2237884fd86ec5e16eaa448edcee42cbdd621ff',
+        '498c1bd160f72532e2ca121927a66fb05a7e78824bd232003ae67e9b0a004aec',
+        '22c601c9a5651a976c86fa5b577dc4a84b72c4f064c5dd299e9fd73f6efbe1f4',
+        '26c2ad530442852abe097fcaf87adb094c5c4c69b29a1df3db974b8700346ed1',
+        'b4604f5bf9d4fd74610f970ebc7c37e7d16dbec98528c6c5707d36410b36685e',
+        '7a0ab1644240b224b2af4fbf75b5b72f776f9029f1eb442f22a004f2da65e9cd',
+        'e553ea28aae7f551e4aa7f645f14f443352a60feb521f6eea1b33e57256989ee',
+        '930c3a6437966f293c5abe43d6755494ffeb61ddbb43122241668cae81eca6ec',
+        'd12676bee6c4758381e00e9dfc5efa26ce3f52e6e3de808cef329caad3b2111b',
+        'fa4fed30de042337154b1876faff96ff476768fe6b33d60bd79f4d79a6723649',
+        'cdbd028b5e021f4d78eca87f92a81fc293741b80f80542a29c91e11bff4ec2ad',
+        '262411d5916f036612b30910f93bf08b3d8f3ebf4b2ede1ca8729a976e72f90b',
+        'a86d19cb8c15d743f0f6de6ec5b217ab869adfed816355b901ca36e32c2735f5',
+        'caa3990ab0ab3dda190dbc7b5fb745d26a75dc679ffd21281ea2f170921a6e93',
+        '7e94b6a5e7f7e34ce2375712f97f6a1304bcadc76f30be8acc65596d8ae5ce0a',
+        '6d61a535827c9dfba926c8846d6aac31c83af3087902a6265182f0677bf4bd36',
+        '8f7cdd107184bef0f66a2c862594178ffed1868e9a62ef827f414ff587418acc',
+        '74772a23245f98b1f247f8e1de703fea87bdb2819238ac6c19c154a68463a757',
+        'f18891474d497c7d510ee3f48273fdbacf14722ccdd1bfe239c0dfc2d4b3046d',
+        'ed13222c9ac540b5fcdc2c5439a772e62fc7a5d7e450b703ea356a158ddf6e8f',
+        'ba41e5a52b71aeb74ac39db74c3a828adb651ac5fb86cee4707a82e5e6030333',
+        'f28f08fc33a4a0b0a120079a8c17f1c98349232c1a64771c131451eeef5103d3',
+        '29098c3528ca288a3ba5d20c50ce2fb33bb977a9441bbe6fd4a20ec329714c67',
+        '7593bdac15e211f10d8534310673cef09b5cdf67ff46cb9d84dc5f02f4d848c8',
+        'ab75f556a55876225d25d8ee1c3e3860a7a5ff00037cb68cd04a3664a9baddfa',
+        '8521b4ee8414b44019406cb6963b4dac52e96db9b8c74147196024ad8aab1fa6',
+        '910fa776612f80c269c29cae69792dbd93643509d8c67d3425ac644655bf43c9',
+        'c51e16db0d4efc068760fe37b7fe930645c396ec0219febd28a0112ed980f372',
+        '779b2c1e0b90396da261b79c57d642a593e4358c9ebd7f4cd846308ef7405737',
+        'c804817654d8ff66bd842a5f16f3140342611c701b095861b0eeadf887ccdc8f',
+        '551f902eda78c0c4e09da6c6fe3c5c4a1664c95ce2d98c36c058d62fb14453c8',
+        '9077ac10aeccc4113896a698303eeb897391e14a988746640387ce055341994d',
+        '2866fdd2824e33bd7484a3d374d60bbb60d17050467bfadecd08c98a3a188ae7',
+        'c069e63b4107c4fe71cd431a53b237976dc673379c35e592f617c0ec074783ed',
+        '8a3d3b797f8b23df8c683872e98cf1dfbd83f9b7486fef5606fe8b0c11d9a8c2',
+        'ba918dfe684b28e620e538a3ee4e7ad64e237dbb042e38926357690b7270c380',
+        '31f3fb62163f04d1aca5de58dade6de1050905d6e069505a382a7f333d7a12a6',
+        '4defa253f768afbba78d8105336a420161ae292bf228aa0010c5efeb4f084dbe',
+        '9f0376ce248aaee1f6b7bd019eabfe41dcf2f2791126d2066c4f18c7b4fc2ee5',
+        '18de05ef18b48feb60aaee96438a759aa93c6e67e62c321749ba5c9c8381712e',
+        '5d01a19ad43eb8318ee032bb2a0fb08b34ea93403ec97be4d5d95540b78afbec',
+        '7a71eefea1554df8a03d866a418759b9c86e3b8dc40297b38a0e84a4edfb9d39',
+        '68a9a9c5b6cace512bdb232c35d5c0b0bb9e4a21d0e672444e8750e04f7fa1c3',
+        'fb77d0a06a1ec39d3c2758d52b8e29bc1057237ccdd67ada6da34ab98e4d45e5',
+        '111a3b94341ffbef92e3d7fc5fbdba4e542e5b0936764467779d3f8105f470ff',
+        '4ac056d1693c69e82a6a7d2176444d798c9f28b02333559173402abd5c86d963',
+        '6ecf4417b67fa62dead99bbe64405ad537db074a4e016766ade016f94ef23e18',
+        '6d89a7c0a0b0f75111b0cbaf1496d186dd06b315baeeae7a86202924869eaf75',
+        'efed2ec89ba08462bc419e788035da433d2c28ae05c7f085c4e1f9fd457155c3',
+        '7c4549074fac4bb803439aa4aec0e2899161858a6d2233549465a9f19a4f9867',
+        'ef98b7260ff0e5c7dee8b16d1f8298252442b37b8df3e4d994895df8e454973b',
+        'df4796a3ebdef36f840325252e264b3ecd3b0cc96595d60e598235b910074569',
+        'd9f3e9094ff2bf0532253a610f6a31cd2070d37cc46aa2dbb267241e179d9a32',
+        'f579021c40d5c79fce7ab6dba30d1b21ee09314ed235160967e183909bd1009d',
+        'a387b317833905653e25a3773f23af872fd3eb6b3c8a7b457a9e07e5fd774b50',
+        '2cf28424be2a22f4ba47a509109c2d7c4cd94b322c4f4114ff1a88f0bd1fcec9',
+        '90e7b8eedd93b64e4ad449baf7af774045c400ff18880e40021a91cca921ed7e',
+        'd19cb91caf32f40d82fdfe3f42152724b9978121ef152fafd238ec1a290f1226',
+        '58bfaa568325cba81e5ca7c8fa3ebd68d6b804b96fa44f6b2e22776e6e0f1413',
+        '27e835b9443e90835ef68860748cacce58ee113a80b9bbd8699ba6018d90ad51',
+        '71009056c2cbc90f40977b03559837f27c3c40fb5f57a9ea535b25dbf9813146',
+        '0dbd34275d12e4468a425a8901aa8ac70b20a375166b5255f591540b4ff3f442',
+        'd268cadc429cfc62b46a044210fb3af2770d26859be18cdc1a596009b09122e7',
+        'a1988bad42c5bb223df55c77118330b1293876ec3dbaeb6317c0d0641539fbf2',
+        '1d838d5b36f231876a74165632d1b9a68f85236d26d1a6dff5a7908bc2cc4e37',
+        'a50c576e962d4c4b856fed8fc904f03f70ab1b7452b9a5e6b128daf3ca7f699f',
+        'be73c876cd5cc4c3d9996bc673e501e3edcc0636c02e5941ecfea40de207d59e',
+        'a861a47a9501b55af3a5d953f5e1dfed6f4f00284be746608f4bf589fb9ca2ae',
+        'ec4db68276cadf1e60947f8065dccc9fffac4fac803d7366272e8b9ac9437464',
+        'ebd4d8b1ea4f429b340b4c3c65015a983d56ad8c8d92f1487530cab1a9d5b04c',
+        '7cb7386183ace5eb5d03cdd418096b736edeb38c2889b137d921f50995c6f868',
+        'a19f51c3d2f4ef463e4c2143934878f7bef4d9117249bf274b1ebddc0b0de377',
+        'b06d2309f76d11ad92a63539a27f878084834c84456084aa805be035293b8278',
+        'df1113d54e2be174efbd89714d72315516cad06f46097706be1620ef4a80e100',
+        '720b709e155a65e44174b8ae8bd442b74752de080dc99093e3b9c90cd9665905',
+        'dd7603f6533970e4e3f499475dc861b125609bfc37b510306aed26eeda801dae',
+        '90bd4c808cb7a55dee8d06c9eae7d20427dd02bf0e10d94fc17f475198815c76',
+        '16157d2bd58a7b95f6865223066637ecbff17547399b3410cba13bd6af3d549a',
+        '8714300a06ded1bbc93fb21d36d5c7322e0f15436b8672751baf7e7cb4ae2a27',
+        '22e7d0c00166e50acd6babf7098332ae6c6357fdd539cd8ec827e25ff550c0ea',
+        '75cc3f60d8ed678cf3d4494cccbd49c76fd5b480e429533c80e5e60d3ee6a004',
+        'd4fa9f86887e680b80cf80b3ef2477f2a2bbc224bbd1b97d3e42155f65aec01e',
+        '2888beb332475f18a777d1f39098fc12541681b963f65dedec5429bfece3210a',
+        '27528eeada7809ec96fa25238661ac169617d23da9d7ff276ba29742caf29ada',
+        'c1ce5cd9116e59ce80baef228aa9104d50a8afaa8732713b645872acc2a51fc2',
+        '1204d6d36acf0c62d34b018a5773af701dfe2ec554a2feb61fd4f9d1d6c4dfae',
+        '66c748fa1fa46286a584d5e32ec3e6df85d227ef94f8ce5edf1a058ce0ada3bb',
+        '1b9c04182065b1b245775830cd0a7d16d5b5ac30003a75ba2da82d41998b75bd',
+        '72050228e76eea36eb63b3819cf423f39f7621dbc55cd5ac95b8085ed72ac18d',
+        '6f35419d1da1260bc0f33d52e8f6d73fc5d672c0dca13bb960b4ae1adec17937',
+        '10c710f9205b30e8a7163edbfcd85e8fbaf2f3fe442f2ee4af580e28b2df1180',
+        '140ab49cc3bb44e342655a521185933b2230ec274ff5304b2cead9873a822863',
+        'a231361ad3389fe6f2b62a46cf677d6c5f7b79964c30a2c34aa4fc3392f501c9',
+        'acd2f3dfd43e9a01bc64a9c4ac8ac8a2b29f3274131a12010b42b8c830e879bf',
+        '31d0f66ab43019856780cb246cfd37b0c190d17111d5c016f19ba715ee622dc5',
+        'e7e8dbc3898515970ca6fce19039ca22ae2638e44b24641fd61048b94dc2be25',
+        'b3f100a0f506f6a6c86c10f107ab4811ddc76f72516fcdfa8a0c9bd71ff912ab',
+        'a962e4bd7d1f316f845784e115ff103530d85f9dfacd638ad45fbe938ba85c40',
+        '63bc3b9e8340ab48a66828d7d9d7d5be2f5f280665196d25a39c4d01345cb95e',
+        'bdf82c7d252d69c64bd6fa8ee66ad9d30241016981e4580e3c2edc4804b75236',
+        '9a91f4c19545d6cd9720d4736591fe70edcf3e33cb2e56f21fdc1244f3d2ef6d',
+        'bb1ff291eb2e614a661d6730b502bae2bde112958cee698478845a1bb3788a6b',
+        'acb98b6fb1a5fdae0a5718d0b812e1de1412e44d875146acc1a7f7c3916c003a',
+        'e0bcfbd03fa4a619a5bc3cae15404f39b4b7bf5ddd5161ea642d13d23baef545',
+        'd50c6062bfcd7bbd0dbd68d1ddeeae095485720a1ce334e9e5e5153066f42260',
+        '31682c19f715cd317da1a553ce384de6902fe26032fecc7de03e40502af05dce',
+        'f0573e660ba01cff272a1c6f7927d73c94c85d380a84399867626d6429d48bae',
+        '1765922797ba721e8937c7470a26d5c2f141f3d4106447dab171fced7d652a69',
+        '3528594d65e9525233b39587174bcf0bba562d95b50b429914c7e0e8a9ae58f9',
+        'fa4c9b1172ab5afebd159573e19e25169975242e10a2ed38dfc805232fb50a64',
+        '31763a8e1dedb15ad0c8b88d437fef835aeb958292644810663dc1756550f22b',
+        '2360c4480d69879eadd7ae508409f2f0ba83a2b0fe0da57b40008c064d2c397d',
+        '8545f2c1afdace5d87f06ce1d44bc0a2691aea4414d0ad640be0d9879c8374d9',
+        '88d0cc35e8abe7d6524569be8aa1a48bb23362326fdfefe961348bc96091c94c',
+        '71e37864edf08740d592362cd24d0db067bf14cd3b97bd2a68e782adffb43655',
+        '68c477f83a13a000ad2b5b3e50375b7c3ae782d987ba4b5a65376bbb97469fb3',
+        '13784d01e2fae904de62c6fbf9776979ca7a2777ae2632ee278d19aca30f890e',
+        '9e1d1ce5cdca9cdf40fa5786548b58eb19ddfd32395b4582983919099dbd1531',
+        '202b1014739f29b1d905d630ddeb8560a32bf23e666c8a1523a4a600227fef7c',
+        'b49d61e8c2c894e12486176ab8f4d7069d6692fa6495541567872e7ecbddb726',
+        '4bf6ffa2bc131204513289738567a68fa9f4827dac7fd3b3d1f2e94777d57f36',
+        'cf277fb80a82478460e8988570b718f1e083ceb76f7e271a1a1497e5975f53ae',
+        '78ccaaab73373552f207a63599de54d7d8d0c1805f86ce7da15818d09f4cff62',
+        '8f6162fa308d2b3a15dc33cffac85f13ab349173121645aedf00f471663108be',
+        '7e275adf313a996c7e2950cac67caba02a5ff925ebf9906b58949f3e77aec5b9',
+        '7fa06ba11241ddd5efdc65d4e39c9f6991b74fd4b81b62230808216c876f827c',
+        '0ff273fcbf4ae0f2bd88d6cf319ff4004f8d7dca70d4ced4e74d2c74139739e6',
+        'c5ab8111456b1f28f3c7a0a604b4553ce905cb019c463ee159137af83c350b22',
+        'fffc43bd08273ccf135fd3cacbeef055418e09eb728d727c4d5d5c556cdea7e3',
+        '1c25ef10ffeb3c7d08aa707d17286e0b0d3cbcb50f1bd3b6523b63ba3b52dd0f',
+        '6ca6a3f763a9395f7da16014725ca7ee17e4815c0ff8119bf33f273dee11833b',
+        '6075c657a105351e7f0fce53bc320113324a522e8fd52dc878c762551e01a46e',
+        'edf260291f734ddac396a956127dde4c34c0cfb8d8052f88ac139658ccf2d507',
+        '44a6d974c75b07423e1d6d33f481916fdd45830aea11b6347e700cd8b9f0767c',
+        '4f05f4acb83f5b65168d9fef89d56d4d77b8944015e6b1eed81b0238e2d0dba3',
+        '504364a5c6858bf98fff714ab5be9de19ed31a976860efbd0e772a2efe23e2e0',
+        'e2e7610b87a5fdf3a72ebe271287d923ab990eefac64b6e59d79f8b7e08c46e3',
+        '776a31db34a1a0a7caaf862cffdfff1789297ffadc380bd3d39281d340abd3ad',
+        '2def10d13dd169f550f578bda343d9717a138562e0093b380a1120789d53cf10',
+        '4ebfd9cd7bca2505f7bef59cc1c12ecc708fff26ae4af19abe852afe9e20c862',
+        'a2fca4a49658f9fab7aa63289c91b7c7b6c832a6d0e69334ff5b0a3483d09dab',
+        'ad676aa337a485e4728a0b240d92b3ef7b3c372d06d189322bfd5f61f1e7203e',
+        '3d04cffd8b46a874edf5cfae63077de85f849a660426697b06a829c70dd1409c',
+        'e026cc5a4aed3c22a58cbd3d2ac754c9352c5436f638042dca99034e83636516',
+        '7ad66c0a68c72cb89e4fb4303841966e4062a76ab97451e3b9fb526a5ceb7f82',
+        'e1cea92ed99acdcb045a6726b2f87107e8a61620a232cf4d7d5b5766b3952e10',
+        '292c23a9aa1d8bea7e2435e555a4a60e379a5a35f3f452bae60121073fb6eead',
+        '617bdd11f7c0a11f49db22f629387a12da7596f9d1704d7465177c63d88ec7d7',
+        'defff6d330bb5403f63b14f33b578274160de3a50df4efecf0e0db73bcdd3da5',
+        'ecd50eee38e386bd62be9bedb990706951b65fe053bd9d8a521af753d139e2da',
+        '3b8ec09e026fdc305365dfc94e189a81b38c7597b3d941c279f042e8206e0bd8',
+        '890740a8eb06ce9be422cb8da5cdafc2b58c0a5e24036c578de2a433c828ff7d',
+        '633dc4d7da7256660a892f8f1604a44b5432649cc8ec5cb3ced4c4e6ac94dd1d',
+        '290decd9548b62a8d60345a988386fc84ba6bc95484008f6362f93160ef3e563',  # leaf
+    )]
+EMPTY_ROOT_HASH = EMPTY_SUBTREE_HASHES[0]
+# Branch for any value in an empty tree in root->leaf order
+EMPTY_NODE_HASHES = EMPTY_SUBTREE_HASHES[1:]
+EMPTY_LEAF_NODE_HASH = EMPTY_SUBTREE_HASHES[TREE_HEIGHT]
+
+
+def _to_int(value):
+    # Same as eth_utils.to_int for bytes, without having to import it
+    return int.from_bytes(value, byteorder='big')
+
+
+def validate_is_bytes(value):
+    if not isinstance(value, bytes):
+        raise ValidationError("Value is not of type `bytes`: got '{0}'".format(type(value)))
+
+
+def validate_length(value, length):
+    if len(value) != length:
+        raise ValidationError("Value is of length {0}.  Must be {1}".format(len(value), length))
+
+
+def compress_branch(branch):
+    """
+    Compresses a branch (root->leaf order) into a bitmap of which siblings are
+    default (empty subtree) hashes and the list of non-default siblings
+
+    Bit `TREE_HEIGHT-1 - i` of the bitmap marks `branch[i]`, so the bitmap
+    lines up with the keypath (MSB:root->LSB:leaf)
+    """
+    validate_length(branch, TREE_HEIGHT)
+    bitmap = 0
+    siblings = []
+    for i, (sibling, empty_node) in enumerate(zip(branch, EMPTY_NODE_HASHES)):
+        if sibling == empty_node:
+            bitmap |= 1 << (TREE_HEIGHT - 1 - i)
+        else:
+            siblings.append(sibling)
+    return bitmap, siblings
+
+
+def expand_branch(bitmap, siblings):
+    """
+    Reverses `compress_branch`, returning the full branch in root->leaf order
+    """
+    siblings = iter(siblings)
+    branch = []
+    for i, empty_node in enumerate(EMPTY_NODE_HASHES):
+        if bitmap & (1 << (TREE_HEIGHT - 1 - i)):
+            branch.append(empty_node)
+        else:
+            sibling = next(siblings, None)
+            if sibling is None:
+                raise ValidationError("Not enough siblings for bitmap")
+            branch.append(sibling)
+    if next(siblings, None) is not None:
+        raise ValidationError("Too many siblings for bitmap")
+    return branch
+
+
+def calc_root(key, value, branch):
+    """
+    Returns the root hash of the tree given a value and its branch
+    """
+    validate_is_bytes(key)
+    validate_length(key, 20)
+    validate_length(branch, TREE_HEIGHT)
+
+    path = _to_int(key)
+    target_bit = 1
+    # traverse the path in leaf->root order
+    # branch is in root->leaf order (key is in MSB to LSB order)
+    node_hash = keccak(value)
+    for sibling in reversed(branch):
+        if path & target_bit:
+            node_hash = keccak(sibling + node_hash)
+        else:
+            node_hash = keccak(node_hash + sibling)
+        target_bit <<= 1
+
+    return node_hash
+
+
+def calc_node_updates(key, value, branch):
+    """
+    Returns the hashes of every node on the path of `key` after setting it
+    to `value` in root->leaf order (same as `SparseMerkleTree.set`)
+    """
+    validate_is_bytes(key)
+    validate_length(key, 20)
+    validate_length(branch, TREE_HEIGHT)
+
+    path = _to_int(key)
+    target_bit = 1
+    node_hash = keccak(value)
+    node_updates = []
+    # traverse the path in leaf->root order, the root itself is not included
+    for sibling in reversed(branch):
+        node_updates.append(node_hash)
+        if path & target_bit:
+            node_hash = keccak(sibling + node_hash)
+        else:
+            node_hash = keccak(node_hash + sibling)
+        target_bit <<= 1
+
+    # updates need to be in root->leaf order, so flip back
+    return list(reversed(node_updates))
+
+
+def _verify_sorted(root_hash, proofs):
+    """
+    Verifies (key, value, branch) proofs sorted by key, returning the results
+    and the number of hashes skipped by reusing the nodes of the last proof
+
+    The last proof that checked out shares the longest path with the next
+    key, so each proof is only hashed up to where its path meets that one.
+    Everything above is checked by comparing against the last proof, which
+    is done first so that a bad branch fails before any hashing.
+    """
+    results = []
+    saved = 0
+    last = None  # path, branch and node hashes (by depth) of the last good proof
+    for key, value, branch in proofs:
+        if len(branch) != TREE_HEIGHT:
+            results.append(False)
+            continue
+
+        path = _to_int(key)
+        if last is None:
+            # Nothing to compare against, so hash up to the root
+            stop, expected = 0, root_hash
+            result = True
+        else:
+            last_path, last_branch, last_nodes = last
+            # Depth of the deepest node both paths go through
+            shared = TREE_HEIGHT - (path ^ last_path).bit_length()
+            if shared == TREE_HEIGHT:
+                # Same key, the branches must be the same
+                stop, expected = TREE_HEIGHT, last_nodes[TREE_HEIGHT]
+                result = (branch == last_branch)
+            else:
+                # Below the shared node, the paths are each other's siblings
+                stop, expected = shared + 1, last_branch[shared]
+                result = (branch[:shared] == last_branch[:shared]) and \
+                        (branch[shared] == last_nodes[shared + 1])
+
+        if not result:
+            results.append(False)
+            continue
+
+        nodes = [None] * (TREE_HEIGHT + 1)
+        node_hash = keccak(value)
+        # Traverse leaf->root until the known node
+        for depth in range(TREE_HEIGHT, stop, -1):
+            nodes[depth] = node_hash
+            sibling = branch[depth-1]
+            if (path >> (TREE_HEIGHT - depth)) & 1:
+                node_hash = keccak(sibling + node_hash)
+            else:
+                node_hash = keccak(node_hash + sibling)
+        nodes[stop] = node_hash
+        # Every level above `stop` is known from the last proof
+        saved += stop
+
+        result = (node_hash == expected)
+        if result:
+            if last is not None:
+                nodes[:stop] = last_nodes[:stop]
+            last = (path, branch, nodes)
+        results.append(result)
+
+    return results, saved
+
+
+def verify_many(root_hash, proofs, workers=None):
+    """
+    Verifies a batch of (key, value, branch) proofs against `root_hash`,
+    sharing the hashing of common upper-level nodes across proofs
+
+    With `workers`, the batch is split into contiguous key ranges which are
+    verified in a pool of that many processes
+
+    Returns pass/fail for each proof (in input order) and the number of
+    hashes saved over checking each proof with `calc_root` (only the shared
+    nodes that weren't hashed again, not proofs rejected before hashing)
+    """
+    proofs = list(proofs)
+    for key, value, branch in proofs:
+        validate_is_bytes(key)
+        validate_length(key, 20)
+        validate_is_bytes(value)
+
+    # Neighbouring keys share the longest paths
+    order = sorted(range(len(proofs)), key=lambda i: proofs[i][0])
+    ordered = [proofs[i] for i in order]
+
+    if workers and workers > 1 and len(ordered) > workers:
+        size = -(-len(ordered) // workers)  # Round up
+        chunks = [ordered[i:i+size] for i in range(0, len(ordered), size)]
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as pool:
+            verified = list(pool.map(_verify_sorted, [root_hash] * len(chunks), chunks))
+        results = [r for chunk_results, _ in verified for r in chunk_results]
+        saved = sum(s for _, s in verified)
+    else:
+        results, saved = _verify_sorted(root_hash, ordered)
+
+    in_order = [None] * len(proofs)
+    for i, result in zip(order, results):
+        in_order[i] = result
+    return in_order, saved
+
+
+def _pack_bits(bits):
+    """
+    Packs bits MSB-first into bytes, zero-padded to a multiple of 32 bytes
+    (so the contract can read them a word at a time)
+    """
+    packed = bytearray(-(-len(bits) // 256) * 32)
+    for i, bit in enumerate(bits):
+        if bit:
+            packed[i // 8] |= 0x80 >> (i % 8)
+    return bytes(packed)
+
+
+def calc_multiroot(keys, values, defaults, siblings):
+    """
+    Returns the root hash of the tree given the values of many keys and their
+    multiproof (see `SparseMerkleTree.multiproof`), the same way auth-list.vy
+    validates and applies a batch
+
+    Keys must be sorted and unique
+    """
+    for key in keys:
+        validate_is_bytes(key)
+        validate_length(key, 20)
+    prefixes = [_to_int(key) for key in keys]
+    if any(a >= b for a, b in zip(prefixes, prefixes[1:])):
+        raise ValidationError("Keys must be sorted and unique")
+
+    nodes = [keccak(value) for value in values]
+    siblings = iter(siblings)
+    bit = 0
+    for depth in range(TREE_HEIGHT, 0, -1):
+        next_prefixes, next_nodes = [], []
+        i = 0
+        while i < len(prefixes):
+            prefix = prefixes[i]
+            if not prefix & 1 and i+1 < len(prefixes) and prefixes[i+1] == prefix + 1:
+                # Both children are being updated
+                left, right = nodes[i], nodes[i+1]
+                i += 2
+            else:
+                if defaults[bit // 8] & (0x80 >> (bit % 8)):
+                    sibling = EMPTY_SUBTREE_HASHES[depth]
+                else:
+                    sibling = next(siblings, None)
+                    if sibling is None:
+                        raise ValidationError("Not enough siblings for multiproof")
+                bit += 1
+                left, right = (sibling, nodes[i]) if prefix & 1 else (nodes[i], sibling)
+                i += 1
+            next_prefixes.append(prefix >> 1)
+            next_nodes.append(keccak(left + right))
+        prefixes, nodes = next_prefixes, next_nodes
+
+    if next(siblings, None) is not None:
+        raise ValidationError("Too many siblings for multiproof")
+    return nodes[0]
+
+
+def _build_subtree(leaves, depth, nodes, flush=None, flush_every=100000):
+    """
+    Hashes the subtree at `depth` holding all of the (key, value) leaves,
+    which must be in ascending key order and all under that subtree
+
+    New nodes are added to `nodes` (unless it is None), and passed to `flush`
+    (then dropped) every `flush_every` nodes. Returns the hash of the subtree.
+    """
+    # Subtrees that are done so far but have no parent yet, as
+    # [depth, path of a key in it, hash] with the deepest on top
+    stack = []
+
+    def fold(depth):
+        # Hash everything on the stack up to `depth`
+        while stack[-1][0] > depth:
+            d, path, node_hash = stack.pop()
+            if stack and stack[-1][0] == d:
+                node = stack.pop()[2] + node_hash  # With its left sibling
+            elif path & (1 << (TREE_HEIGHT - d)):
+                node = EMPTY_SUBTREE_HASHES[d] + node_hash
+            else:
+                node = node_hash + EMPTY_SUBTREE_HASHES[d]
+            node_hash = keccak(node)
+            if nodes is not None and node_hash != EMPTY_SUBTREE_HASHES[d-1]:
+                nodes[node_hash] = node
+            stack.append([d-1, path, node_hash])
+
+    last = None
+    for key, value in leaves:
+        validate_is_bytes(key)
+        validate_length(key, 20)
+        validate_is_bytes(value)
+        path = _to_int(key)
+        if last is not None:
+            if path < last:
+                raise ValidationError("Leaves must be sorted by key (or use `sort=True`)")
+            if path == last:
+                stack.pop()  # Replaced by this value
+            else:
+                # Everything below where the paths split is done
+                fold(TREE_HEIGHT - (path ^ last).bit_length() + 1)
+        last = path
+
+        node_hash = keccak(value)
+        if nodes is not None and node_hash != EMPTY_LEAF_NODE_HASH:
+            nodes[node_hash] = value
+        stack.append([TREE_HEIGHT, path, node_hash])
+
+        if flush is not None and len(nodes) >= flush_every:
+            flush(nodes)
+            nodes.clear()
+
+    if not stack:
+        return EMPTY_SUBTREE_HASHES[depth]
+    fold(depth)
+    return stack[0][2]
+
+
+def _read_leaves(path):
+    # Records are the key, the value length (2 bytes) and the value
+    with open(path, 'rb') as f:
+        data = f.read()
+    i = 0
+    while i < len(data):
+        size = int.from_bytes(data[i+20:i+22], byteorder='big')
+        yield data[i:i+20], data[i+22:i+22+size]
+        i += 22 + size
+
+
+def _build_shard(path, depth, keep_nodes):
+    """
+    Builds the subtree at `depth` from the leaves in a file (in a worker
+    process), returning its hash and nodes
+    """
+    nodes = {} if keep_nodes else None
+    return _build_subtree(_read_leaves(path), depth, nodes), nodes
+
+
+def _build_sharded(leaves, shard_bits, workers, nodes, flush=None):
+    """
+    Builds the tree from the sorted leaves as 2^`shard_bits` subtrees in a
+    pool of `workers` processes, and the levels above them here
+
+    Leaves are sorted, so each subtree's leaves are contiguous: they are
+    written to a file and handed to a worker as soon as the next subtree
+    starts. Subtree nodes are passed to `flush` as they come back (unless
+    `nodes` is None), with a bounded number of subtrees in flight.
+    """
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    shift = TREE_HEIGHT - shard_bits
+    roots = {}  # Shard -> subtree hash
+    pending = deque()  # (shard, future) in shard order
+
+    def collect(limit):
+        while len(pending) > limit:
+            shard, future = pending.popleft()
+            roots[shard], shard_nodes = future.result()
+            if shard_nodes is not None:
+                flush(shard_nodes)
+
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(workers) as pool:
+        shard, records, last = None, [], None
+        for key, value in leaves:
+            validate_is_bytes(key)
+            validate_length(key, 20)
+            validate_is_bytes(value)
+            path = _to_int(key)
+            if last is not None and path < last:
+                raise ValidationError("Leaves must be sorted by key (or use `sort=True`)")
+            last = path
+            if path >> shift != shard:
+                if records:
+                    pending.append((shard, _submit_shard(pool, tmp, shard, shard_bits, records, nodes)))
+                    collect(2 * workers)
+                shard, records = path >> shift, []
+            records.append(key + len(value).to_bytes(2, byteorder='big') + value)
+        if records:
+            pending.append((shard, _submit_shard(pool, tmp, shard, shard_bits, records, nodes)))
+        collect(0)
+
+    # Hash the top levels from the subtree roots
+    for depth in range(shard_bits, 0, -1):
+        parents = {}
+        for prefix in roots:
+            if prefix >> 1 in parents:
+                continue  # Already hashed with its sibling
+            left = roots.get(prefix & ~1, EMPTY_SUBTREE_HASHES[depth])
+            right = roots.get(prefix | 1, EMPTY_SUBTREE_HASHES[depth])
+            node = left + right
+            node_hash = keccak(node)
+            if nodes is not None and node_hash != EMPTY_SUBTREE_HASHES[depth-1]:
+                nodes[node_hash] = node
+            parents[prefix >> 1] = node_hash
+        roots = parents
+    return roots.get(0, EMPTY_ROOT_HASH)
+
+
+def _submit_shard(pool, tmp, shard, shard_bits, records, nodes):
+    path = '{}/{}'.format(tmp, shard)
+    with open(path, 'wb') as f:
+        f.write(b''.join(records))
+    return pool.submit(_build_shard, path, shard_bits, nodes is not None)
+
+
+def _default_shard_bits(workers):
+    # About 8 subtrees per worker, so uneven subtrees even out
+    return min((8 * workers - 1).bit_length(), 16)
+
+
+def calc_leaves_root(leaves, workers=None, shard_bits=None):
+    """
+    Returns the root of the tree holding the (key, value) leaves, which must
+    be in ascending key order, without keeping any nodes (see
+    `SparseMerkleTree.from_leaves` for the tree, and for `workers`)
+    """
+    if not workers:
+        return _build_subtree(leaves, 0, None)
+    return _build_sharded(leaves, shard_bits or _default_shard_bits(workers), workers, None)
+
+
+class SparseMerkleProof:
+    """
+    Value and branch for a single key, kept up to date using the node updates
+    (root->leaf order, as returned by `SparseMerkleTree.set`) of every change
+    """
+    def __init__(self, key, value, branch):
+        validate_is_bytes(key)
+        validate_length(key, 20)
+        validate_is_bytes(value)
+        validate_length(branch, TREE_HEIGHT)
+        self.key = key
+        self.value = value
+        self.branch = list(branch)
+        self._path = _to_int(key)
+
+    @property
+    def root_hash(self):
+        return calc_root(self.key, self.value, self.branch)
+
+    def update(self, key, value, node_updates):
+        validate_length(node_updates, TREE_HEIGHT)
+        if key == self.key:
+            # Our own siblings don't change
+            self.value = value
+            return
+
+        # Only the sibling where the updated path splits off from ours changes
+        depth = TREE_HEIGHT - (_to_int(key) ^ self._path).bit_length()
+        self.branch[depth] = node_updates[depth]
+
+
+class SqliteDB:
+    """
+    Persistent node store for SparseMerkleTree
+
+    Every batch of node writes is committed in one transaction together with
+    the root pointer, so reopening the store always resumes from the last
+    complete update. Pruned trees (see `SparseMerkleTree`) also keep their
+    reference counts and retained roots (with their stamps) here, in the same
+    transactions, and the roots of unpruned trees are all recorded.
+
+    Other writes (like `set_meta`) can join those transactions with
+    `transaction`, and readers in other threads share the connection.
+    """
+    def __init__(self, path):
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._depth = 0  # Of nested `transaction`s
+        with self._conn:
+            self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS nodes "
+                    "(hash BLOB PRIMARY KEY, node BLOB NOT NULL) WITHOUT ROWID"
+                )
+            self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS meta "
+                    "(key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+                )
+            self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS refs "
+                    "(hash BLOB PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID"
+                )
+            self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS unreferenced ON refs (count) WHERE count = 0"
+                )
+            self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS roots (hash BLOB PRIMARY KEY) WITHOUT ROWID"
+                )
+        # Commits are appended to the write-ahead log, which is crash-safe
+        # without an fsync of the main db file on every update
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def __getitem__(self, node_hash):
+        row = self._conn.execute(
+                "SELECT node FROM nodes WHERE hash = ?", (node_hash,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(node_hash)
+        return bytes(row[0])
+
+    def __setitem__(self, node_hash, node):
+        self.write_batch({node_hash: node})
+
+    def __contains__(self, node_hash):
+        return self._conn.execute(
+                "SELECT 1 FROM nodes WHERE hash = ?", (node_hash,)
+            ).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commits all the writes made inside in one transaction (or in the
+        enclosing one, if nested), or none of them if it raises
+        """
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        self._depth = 1
+        try:
+            with self._conn:
+                yield
+        finally:
+            self._depth = 0
+
+    def get_meta(self, key):
+        """
+        Returns the value stored under `key` (None if there is none)
+        """
+        row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set_meta(self, key, value):
+        """
+        Stores `value` (bytes) under `key`, next to the tree's own entries
+        (`root`, `retained` and `stamps`)
+        """
+        with self.transaction():
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    @property
+    def root(self):
+        """
+        Root hash of the last committed update (None if never written)
+        """
+        return self.get_meta('root')
+
+    @property
+    def retained_roots(self):
+        """
+        Roots a pruned tree keeps the nodes of, oldest first (None if the
+        reference counts were never written)
+        """
+        roots = self.get_meta('retained')
+        return None if roots is None else [roots[i:i+32] for i in range(0, len(roots), 32)]
+
+    @property
+    def retained_stamps(self):
+        """
+        Stamps of the retained roots, in the same order (None if never written)
+        """
+        stamps = self.get_meta('stamps')
+        if stamps is None:
+            return None
+        return [int.from_bytes(stamps[i:i+8], 'big') for i in range(0, len(stamps), 8)]
+
+    def has_root(self, root_hash):
+        """
+        Whether `root_hash` was the root of an unpruned update
+        """
+        return self._conn.execute(
+                "SELECT 1 FROM roots WHERE hash = ?", (root_hash,)
+            ).fetchone() is not None
+
+    def ref_counts(self, node_hashes):
+        """
+        Returns the reference counts of the given nodes (the ones that have one)
+        """
+        node_hashes = list(node_hashes)
+        counts = {}
+        for i in range(0, len(node_hashes), 500):
+            chunk = node_hashes[i:i+500]
+            counts.update((bytes(h), c) for h, c in self._conn.execute(
+                    "SELECT hash, count FROM refs WHERE hash IN ({})".format(
+                            ','.join('?' * len(chunk))), chunk))
+        return counts
+
+    def unreferenced(self):
+        """
+        Nodes whose reference count dropped to zero, but that are still stored
+        """
+        return [bytes(row[0]) for row in self._conn.execute(
+                "SELECT hash FROM refs WHERE count = 0")]
+
+    def _write_refs(self, refs, retained, stamps=None):
+        # A count of None removes it
+        self._conn.executemany(
+                "INSERT OR REPLACE INTO refs VALUES (?, ?)",
+                ((h, c) for h, c in refs.items() if c is not None)
+            )
+        self._conn.executemany(
+                "DELETE FROM refs WHERE hash = ?",
+                ((h,) for h, c in refs.items() if c is None)
+            )
+        if retained is not None:
+            self._conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('retained', ?)", (b''.join(retained),)
+                )
+        if stamps is not None:
+            self._conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('stamps', ?)",
+                    (b''.join(s.to_bytes(8, 'big') for s in stamps),)
+                )
+
+    def write_batch(self, nodes, root_hash=None, refs=None, retained=None, stamps=None, roots=()):
+        """
+        Atomically writes all nodes and (optionally) the new root pointer,
+        reference count changes and retained roots (and their stamps). Without
+        retained roots (an unpruned tree), the new root is recorded too, along
+        with the other `roots` the update went through.
+        """
+        with self.transaction():
+            self._conn.executemany(
+                    "INSERT OR REPLACE INTO nodes VALUES (?, ?)", nodes.items()
+                )
+            if root_hash is not None:
+                self._conn.execute(
+                        "INSERT OR REPLACE INTO meta VALUES ('root', ?)", (root_hash,)
+                    )
+                if retained is None:
+                    self._conn.executemany(
+                            "INSERT OR IGNORE INTO roots VALUES (?)",
+                            ((h,) for h in set(roots) | {root_hash})
+                        )
+            self._write_refs(refs or {}, retained, stamps)
+
+    def delete_batch(self, node_hashes, refs=None):
+        """
+        Atomically removes all the given nodes, and applies the reference
+        count changes
+        """
+        with self.transaction():
+            self._conn.executemany(
+                    "DELETE FROM nodes WHERE hash = ?", ((h,) for h in node_hashes)
+                )
+            self._write_refs(refs or {}, None)
+
+    def reset_refs(self, refs, retained, stamps=None):
+        """
+        Atomically replaces all reference counts and retained roots (and their
+        stamps), removing every node that has no count (and the recorded roots,
+        which may not be complete anymore)
+        """
+        with self.transaction():
+            self._conn.execute("DELETE FROM refs")
+            self._conn.execute("DELETE FROM roots")
+            self._write_refs(refs, retained, stamps)
+            self._conn.execute("DELETE FROM nodes WHERE hash NOT IN (SELECT hash FROM refs)")
+
+    def close(self):
+        self._conn.close()
+
+
+class SparseMerkleTree:
+    """
+    With `keep_roots`, nodes that are no longer part of the last `keep_roots`
+    roots are pruned: every stored node counts the stored nodes (and retained
+    roots) referencing it, and once that drops to zero it is queued for removal.
+    A bounded number of queued nodes is removed after every update (see `prune`).
+
+    With `keep_age`, roots are kept by age instead (or as well): every root is
+    stamped when it is committed (e.g. with its block number, see `merge`),
+    and a root is released once the one that replaced it is more than
+    `keep_age` older than the newest root. Roots committed without a stamp
+    take the newest one (0 for the first).
+
+    Reference counts are kept in memory, or with a `SqliteDB` in the db along
+    with the retained roots and their stamps, so a reopened store picks up
+    where it left off. They are counted from the current root (dropping the
+    nodes of any other root) the first time a store is opened pruned, or when it was
+    updated without since.
+    """
+    def __init__(self, db=None, keep_roots=None, keep_age=None, prune_step=512):
+        self.db = {} if db is None else db
+
+        # Reopen an existing tree if the store has a root pointer,
+        # otherwise start from the empty tree (which needs no db entries)
+        root_hash = getattr(self.db, 'root', None)
+        self.root_hash = EMPTY_ROOT_HASH if root_hash is None else root_hash
+
+        self.keep_roots = keep_roots
+        self.keep_age = keep_age
+        self.prune_step = prune_step
+        self.pruned_nodes = 0
+        self.reclaimed_bytes = 0
+        self._refs = None  # Stored node -> number of references to it, if not in the db
+        self._roots = deque()  # Retained roots, oldest first
+        self._stamps = deque()  # Of the retained roots
+        self._doomed = deque()  # Nodes that lost their last reference
+        self._history = set()  # Roots committed unpruned, if not in the db
+        if self.pruning:
+            self._track()
+
+    @property
+    def pruning(self):
+        """
+        Whether only some roots are kept (with `keep_roots` or `keep_age`)
+        """
+        return self.keep_roots is not None or self.keep_age is not None
+
+    @property
+    def _stored_refs(self):
+        return hasattr(self.db, 'ref_counts')
+
+    def _track(self):
+        """
+        Loads the reference counts of the stored nodes, or counts them from
+        the current root
+        """
+        if self._stored_refs:
+            retained = self.db.retained_roots
+            if retained and retained[-1] == self.root_hash:
+                self._roots = deque(retained)
+                stamps = self.db.retained_stamps
+                # Stores from before stamps start out all at 0
+                self._stamps = deque(stamps if stamps and len(stamps) == len(retained)
+                        else [0] * len(retained))
+                self._doomed = deque(self.db.unreferenced())
+                changes = {}
+                self._evict(changes)  # If less is kept than before
+                if changes:
+                    self._write({}, None, changes)
+                return
+
+        refs = {}
+        if self.root_hash != EMPTY_ROOT_HASH:
+            refs[self.root_hash] = 1  # Retained
+            stack = [(self.root_hash, 0)]
+            while stack:
+                node_hash, depth = stack.pop()
+                if depth == TREE_HEIGHT:
+                    continue  # Leaf values have no children
+                node = self.db[node_hash]
+                for child in (node[:32], node[32:]):
+                    if child == EMPTY_SUBTREE_HASHES[depth+1]:
+                        continue
+                    if child not in refs:
+                        refs[child] = 0
+                        stack.append((child, depth+1))
+                    refs[child] += 1
+        self._roots = deque([self.root_hash])
+        self._stamps = deque([0])
+        self._doomed = deque()
+        # Nodes of any other root would never be released
+        if self._stored_refs:
+            self.db.reset_refs(refs, list(self._roots), list(self._stamps))
+        else:
+            for node_hash in [h for h in self.db if h not in refs]:
+                del self.db[node_hash]
+            self._refs = refs
+
+    def _counts(self, node_hashes, changes):
+        """
+        Reference counts of the given nodes that are stored, including the
+        `changes` that aren't written yet (None for removed nodes)
+        """
+        counts = dict((h, changes[h]) for h in node_hashes if h in changes)
+        rest = [h for h in node_hashes if h not in changes]
+        if self._stored_refs:
+            counts.update(self.db.ref_counts(rest))
+        else:
+            counts.update((h, self._refs[h]) for h in rest if h in self._refs)
+        return dict((h, c) for h, c in counts.items() if c is not None)
+
+    def _count_new(self, nodes, changes):
+        """
+        Returns the nodes that aren't stored yet, adding their counts and
+        the references they make to `changes`
+        """
+        # Nodes that are already stored are shared, and already count
+        # their children
+        stored = self._counts(list(nodes), changes)
+        nodes = dict((h, n) for h, n in nodes.items() if h not in stored)
+        for node_hash in nodes:
+            changes[node_hash] = 0
+        children = [c for n in nodes.values() if len(n) == 64 for c in (n[:32], n[32:])]
+        counts = self._counts(set(children), changes)
+        for child in children:
+            if child in counts:
+                counts[child] += 1
+        changes.update(counts)
+        return nodes
+
+    def _unref(self, node_hash, changes):
+        count = self._counts([node_hash], changes).get(node_hash)
+        if count is not None:
+            changes[node_hash] = count - 1
+            if count == 1:
+                self._doomed.append(node_hash)
+
+    def _retain(self, root_hash, changes, stamp=None):
+        if stamp is None:
+            stamp = self._stamps[-1] if self._stamps else 0
+        self._roots.append(root_hash)
+        self._stamps.append(stamp)
+        count = self._counts([root_hash], changes).get(root_hash)
+        if count is not None:
+            changes[root_hash] = count + 1
+        self._evict(changes)
+
+    def _expired(self):
+        if len(self._roots) < 2:
+            return False  # The current root is always kept
+        if self.keep_roots is not None and len(self._roots) > self.keep_roots:
+            return True
+        # The oldest root was current until the next one was committed
+        return self.keep_age is not None and self._stamps[-1] - self._stamps[1] > self.keep_age
+
+    def _evict(self, changes):
+        while self._expired():
+            self._stamps.popleft()
+            self._unref(self._roots.popleft(), changes)
+
+    def _write(self, nodes, root_hash, changes, roots=()):
+        """
+        Writes the nodes, the root pointer (unless None) and the reference
+        count changes as a single batch, recording `roots` as well as the
+        new root for `at` if the tree isn't pruned
+        """
+        if self._stored_refs and self.pruning:
+            self.db.write_batch(nodes, root_hash, refs=changes,
+                    retained=list(self._roots), stamps=list(self._stamps))
+            return
+        if hasattr(self.db, 'write_batch'):
+            self.db.write_batch(nodes, root_hash, roots=roots)
+        else:
+            self.db.update(nodes)
+            if root_hash is not None and not self.pruning:
+                self._history.update(roots)
+                self._history.add(root_hash)
+        if self._refs is not None:
+            self._apply(changes)
+
+    def _apply(self, changes):
+        for node_hash, count in changes.items():
+            if count is None:
+                del self._refs[node_hash]
+            else:
+                self._refs[node_hash] = count
+
+    def prune(self, max_nodes=None):
+        """
+        Removes up to `max_nodes` (default: all) of the nodes that are not
+        referenced anymore, returning how many bytes that freed
+        """
+        if not self.pruning:
+            return 0
+        removed = {}
+        changes = {}
+        while self._doomed and (max_nodes is None or len(removed) < max_nodes):
+            node_hash = self._doomed.popleft()
+            if self._counts([node_hash], changes).get(node_hash) != 0:
+                continue  # Referenced again since, or already removed
+            changes[node_hash] = None
+            node = self.db[node_hash]
+            removed[node_hash] = node
+            # Leaf values are 32 bytes, all other nodes are 2 child hashes
+            if len(node) == 64:
+                self._unref(node[:32], changes)
+                self._unref(node[32:], changes)
+
+        if self._stored_refs:
+            self.db.delete_batch(removed.keys(), refs=changes)
+        else:
+            if hasattr(self.db, 'delete_batch'):
+                self.db.delete_batch(removed.keys())
+            else:
+                for node_hash in removed:
+                    del self.db[node_hash]
+            self._apply(changes)
+        reclaimed = sum(len(h) + len(n) for h, n in removed.items())
+        self.pruned_nodes += len(removed)
+        self.reclaimed_bytes += reclaimed
+        return reclaimed
+
+    @property
+    def prunable_nodes(self):
+        """
+        Nodes waiting to be removed by `prune`
+        """
+        return len(self._doomed)
+
+    @classmethod
+    def from_leaves(cls, leaves, db=None, sort=False, flush_every=100000, keep_roots=None,
+            keep_age=None, workers=None, shard_bits=None):
+        """
+        Builds a tree from (key, value) pairs in ascending key order (e.g. a
+        status snapshot), hashing every node exactly once and never reading
+        from the db (last value wins for repeated keys)
+
+        Leaves are streamed: only the nodes along the current path are kept,
+        and new nodes are written to the db every `flush_every` nodes. With
+        `sort`, the leaves are sorted first (which needs them all in memory)
+
+        With `workers`, the keys are split by their top `shard_bits` bits
+        (default: about 8 subtrees per worker) and the subtrees are built in a
+        pool of that many processes, reading their leaves from temporary
+        files. Only the top `shard_bits` levels are hashed here. The tree is
+        the same as when built serially.
+        """
+        tree = cls(db, keep_roots=keep_roots, keep_age=keep_age)
+        if sort:
+            leaves = sorted(leaves, key=lambda leaf: leaf[0])
+
+        def flush(nodes):
+            changes = {}
+            if tree.pruning:
+                nodes = tree._count_new(nodes, changes)
+            tree._write(nodes, None, changes)
+
+        nodes = {}
+        if workers:
+            shard_bits = shard_bits or _default_shard_bits(workers)
+            root_hash = _build_sharded(leaves, shard_bits, workers, nodes, flush)
+        else:
+            root_hash = _build_subtree(leaves, 0, nodes, flush, flush_every)
+        if root_hash != EMPTY_ROOT_HASH:
+            tree._commit(nodes, root_hash)
+        return tree
+
+    def _commit(self, nodes, root_hash, roots=None, stamps=None):
+        """
+        Writes all new nodes along with the new root as a single batch
+
+        `roots` are the roots the update went through (oldest first, ending
+        with the new one), which are kept like the new root (default: only it),
+        with their `stamps` for `keep_age` (default: the newest one)
+        """
+        roots = [root_hash] if roots is None else roots
+        stamps = [None] * len(roots) if stamps is None else stamps
+        changes = {}
+        if self.pruning:
+            nodes = self._count_new(nodes, changes)
+            for root, stamp in zip(roots, stamps):
+                self._retain(root, changes, stamp)
+            # Nodes that only intermediate roots (or none) reference
+            self._doomed.extend(h for h in nodes if changes.get(h) == 0)
+        self._write(nodes, root_hash, changes, roots)
+        # Only move the root once the nodes it references are stored
+        self.root_hash = root_hash
+
+        if self.pruning:
+            # Keep up with the garbage this update made, a bit at a time
+            self.prune(max(self.prune_step, 2 * len(nodes)))
+
+    def overlay(self, root_hash=None):
+        """
+        Returns a copy of the tree (at `root_hash`, default the current root)
+        that can be updated without touching this one (new nodes are kept in
+        memory, everything else is read from here), see `merge`
+        """
+        tree = SparseMerkleTree(ChainMap({}, self.db))
+        tree.root_hash = self.root_hash if root_hash is None else root_hash
+        return tree
+
+    def merge(self, tree, roots, stamps=None):
+        """
+        Writes the updates made to an `overlay` of this tree in one batch,
+        moving to its root. `roots` are the roots it went through that `at`
+        should open (oldest first, ending with its current root), and are
+        kept like the roots of updates made here, with their `stamps` if given
+        (see `keep_age`).
+        """
+        if not isinstance(tree.db, ChainMap) or len(tree.db.maps) != 2 or tree.db.maps[1] is not self.db:
+            raise ValidationError("Can only merge an overlay of this tree")
+        if not roots or roots[-1] != tree.root_hash:
+            raise ValidationError("Roots must end with the root of the overlay")
+        if stamps is not None and len(stamps) != len(roots):
+            raise ValidationError("Need a stamp for every root")
+        self._commit(dict(tree.db.maps[0]), tree.root_hash, roots, stamps)
+
+    def at(self, root_hash):
+        """
+        Returns a read-only view of the tree at an earlier `root_hash`
+
+        Nodes are content addressed, so every stored root is a full version
+        of the tree (sharing its unchanged nodes with the others), and lookups
+        in it take the same 160 db reads. When pruning, only the retained
+        roots are available, otherwise every root this tree (or a `SqliteDB`)
+        has committed is. Other stored nodes, like interior ones, aren't roots.
+        """
+        if self.pruning:
+            stored = root_hash in self._roots
+        elif root_hash in (self.root_hash, EMPTY_ROOT_HASH):
+            stored = True
+        elif hasattr(self.db, 'has_root'):
+            stored = self.db.has_root(root_hash)
+        else:
+            stored = root_hash in self._history
+        if not stored:
+            raise KeyError("Root 0x{} is not stored".format(root_hash.hex()))
+        return SparseMerkleSnapshot(self.db, root_hash)
+
+    def get(self, key):
+        value, _ = self._get(key)
+        return value
+    
+    def branch(self, key):
+        _, branch = self._get(key)
+        return branch
+
+    def compressed_branch(self, key):
+        """
+        Returns the branch as (bitmap, non-default siblings), see `compress_branch`
+        """
+        return compress_branch(self.branch(key))
+
+    def multiproof(self, keys):
+        """
+        Returns one deduplicated proof for updating all `keys` at once
+
+        The tree is merklized level by level (leaf->root), and within a level
+        in key order. Each node needs its sibling unless that sibling is also
+        being updated. The proof is a bitstream with one bit per needed sibling
+        (set if it is a default hash, packed by `_pack_bits`) and the list of
+        non-default siblings, both in the order they are needed.
+        """
+        keys = sorted(set(keys))
+        branches = [self.branch(key) for key in keys]
+        prefixes = [_to_int(key) for key in keys]
+        owners = list(range(len(keys)))  # A key under each node (to get siblings)
+        bits = []
+        siblings = []
+        for depth in range(TREE_HEIGHT, 0, -1):
+            next_prefixes, next_owners = [], []
+            i = 0
+            while i < len(prefixes):
+                prefix = prefixes[i]
+                next_prefixes.append(prefix >> 1)
+                next_owners.append(owners[i])
+                if not prefix & 1 and i+1 < len(prefixes) and prefixes[i+1] == prefix + 1:
+                    i += 2
+                    continue
+
+                sibling = branches[owners[i]][depth-1]
+                if sibling == EMPTY_SUBTREE_HASHES[depth]:
+                    bits.append(1)
+                else:
+                    bits.append(0)
+                    siblings.append(sibling)
+                i += 1
+            prefixes, owners = next_prefixes, next_owners
+
+        return _pack_bits(bits), siblings
+
+    def _get(self, key):
+        """
+        Returns db value and branch in root->leaf order
+        """
+        validate_is_bytes(key)
+        validate_length(key, 20)
+        branch = []
+
+        target_bit = 1 << (TREE_HEIGHT - 1)
+        path = _to_int(key)
+        node_hash = self.root_hash
+        # Append the sibling to the branch
+        # Iterate on the parent
+        for i in range(TREE_HEIGHT):
+            if node_hash == EMPTY_SUBTREE_HASHES[i]:
+                # The rest of the path is an empty subtree, so the remaining
+                # siblings are all defaults and don't need a db lookup
+                branch.extend(EMPTY_NODE_HASHES[i:])
+                return EMPTY_VALUE, branch
+
+            node = self.db[node_hash]
+            if path & target_bit:
+                branch.append(node[:32])
+                node_hash = node[32:]
+            else:
+                branch.append(node[32:])
+                node_hash = node[:32]
+            target_bit >>= 1
+
+        if node_hash == EMPTY_LEAF_NODE_HASH:
+            return EMPTY_VALUE, branch
+
+        return self.db[node_hash], branch
+
+    def set(self, key, value):
+        """
+        Returns all updated hashes in root->leaf order
+        """
+        validate_is_bytes(key)
+        validate_length(key, 20)
+        validate_is_bytes(value)
+
+        path = _to_int(key)
+        branch = self.branch(key)
+        node = value
+        nodes = {}
+        proof_update = []
+
+        target_bit = 1
+        depth = TREE_HEIGHT
+        # branch is in root->leaf order, so flip
+        for sibling in reversed(branch):
+            # Set
+            node_hash = keccak(node)
+            proof_update.append(node_hash)
+            if node_hash != EMPTY_SUBTREE_HASHES[depth]:
+                nodes[node_hash] = node
+
+            # Update
+            if (path & target_bit):
+                node = sibling + node_hash
+            else:
+                node = node_hash + sibling
+
+            target_bit <<= 1
+            depth -= 1
+
+        root_hash = keccak(node)
+        if root_hash != EMPTY_ROOT_HASH:
+            nodes[root_hash] = node
+        self._commit(nodes, root_hash)
+        # updates need to be in root->leaf order, so flip back
+        return list(reversed(proof_update))
+
+    def set_many(self, items):
+        """
+        Sets a batch of (key, value) pairs in one bottom-up pass, hashing
+        every updated node exactly once (last value wins for repeated keys)
+
+        Returns the new root hash and a dict of all updated hashes for each
+        key in root->leaf order (same format as `set`)
+        """
+        batch = {}
+        for key, value in items:
+            validate_is_bytes(key)
+            validate_length(key, 20)
+            validate_is_bytes(value)
+            batch[key] = value
+
+        keys = sorted(batch.keys())
+        paths = [_to_int(key) for key in keys]
+        values = [batch[key] for key in keys]
+        # Collected in leaf->root order, flipped at the end
+        updates = [[] for _ in keys]
+
+        if keys:
+            nodes = {}
+            root_hash = self._set_many(
+                    self.root_hash, 0, 0, len(keys), paths, values, updates, nodes
+                )
+            self._commit(nodes, root_hash)
+
+        # updates need to be in root->leaf order, so flip back
+        return self.root_hash, dict((k, list(reversed(u))) for k, u in zip(keys, updates))
+
+    def _set_many(self, node_hash, depth, lo, hi, paths, values, updates, nodes):
+        """
+        Returns the updated hash of the node at `depth` containing the sorted
+        paths[lo:hi], recursing only into subtrees that are modified
+        """
+        if depth == TREE_HEIGHT:
+            # Keys are unique, so there is only one value to set at the leaf
+            node = values[lo]
+            node_hash = keccak(node)
+            if node_hash != EMPTY_LEAF_NODE_HASH:
+                nodes[node_hash] = node
+            return node_hash
+
+        if node_hash == EMPTY_SUBTREE_HASHES[depth]:
+            left = right = EMPTY_SUBTREE_HASHES[depth+1]
+        else:
+            node = self.db[node_hash]
+            left, right = node[:32], node[32:]
+
+        # Paths are sorted, so all the paths going left come first
+        target_bit = 1 << (TREE_HEIGHT - 1 - depth)
+        prefix = paths[lo] & ~((target_bit << 1) - 1)
+        mid = bisect_left(paths, prefix | target_bit, lo, hi)
+
+        if lo < mid:
+            left = self._set_many(left, depth+1, lo, mid, paths, values, updates, nodes)
+            for i in range(lo, mid):
+                updates[i].append(left)
+
+        if mid < hi:
+            right = self._set_many(right, depth+1, mid, hi, paths, values, updates, nodes)
+            for i in range(mid, hi):
+                updates[i].append(right)
+
+        node = left + right
+        node_hash = keccak(node)
+        if node_hash != EMPTY_SUBTREE_HASHES[depth]:
+            nodes[node_hash] = node
+        return node_hash
+
+    def exists(self, key):
+        validate_is_bytes(key)
+        validate_length(key, 20)
+        return (self.get(key) != EMPTY_VALUE)
+
+    def delete(self, key):
+        """
+        Equals to setting the value to None
+        """
+        validate_is_bytes(key)
+        validate_length(key, 20)
+
+        self.set(key, EMPTY_VALUE)
+
+    #
+    # Dictionary API
+    #
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        return self.set(key, value)
+
+    def __delitem__(self, key):
+        return self.delete(key)
+
+    def __contains__(self, key):
+        return self.exists(key)
+
+
+class SparseMerkleSnapshot(SparseMerkleTree):
+    """
+    A tree at a fixed root, reading the nodes of the tree it came from (see
+    `SparseMerkleTree.at`). Updates raise, use `overlay` to update a copy.
+    """
+    def __init__(self, db, root_hash):
+        super().__init__(db)
+        self.root_hash = root_hash
+
+    def _commit(self, nodes, root_hash):
+        raise ValidationError("Can't update a snapshot, use `overlay` for a copy")
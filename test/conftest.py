@@ -0,0 +1,78 @@
+"""
+Fixtures shared by the contract tests (`vy_deployer` comes from the
+pytest-ethereum plugin, on top of the `w3`, `manifest` and `package` here)
+"""
+from pathlib import Path
+
+import pytest
+from eth_utils import to_canonical_address
+
+
+AUTHORIZED = (1).to_bytes(32, byteorder='big')
+
+# Contracts the tests deploy (root-chain.vy is a draft that doesn't compile yet)
+CONTRACTS = ('auth-list', 'gun-token', 'operator-pool')
+# eth-tester's default block gas limit (~3.1M) can't deploy the authlist,
+# or fit the largest batch updates
+GAS_LIMIT = 10000000
+
+
+# The chain tooling is only imported by the tests that use it, so the
+# tree and service tests run without it
+@pytest.fixture
+def w3():
+    from eth_tester import EthereumTester, PyEVMBackend
+    from web3 import Web3
+    from web3.providers.eth_tester import EthereumTesterProvider
+    params = PyEVMBackend._generate_genesis_params(overrides={'gas_limit': GAS_LIMIT})
+    return Web3(EthereumTesterProvider(EthereumTester(PyEVMBackend(genesis_parameters=params))))
+
+
+@pytest.fixture
+def manifest():
+    from ethpm.tools import builder as b
+    from pytest_ethereum.plugins import (
+            generate_compiler_output,
+            generate_contract_types,
+            generate_inline_sources,
+        )
+    # Relative to the repo root, like the plugin's own `manifest`
+    compiler_output = generate_compiler_output([Path('contracts', name + '.vy') for name in CONTRACTS])
+    return b.build(
+            {},
+            b.package_name('gunclear'),
+            b.version('1.0.0'),
+            b.manifest_version('2'),
+            *generate_inline_sources(compiler_output),
+            *generate_contract_types(compiler_output),
+            b.validate(),
+        )
+
+
+@pytest.fixture
+def package(manifest, w3):
+    from ethpm import Package
+    from web3 import Web3
+    # ethpm swaps in its own contract class for all of its web3, which only
+    # takes canonical addresses, so it gets a web3 of its own on the same chain
+    return Package(manifest, Web3(w3.providers[0]))
+
+
+@pytest.fixture
+def authlist(vy_deployer):
+    # We don't need the address...
+    package, _ = vy_deployer.deploy('auth-list')
+    return package.deployments.get_contract_instance('auth-list')
+
+
+@pytest.fixture
+def authorize(w3, authlist):
+    """
+    Authorizes an account on the contract as the operator, with a branch
+    from `smt`, and mirrors the update in `smt`
+    """
+    def authorize(smt, acct):
+        branch = smt.branch(to_canonical_address(acct))
+        authlist.functions.authorize(acct, branch).transact({'from':w3.eth.accounts[0]})
+        smt.set(to_canonical_address(acct), AUTHORIZED)
+    return authorize
@@ -0,0 +1,99 @@
+import pytest
+from eth_tester.exceptions import TransactionFailed
+from eth_utils import to_canonical_address, to_checksum_address
+
+from smt import SparseMerkleTree
+
+
+AUTHORIZED = (1).to_bytes(32, byteorder='big')
+
+
+def test_empty_root(authlist):
+    # The contract and the SMT agree on the empty tree
+    assert authlist.functions.root().call() == SparseMerkleTree().root_hash
+
+
+def test_authorize(w3, authlist):
+    smt = SparseMerkleTree()
+    for acct in w3.eth.accounts[1:4]:
+        branch = smt.branch(to_canonical_address(acct))
+        # Only the operator can authorize
+        with pytest.raises(TransactionFailed):
+            authlist.functions.authorize(acct, branch).transact({'from':w3.eth.accounts[1]})
+        authlist.functions.authorize(acct, branch).transact({'from':w3.eth.accounts[0]})
+        smt.set(to_canonical_address(acct), AUTHORIZED)
+        assert authlist.functions.status(acct).call() == 1
+        assert authlist.functions.root().call() == smt.root_hash
+
+
+def test_authorizeCompressed(w3, authlist):
+    smt = SparseMerkleTree()
+    for acct in w3.eth.accounts[1:4]:
+        bitmap, siblings = smt.compressed_branch(to_canonical_address(acct))
+        # A stale or mangled proof doesn't validate
+        if siblings:
+            with pytest.raises(TransactionFailed):
+                authlist.functions.authorizeCompressed(acct, bitmap, b''.join(siblings[1:])).\
+                        transact({'from':w3.eth.accounts[0]})
+        with pytest.raises(TransactionFailed):
+            authlist.functions.authorizeCompressed(acct, bitmap, b''.join(siblings) + b'\x00' * 32).\
+                    transact({'from':w3.eth.accounts[0]})
+        # Trailing bytes that aren't a whole sibling are rejected too
+        with pytest.raises(TransactionFailed):
+            authlist.functions.authorizeCompressed(acct, bitmap, b''.join(siblings) + b'\x00' * 5).\
+                    transact({'from':w3.eth.accounts[0]})
+        # Only the non-default siblings are needed
+        authlist.functions.authorizeCompressed(acct, bitmap, b''.join(siblings)).\
+                transact({'from':w3.eth.accounts[0]})
+        smt.set(to_canonical_address(acct), AUTHORIZED)
+        assert authlist.functions.status(acct).call() == 1
+        assert authlist.functions.root().call() == smt.root_hash
+
+
+def set_batch(w3, authlist, smt, updates):
+    # Pad out the fixed-size arguments
+    keys = sorted(updates.keys())
+    defaults, siblings = smt.multiproof(keys)
+    accounts = b''.join(k.rjust(32, b'\x00') for k in keys)
+    statuses = [updates[k] for k in keys] + [0] * (256 - len(keys))
+    txn_hash = authlist.functions.setBatch(accounts, statuses, len(keys), defaults, b''.join(siblings)).\
+            transact({'from':w3.eth.accounts[0]})
+    smt.set_many((k, s.to_bytes(32, byteorder='big')) for k, s in updates.items())
+    return w3.eth.waitForTransactionReceipt(txn_hash)
+
+
+def test_setBatch(w3, authlist):
+    smt = SparseMerkleTree()
+    acct = w3.eth.accounts[1]
+    authlist.functions.authorize(acct, smt.branch(to_canonical_address(acct))).transact({'from':w3.eth.accounts[0]})
+    smt.set(to_canonical_address(acct), AUTHORIZED)
+
+    # Two keys that are siblings at the leaf, plus more accounts
+    updates = dict((to_canonical_address(a), 1) for a in w3.eth.accounts[2:6])
+    updates[b'\x00' * 19 + b'\x01'] = 1
+    updates[b'\x00' * 19 + b'\x02'] = 1
+    # Reviews can be batched along with authorizations
+    updates[to_canonical_address(acct)] = 2
+    set_batch(w3, authlist, smt, updates)
+    assert authlist.functions.root().call() == smt.root_hash
+    for key, status in updates.items():
+        assert authlist.functions.status(to_checksum_address(key)).call() == status
+
+    # Stale multiproofs don't validate
+    keys = [to_canonical_address(w3.eth.accounts[6])]
+    defaults, siblings = SparseMerkleTree().multiproof(keys)
+    with pytest.raises(TransactionFailed):
+        authlist.functions.setBatch(
+                keys[0].rjust(32, b'\x00'), [1] * 256, 1, defaults, b''.join(siblings)
+            ).transact({'from':w3.eth.accounts[0]})
+
+    # Accounts must be valid addresses (zero-padded)
+    defaults, siblings = smt.multiproof(keys)
+    with pytest.raises(TransactionFailed):
+        authlist.functions.setBatch(
+                b'\x01' + keys[0].rjust(31, b'\x00'), [1] * 256, 1, defaults, b''.join(siblings)
+            ).transact({'from':w3.eth.accounts[0]})
+
+    # Statuses follow the same rules as the single updates
+    with pytest.raises(TransactionFailed):
+        set_batch(w3, authlist, smt, {to_canonical_address(w3.eth.accounts[7]): 3})
@@ -0,0 +1,62 @@
+import random
+import time
+
+import pytest
+
+from backfill import Backfill
+
+
+class StandInNode:
+    """
+    Serves synthetic logs over `eth.getLogs`, rejecting queries with too many
+    results like public nodes do, and answering in a random order
+    """
+    def __init__(self, num_blocks, logs_per_block, max_results, seed=0):
+        rng = random.Random(seed)
+        self.logs = [
+                {'blockNumber': b, 'logIndex': i, 'data': rng.getrandbits(32)}
+                for b in range(num_blocks)
+                for i in range(rng.randrange(logs_per_block + 1))
+            ]
+        self.max_results = max_results
+        self.rng = rng
+        self.eth = self
+        self.queries = []
+
+    def getLogs(self, params):
+        self.queries.append((params['fromBlock'], params['toBlock']))
+        logs = [l for l in self.logs if params['fromBlock'] <= l['blockNumber'] <= params['toBlock']]
+        if len(logs) > self.max_results:
+            raise ValueError({'code': -32005, 'message': 'query returned more than {} results'.format(self.max_results)})
+        time.sleep(self.rng.random() / 1000)  # Chunks complete out of order
+        logs.reverse()  # Ordering within a response is not guaranteed
+        return logs
+
+
+def test_backfill_in_order():
+    node = StandInNode(2000, 5, max_results=200)
+    backfill = Backfill(node, {}, chunk_size=500, workers=8)
+    logs = list(backfill.run(0, 1999))
+    # Everything is delivered exactly once, in (block, log index) order
+    assert logs == node.logs
+    # The chunk size adapted down to what the node can serve
+    assert backfill.chunk_size < 500
+    assert backfill.logs == len(node.logs)
+    assert backfill.logs_per_sec > 0
+
+
+def test_backfill_partial_range_and_decode():
+    node = StandInNode(100, 3, max_results=1000)
+    backfill = Backfill(node, {}, decode=lambda l: l['data'], chunk_size=7, workers=2)
+    expected = [l['data'] for l in node.logs if 10 <= l['blockNumber'] <= 50]
+    assert list(backfill.run(10, 50)) == expected
+    # Chunks are contiguous and cover exactly the range
+    assert sorted(node.queries)[0][0] == 10
+    assert max(q[1] for q in node.queries) == 50
+
+
+def test_backfill_other_errors():
+    node = StandInNode(10, 5, max_results=0)
+    node.getLogs = lambda params: (_ for _ in ()).throw(ValueError("execution reverted"))
+    with pytest.raises(ValueError):
+        list(Backfill(node, {}).run(0, 9))
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_gas_baseline():
+    # No function may use more gas than in the committed baseline
+    result = subprocess.run(
+            [sys.executable, str(ROOT / 'bench' / 'gas_profile.py'), '--check'],
+            cwd=str(ROOT), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+    assert result.returncode == 0, result.stderr.decode()
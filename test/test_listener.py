@@ -0,0 +1,204 @@
+import pytest
+from eth_utils import to_canonical_address
+
+from smt import TREE_HEIGHT, EMPTY_VALUE, SparseMerkleTree, compress_branch
+from listener import Listener
+
+
+AUTHORIZED = (1).to_bytes(32, byteorder='big')
+
+
+def authorize_compressed(w3, authlist, smt, acct):
+    bitmap, siblings = smt.compressed_branch(to_canonical_address(acct))
+    authlist.functions.authorizeCompressed(acct, bitmap, b''.join(siblings)).\
+            transact({'from':w3.eth.accounts[0]})
+    smt.set(to_canonical_address(acct), AUTHORIZED)
+
+
+def test_multiple_accounts(w3, authlist, authorize):
+    smt = SparseMerkleTree()
+    for acct in w3.eth.accounts[1:3]:
+        authorize(smt, acct)
+
+    # One listener replays the logs once for all accounts
+    listener = Listener(w3, authlist.address, w3.eth.accounts[1:3])
+    assert listener.updated
+    for acct in w3.eth.accounts[1:3]:
+        assert listener.branch(acct) == smt.branch(to_canonical_address(acct))
+        assert listener.status(acct) == 1
+
+    # New updates are fanned out to all tracked proofs
+    authorize(smt, w3.eth.accounts[3])
+    listener.sync()
+    assert listener.updated
+    for acct in w3.eth.accounts[1:3]:
+        assert listener.branch(acct) == smt.branch(to_canonical_address(acct))
+
+    # Accounts can be added mid-stream from the mirror
+    listener.add(w3.eth.accounts[4])
+    assert listener.branch(w3.eth.accounts[4]) == smt.branch(to_canonical_address(w3.eth.accounts[4]))
+    assert listener.status(w3.eth.accounts[4]) == 0
+    assert listener.status(w3.eth.accounts[3]) == 1
+
+
+def test_every_root(w3, authlist, authorize):
+    smt = SparseMerkleTree()
+    listener = Listener(w3, authlist.address)
+    key = to_canonical_address(w3.eth.accounts[1])
+    versions = []
+    for acct in w3.eth.accounts[1:4]:
+        authorize(smt, acct)
+        versions.append((smt.root_hash, smt.branch(key)))
+
+    # A single sync over all the updates still keeps every root they made
+    listener.sync()
+    for root_hash, branch in versions:
+        assert listener.tree.at(root_hash).branch(key) == branch
+        assert listener.tree.at(root_hash).get(key) == AUTHORIZED
+
+    # Roots are kept by the block they were replaced in (one update per block)
+    recent = Listener(w3, authlist.address, keep_blocks=0)
+    with pytest.raises(KeyError):
+        recent.tree.at(versions[0][0])
+    for root_hash, branch in versions[1:]:
+        assert recent.tree.at(root_hash).branch(key) == branch
+
+
+def test_audit(w3, authlist, authorize):
+    smt = SparseMerkleTree()
+    for acct in w3.eth.accounts[1:3]:
+        authorize(smt, acct)
+    listener = Listener(w3, authlist.address)
+    assert listener.audit(w3.eth.accounts[:5], batch_size=2) == {}
+
+    # Reads are pinned to the last synced block, so they match the mirror
+    authorize(smt, w3.eth.accounts[3])
+    assert listener.audit(w3.eth.accounts[:5]) == {}
+    listener._smt.set(to_canonical_address(w3.eth.accounts[4]), AUTHORIZED)
+    with pytest.raises(AssertionError):
+        listener.audit(w3.eth.accounts[:5])
+
+
+def test_checkpoint(w3, authlist, authorize, tmp_path):
+    smt = SparseMerkleTree()
+    for acct in w3.eth.accounts[1:3]:
+        authorize(smt, acct)
+
+    checkpoint = tmp_path / 'authlist.db'
+    listener = Listener(w3, authlist.address, [w3.eth.accounts[1]], checkpoint=checkpoint)
+    assert checkpoint.exists()
+    assert listener.block_number == w3.eth.blockNumber
+    root_hash = listener.tree.root_hash
+    listener.tree.db.close()
+
+    authorize(smt, w3.eth.accounts[3])
+
+    # A new listener reopens the mirror at the checkpoint, and only syncs the delta
+    resumed = Listener(w3, authlist.address, [w3.eth.accounts[1]], checkpoint=checkpoint)
+    assert resumed.updated
+    assert resumed.block_number == w3.eth.blockNumber
+    assert resumed.backfill.logs == 1
+    assert resumed.accounts == [to_canonical_address(w3.eth.accounts[1])]
+    for acct in w3.eth.accounts[1:5]:
+        assert resumed.branch(acct) == smt.branch(to_canonical_address(acct))
+    # Along with its history
+    assert resumed.tree.at(root_hash).get(to_canonical_address(w3.eth.accounts[3])) == EMPTY_VALUE
+
+
+def test_compact_updates(w3, authlist, authorize):
+    smt = SparseMerkleTree()
+    authorize(smt, w3.eth.accounts[1])
+    authorize_compressed(w3, authlist, smt, w3.eth.accounts[2])
+
+    # Both event encodings can be mixed, the listener recomputes the node updates
+    listener = Listener(w3, authlist.address, w3.eth.accounts[1:3])
+    authorize_compressed(w3, authlist, smt, w3.eth.accounts[3])
+    listener.sync()
+    assert listener.tree.root_hash == smt.root_hash
+    for acct in w3.eth.accounts[1:4]:
+        assert listener.branch(acct) == smt.branch(to_canonical_address(acct))
+
+
+def test_non_canonical_compact_update(w3, authlist, authorize):
+    smt = SparseMerkleTree()
+    authorize(smt, w3.eth.accounts[1])
+    listener = Listener(w3, authlist.address, w3.eth.accounts[1:3])
+
+    # The contract also takes default siblings sent in full, with their bit clear
+    acct = w3.eth.accounts[2]
+    branch = smt.branch(to_canonical_address(acct))
+    bitmap, _ = compress_branch(branch)
+    bitmap &= ~((1 << TREE_HEIGHT - 1) | 1)  # Root and leaf level
+    siblings = [s for i, s in enumerate(branch) if not bitmap & (1 << (TREE_HEIGHT - 1 - i))]
+    authlist.functions.authorizeCompressed(acct, bitmap, b''.join(siblings)).\
+            transact({'from':w3.eth.accounts[0]})
+    smt.set(to_canonical_address(acct), AUTHORIZED)
+
+    listener.sync()
+    assert listener.tree.root_hash == smt.root_hash
+    assert listener.branch(acct) == smt.branch(to_canonical_address(acct))
+
+
+def test_failed_sync(w3, authlist, authorize):
+    smt = SparseMerkleTree()
+    authorize(smt, w3.eth.accounts[1])
+    listener = Listener(w3, authlist.address, chunk_size=1, workers=1)
+    block_number, root_hash = listener.block_number, listener.tree.root_hash
+    for acct in w3.eth.accounts[2:5]:
+        authorize(smt, acct)
+
+    # The node fails partway through the range (in chunks of one block, the
+    # chunk size grew during the first sync)
+    listener.backfill.chunk_size = 1
+    fetch = listener.backfill._fetch
+    calls = []
+    def flaky(from_block, to_block, split=False):
+        calls.append(from_block)
+        if len(calls) == 2:
+            raise ValueError("upstream timeout")
+        return fetch(from_block, to_block, split)
+    listener.backfill._fetch = flaky
+    with pytest.raises(ValueError):
+        listener.sync()
+    # Nothing from the range was applied
+    assert (listener.block_number, listener.tree.root_hash) == (block_number, root_hash)
+
+    listener.backfill._fetch = fetch
+    listener.sync()
+    assert listener.tree.root_hash == smt.root_hash
+    assert listener.updated
+
+
+def test_confirmations_and_reorg(w3, authlist, authorize):
+    smt = SparseMerkleTree()
+    listener = Listener(w3, authlist.address, [w3.eth.accounts[1]], confirmations=1)
+    snapshot = w3.testing.snapshot()
+    authorize(smt, w3.eth.accounts[1])
+    listener.sync()
+    # Stays a block behind the head
+    assert listener.block_number == w3.eth.blockNumber - 1
+    w3.testing.mine(1)
+    listener.sync()
+    assert listener.status(w3.eth.accounts[1]) == 1
+
+    # The update is re-organized away, and another one takes its place
+    root_hash = listener.tree.root_hash
+    w3.testing.revert(snapshot)
+    smt = SparseMerkleTree()
+    authorize(smt, w3.eth.accounts[2])
+    w3.testing.mine(2)
+
+    # The last good state is kept until the replay succeeds
+    fetch = listener.backfill._fetch
+    def failing(from_block, to_block, split=False):
+        raise ValueError("upstream timeout")
+    listener.backfill._fetch = failing
+    with pytest.raises(ValueError):
+        listener.sync()
+    assert listener.tree.root_hash == root_hash
+    assert listener.tree.get(to_canonical_address(w3.eth.accounts[1])) == AUTHORIZED
+
+    listener.backfill._fetch = fetch
+    listener.sync()
+    assert listener.tree.root_hash == smt.root_hash
+    assert listener.branch(w3.eth.accounts[1]) == smt.branch(to_canonical_address(w3.eth.accounts[1]))
@@ -0,0 +1,171 @@
+import pytest
+from eth_account import Account
+from eth_utils import to_canonical_address, to_checksum_address
+
+from smt import SparseMerkleTree
+from listener import Listener
+from onboarding import Onboarding, AUTHORIZED
+from pipeline import TxPipeline
+
+
+IN_REVIEW = (2).to_bytes(32, byteorder='big')
+
+
+@pytest.fixture
+def operator(w3, authlist):
+    # Pipelines sign locally, so the operator needs a key we know
+    account = Account.create()
+    w3.eth.sendTransaction({'from':w3.eth.accounts[0], 'to':account.address, 'value':10**18})
+    authlist.functions.nominateOperator(account.address).transact({'from':w3.eth.accounts[0]})
+    pipeline = TxPipeline(w3, account, poll_interval=0)
+    pipeline.submit(authlist.functions.acceptOperatorNominee())
+    assert all(r.success for r in pipeline.wait())
+    return account
+
+
+def new_accounts(n):
+    return [Account.create().address for _ in range(n)]
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_onboarding(w3, authlist, operator, tmp_path, compressed):
+    listener = Listener(w3, authlist.address)
+    onboarding = Onboarding(
+            listener,
+            authlist,
+            TxPipeline(w3, operator, poll_interval=0),
+            checkpoint=tmp_path / 'onboard.json',
+            compressed=compressed,
+        )
+    accounts = new_accounts(5)
+    assert onboarding.run(accounts) == accounts
+
+    smt = SparseMerkleTree()
+    smt.set_many((to_canonical_address(a), AUTHORIZED) for a in accounts)
+    assert authlist.functions.root().call() == smt.root_hash
+    assert all(authlist.functions.status(a).call() == 1 for a in accounts)
+
+
+def test_onboarding_skips_and_resumes(w3, authlist, operator, tmp_path):
+    smt = SparseMerkleTree()
+    authorized, in_review = new_accounts(2)
+    pipeline = TxPipeline(w3, operator, poll_interval=0)
+    for acct, method, status in [
+            (authorized, 'authorize', AUTHORIZED),
+            (in_review, 'authorize', AUTHORIZED),
+            (in_review, 'review', IN_REVIEW),
+        ]:
+        pipeline.submit(getattr(authlist.functions, method)(acct, smt.branch(to_canonical_address(acct))))
+        pipeline.wait()
+        smt.set(to_canonical_address(acct), status)
+
+    checkpoint = tmp_path / 'onboard.json'
+    accounts = new_accounts(3)
+    batch = accounts[:1] + [authorized, in_review] + accounts[1:]
+    onboarding = Onboarding(Listener(w3, authlist.address), authlist,
+            TxPipeline(w3, operator, poll_interval=0), checkpoint=checkpoint)
+    # Already authorized counts as done, other statuses can't be authorized
+    assert onboarding.run(batch) == accounts[:1] + [authorized] + accounts[1:]
+    assert list(onboarding.failed) == [to_checksum_address(in_review)]
+
+    # Resuming from the checkpoint has nothing left to send
+    pipeline = TxPipeline(w3, operator, poll_interval=0)
+    resumed = Onboarding(Listener(w3, authlist.address), authlist, pipeline, checkpoint=checkpoint)
+    assert resumed.run(batch) == accounts[:1] + [authorized] + accounts[1:]
+    assert pipeline.results == []
+    assert resumed.failed == onboarding.failed
+
+
+class FlakyPipeline(TxPipeline):
+    """
+    Sends the update of some accounts once with too little gas (mined, out of
+    gas), or crashes when it gets to them
+    """
+    def __init__(self, *args, out_of_gas=(), crash=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.out_of_gas = set(out_of_gas)
+        self.crash = set(crash)
+
+    def submit(self, call, label=None, gas=None):
+        if label in self.crash:
+            self.crash.remove(label)
+            raise KeyboardInterrupt
+        if label in self.out_of_gas:
+            self.out_of_gas.remove(label)
+            gas = 60000
+        return super().submit(call, label=label, gas=gas)
+
+
+@pytest.mark.parametrize('retries', [0, 1])
+def test_onboarding_failure(w3, authlist, operator, tmp_path, retries):
+    accounts = new_accounts(5)
+    pipeline = FlakyPipeline(w3, operator, poll_interval=0, out_of_gas=accounts[1:2])
+    checkpoint = tmp_path / 'onboard.json'
+    onboarding = Onboarding(Listener(w3, authlist.address), authlist, pipeline,
+            checkpoint=checkpoint, compressed=True, retries=retries)
+    done = onboarding.run(accounts)
+
+    # The round stopped at the failure instead of sending updates that must fail
+    failed = [r for r in pipeline.results if not r.success]
+    assert [r.label for r in failed] == accounts[1:2]
+    if retries:
+        assert done == accounts
+        assert len(pipeline.results) == len(accounts) + 1
+    else:
+        assert done == accounts[:1] + accounts[2:]
+        assert list(onboarding.failed) == accounts[1:2]
+        assert len(pipeline.results) == len(accounts)
+
+    # Resuming from the checkpoint keeps the outcome, and sends nothing
+    pipeline = TxPipeline(w3, operator, poll_interval=0)
+    resumed = Onboarding(Listener(w3, authlist.address), authlist, pipeline,
+            checkpoint=checkpoint, compressed=True, retries=retries)
+    assert resumed.run(accounts) == done
+    assert resumed.failed == onboarding.failed
+    assert pipeline.results == []
+
+
+
+class FlakyOnboarding(Onboarding):
+    """
+    Fails the first `bad_estimates` gas estimates (e.g. a rate-limited node)
+    """
+    def __init__(self, *args, bad_estimates=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bad_estimates = bad_estimates
+
+    def _estimate(self, call):
+        if self.bad_estimates:
+            self.bad_estimates -= 1
+            raise ValueError("Rate limited")
+        return super()._estimate(call)
+
+
+@pytest.mark.parametrize('retries', [0, 1])
+def test_onboarding_failed_estimate(w3, authlist, operator, retries):
+    accounts = new_accounts(3)
+    pipeline = TxPipeline(w3, operator, poll_interval=0)
+    onboarding = FlakyOnboarding(Listener(w3, authlist.address), authlist, pipeline,
+            retries=retries, bad_estimates=1)
+    # Only the round (and the account it was estimated for) failed
+    if retries:
+        assert onboarding.run(accounts) == accounts
+    else:
+        assert onboarding.run(accounts) == accounts[1:]
+        assert list(onboarding.failed) == accounts[:1]
+        assert 'Rate limited' in onboarding.failed[accounts[0]]
+    assert all(r.success for r in pipeline.results)
+
+def test_onboarding_resumes_after_crash(w3, authlist, operator, tmp_path):
+    accounts = new_accounts(4)
+    checkpoint = tmp_path / 'onboard.json'
+    pipeline = FlakyPipeline(w3, operator, poll_interval=0, crash=accounts[2:3])
+    with pytest.raises(KeyboardInterrupt):
+        Onboarding(Listener(w3, authlist.address), authlist, pipeline, checkpoint=checkpoint).run(accounts)
+
+    # What got mined before the crash is found on chain, the rest is sent
+    pipeline = TxPipeline(w3, operator, poll_interval=0)
+    resumed = Onboarding(Listener(w3, authlist.address), authlist, pipeline, checkpoint=checkpoint)
+    assert resumed.run(accounts) == accounts
+    assert [r.label for r in pipeline.results] == accounts[2:]
+    assert all(r.success for r in pipeline.results)
@@ -0,0 +1,70 @@
+import io
+import json
+from collections import namedtuple
+from pathlib import Path
+
+import pytest
+from vyper.compiler import compile as vyc
+from vyper.compiler import mk_full_signature as vya
+from eth_utils import to_canonical_address
+
+from daemon import OperatorService
+from smt import SparseMerkleTree
+
+
+Account = namedtuple('Account', ['address'])
+AUTHORIZED = (1).to_bytes(32, byteorder='big')
+
+
+def interface(name):
+    with open(Path(__file__).resolve().parents[1] / 'contracts' / (name + '.vy'), 'r') as f:
+        code = f.read()
+    return {'abi': vya(code), 'bytecode': vyc(code), 'bytecode_runtime': vyc(code, bytecode_runtime=True)}
+
+
+@pytest.fixture
+def operator(w3):
+    # eth-tester accounts are unlocked, so no key is needed
+    interfaces = dict((name, interface(name)) for name in ('auth-list', 'gun-token'))
+    return OperatorService(w3, interfaces, Account(w3.eth.accounts[0]))
+
+
+def run(operator, *commands):
+    out = io.StringIO()
+    operator.run(commands, out)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_operator_commands(w3, operator):
+    authlist, token = [r['result'] for r in run(operator, 'deploy auth-list', '', 'deploy gun-token')]
+
+    smt = SparseMerkleTree()
+    accounts = w3.eth.accounts[1:4]
+    replies = run(operator,
+            'authorize {} {}'.format(authlist, accounts[0]),
+            'authorize {} {} compressed'.format(authlist, accounts[1]),
+            'authorize {} {}'.format(authlist, accounts[2]),
+            'mint {} 0x1234 {}'.format(token, accounts[0]),
+            'root {}'.format(authlist),
+            'status {} {}'.format(authlist, accounts[1]),
+        )
+    assert all('result' in r for r in replies)
+    for acct in accounts:
+        smt.set(to_canonical_address(acct), AUTHORIZED)
+    # One mirror is kept between commands, and follows the updates it made
+    assert replies[-2]['result'] == '0x' + smt.root_hash.hex()
+    assert replies[-1]['result'] == 1
+    assert len(operator._listeners) == 1
+
+
+def test_operator_errors(w3, operator):
+    authlist = run(operator, 'deploy auth-list')[0]['result']
+    replies = run(operator,
+            'approve {}'.format(authlist),
+            'root',
+            'authorize {} {} uncompressed'.format(authlist, w3.eth.accounts[1]),
+            'root {}'.format(authlist),
+        )
+    # Errors don't stop the commands after them
+    assert [list(r) for r in replies] == [['error']] * 3 + [['result']]
+    assert replies[0]['error'] == "Unknown command 'approve'"
@@ -0,0 +1,149 @@
+import json
+from collections import namedtuple
+
+from hashing import keccak
+from pipeline import TxPipeline
+
+
+Signed = namedtuple('Signed', ['rawTransaction', 'hash'])
+
+
+class StandInAccount:
+    address = '0x' + '11' * 20
+
+    def signTransaction(self, tx):
+        raw = json.dumps(tx, sort_keys=True).encode()
+        return Signed(raw, keccak(raw))
+
+
+class StandInNode:
+    """
+    Keeps a mempool and only mines when told to, picking the highest gas
+    price for each nonce like real nodes do. Transactions with `fail` in
+    them revert, and ones with `reject` can't be estimated/sent
+    """
+    gasPrice = 10
+
+    def __init__(self, nonce=0):
+        self.eth = self
+        self.nonce = nonce
+        self.mempool = {}  # nonce -> (gas price, hash, tx)
+        self.receipts = {}
+        self.sent = []
+        self.block_number = 0
+
+    def getTransactionCount(self, address, block):
+        return self.nonce + len(self.mempool)
+
+    def estimateGas(self, tx):
+        if 'reject' in tx:
+            raise ValueError("execution reverted")
+        return 21000
+
+    def sendRawTransaction(self, raw):
+        tx = json.loads(raw.decode())
+        if tx['nonce'] < self.nonce:
+            raise ValueError("nonce too low")
+        txn_hash = keccak(raw)
+        current = self.mempool.get(tx['nonce'])
+        if current is None or tx['gasPrice'] > current[0]:
+            self.mempool[tx['nonce']] = (tx['gasPrice'], txn_hash, tx)
+        self.sent.append(tx)
+        return txn_hash
+
+    def mine(self, count=None):
+        self.block_number += 1
+        while self.nonce in self.mempool and count != 0:
+            _, txn_hash, tx = self.mempool.pop(self.nonce)
+            self.receipts[txn_hash] = {
+                    'transactionHash': txn_hash,
+                    'blockNumber': self.block_number,
+                    'gasUsed': tx['gas'],
+                    'status': 0 if 'fail' in tx else 1,
+                }
+            self.nonce += 1
+            count = None if count is None else count - 1
+
+    def getTransactionReceipt(self, txn_hash):
+        return self.receipts.get(txn_hash)
+
+
+def test_pipeline(tmp_path):
+    node = StandInNode(nonce=5)
+    results = tmp_path / 'results.jsonl'
+    pipeline = TxPipeline(node, StandInAccount(), poll_interval=0, results=results)
+
+    subs = [pipeline.submit({'to': i}, label=i) for i in range(10)]
+    subs.append(pipeline.submit({'to': 10, 'fail': True}, label=10))
+    # Everything is broadcast before anything is mined, with consecutive nonces
+    assert [tx['nonce'] for tx in node.sent] == list(range(5, 16))
+    assert len(pipeline.pending) == 11
+
+    # Rejected before broadcast, so the nonce is re-used
+    rejected = pipeline.submit({'to': 11, 'reject': True}, label=11)
+    assert rejected.error and not rejected.hashes
+    assert pipeline.submit({'to': 12}, label=12).tx['nonce'] == 16
+
+    node.mine()
+    pipeline.wait(timeout=1)
+    assert all(s.success for s in subs[:10])
+    assert not subs[10].success
+
+    # Results file has every transaction, in the order they completed
+    lines = [json.loads(l) for l in results.read_text().splitlines()]
+    assert [l['label'] for l in lines] == [11] + list(range(11)) + [12]
+    assert [l['status'] for l in lines] == ['ERROR'] + ['SUCCESS'] * 10 + ['FAIL', 'SUCCESS']
+
+
+def test_pipeline_max_pending():
+    node = StandInNode()
+    pipeline = TxPipeline(node, StandInAccount(), max_pending=3, poll_interval=0)
+    for i in range(3):
+        pipeline.submit({'to': i})
+    # Next submission has to wait for one to be mined
+    node.mine(count=1)
+    pipeline.submit({'to': 3})
+    assert len(pipeline.results) == 1
+    assert len(pipeline.pending) == 3
+
+
+def test_pipeline_gas_bump():
+    node = StandInNode()
+    pipeline = TxPipeline(node, StandInAccount(), bump_after=0, max_gas_price=13, poll_interval=0)
+    sub = pipeline.submit({'to': 0})
+
+    # Stuck transactions are re-sent with the same nonce and a higher price
+    pipeline.poll()
+    assert len(sub.hashes) == 2
+    assert [tx['nonce'] for tx in node.sent] == [0, 0]
+    assert node.sent[1]['gasPrice'] > node.sent[0]['gasPrice']
+    # ...but not past the maximum
+    pipeline.poll()
+    pipeline.poll()
+    assert sub.tx['gasPrice'] == 13
+    assert pipeline.bumps == 2
+
+    node.mine()
+    pipeline.wait(timeout=1)
+    # The replacement is what got mined
+    assert sub.receipt['transactionHash'] == sub.hashes[-1]
+    assert sub.result()['gasPrice'] == 13
+
+
+def test_pipeline_failed_bump():
+    node = StandInNode()
+    pipeline = TxPipeline(node, StandInAccount(), bump_after=0, poll_interval=0)
+    sub = pipeline.submit({'to': 0})
+
+    # The node drops the re-send, so the original price is still the one out there
+    send = node.sendRawTransaction
+    def unavailable(raw):
+        raise ConnectionError("node unavailable")
+    node.sendRawTransaction = unavailable
+    pipeline.poll()
+    assert sub.tx['gasPrice'] == StandInNode.gasPrice
+    assert len(sub.hashes) == 1 and pipeline.bumps == 0
+
+    node.sendRawTransaction = send
+    pipeline.poll()
+    assert sub.tx['gasPrice'] > StandInNode.gasPrice and pipeline.bumps == 1
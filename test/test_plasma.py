@@ -0,0 +1,73 @@
+import random
+
+import pytest
+from eth_keys import keys
+
+from plasma import BlockBuilder, InvalidTransaction, Transaction, verify
+from smt import EMPTY_VALUE, SparseMerkleTree
+
+
+def account(rng):
+    key = rng.getrandbits(256).to_bytes(32, byteorder='big')
+    return key, keys.PrivateKey(key).public_key.to_canonical_address()
+
+
+@pytest.fixture
+def chain():
+    rng = random.Random(0)
+    users = [account(rng) for _ in range(4)]
+    tokens = [rng.getrandbits(160).to_bytes(20, byteorder='big') for _ in range(20)]
+    owners = dict((token_id, rng.choice(users)) for token_id in tokens)
+    return rng, users, owners
+
+
+def test_block(chain):
+    rng, users, owners = chain
+    builder = BlockBuilder(period=3, owners=dict((t, u[1]) for t, u in owners.items()), batch_size=4)
+    moved = sorted(owners)[:10]
+    hashes = {}
+    for token_id in moved:
+        key, _ = owners[token_id]
+        tx = Transaction(token_id, rng.choice(users)[1], 3).sign(key)
+        hashes[token_id] = builder.add(tx)
+
+    # A second transfer in the same period is rejected, even from the new owner
+    token_id = moved[0]
+    new_owner = [k for k, a in users if a == builder.owners[token_id]][0]
+    with pytest.raises(InvalidTransaction):
+        builder.add(Transaction(token_id, users[0][1], 3).sign(new_owner))
+    rejected = builder.extend([
+            Transaction(sorted(owners)[10], users[0][1], 2).sign(owners[sorted(owners)[10]][0]),  # Old period
+            Transaction(sorted(owners)[11], users[0][1], 3).sign(b'\x01' * 32),  # Not the owner
+            Transaction(sorted(owners)[12], users[0][1], 3),  # Not signed
+        ])
+    assert len(rejected) == 3 and builder.rejected == 4
+    assert len(builder) == 10
+
+    root = builder.root
+    block = builder.seal()
+    assert block.root == root and block.period == 3 and builder.period == 4
+    # Only the sealed tree is kept, not the roots of earlier batches
+    expected = SparseMerkleTree()
+    expected.set_many((t, h) for t, h in hashes.items())
+    assert len(block.tree.db) == len(expected.db)
+    for token_id in owners:
+        tx_hash, branch = block.proof(token_id)
+        # Transferred tokens prove their transaction, the rest prove there was none
+        assert tx_hash == hashes.get(token_id, EMPTY_VALUE)
+        assert verify(block.root, token_id, tx_hash, branch)
+    assert not verify(block.root, moved[0], EMPTY_VALUE, block.proof(moved[0])[1])
+
+    # Next period starts empty, and the token can move again
+    builder.add(Transaction(moved[0], users[0][1], 4).sign(new_owner))
+    assert len(builder) == 1
+
+
+def test_encoding(chain):
+    rng, users, owners = chain
+    token_id = sorted(owners)[0]
+    tx = Transaction(token_id, users[1][1], 7).sign(owners[token_id][0])
+    decoded = Transaction.decode(tx.encode())
+    assert decoded.hash == tx.hash and decoded.sender == owners[token_id][1]
+    with pytest.raises(InvalidTransaction):
+        Transaction.decode(tx.encode()[:-1])
@@ -0,0 +1,88 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from eth_utils import to_checksum_address
+
+from reader import BatchReader
+from smt import SparseMerkleTree
+
+
+@pytest.fixture
+def rpc_server(w3):
+    """
+    JSON-RPC endpoint answering `eth_call` batches from the eth-tester chain
+    """
+    batches = []
+    pruned = set()  # Blocks whose state the node no longer has
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            requests = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+            batches.append(len(requests))
+            responses = []
+            for request in reversed(requests):  # Order isn't guaranteed
+                tx, block = request['params']
+                tx['to'] = to_checksum_address(tx['to'])
+                if int(block, 16) in pruned:
+                    responses.append({'jsonrpc': '2.0', 'id': request['id'], 'error': {
+                            'code': -32000, 'message': 'missing trie node 1d2f8a (path )'}})
+                    continue
+                try:
+                    result = {'result': '0x' + bytes(w3.eth.call(tx, int(block, 16))).hex()}
+                except Exception:
+                    result = {'error': {'code': 3, 'message': 'execution reverted'}}
+                responses.append(dict(result, jsonrpc='2.0', id=request['id']))
+            body = json.dumps(responses).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(server.server_port), batches, pruned
+    server.shutdown()
+
+
+@pytest.mark.parametrize('http', [False, True])
+def test_batch_reads(w3, authlist, authorize, rpc_server, http):
+    endpoint_uri, batches, _ = rpc_server
+    smt = SparseMerkleTree()
+    accounts = w3.eth.accounts[1:6]
+    for acct in accounts[:3]:
+        authorize(smt, acct)
+    reader = BatchReader(w3, batch_size=2, workers=2,
+            endpoint_uri=endpoint_uri if http else None)
+    root = smt.root_hash
+
+    # Updates after the reader's block aren't seen
+    authorize(smt, accounts[3])
+    fns = [authlist.functions.root()] + [authlist.functions.status(a) for a in accounts]
+    assert reader.call(fns) == [root, 1, 1, 1, 0, 0]
+    if http:
+        # One round-trip per chunk
+        assert batches == [2, 2, 2]
+        assert reader.requests == 3
+
+
+@pytest.mark.parametrize('http', [False, True])
+def test_reverted_reads(w3, vy_deployer, rpc_server, http):
+    package, _ = vy_deployer.deploy('gun-token')
+    token = package.deployments.get_contract_instance('gun-token')
+    token.functions.mint(w3.eth.accounts[1], 1).transact({'from':w3.eth.accounts[0]})
+    endpoint_uri, _, pruned = rpc_server
+    reader = BatchReader(w3, endpoint_uri=endpoint_uri if http else None)
+    fns = [token.functions.ownerOf(1), token.functions.ownerOf(2)]
+    # Token 2 doesn't exist, so `ownerOf` reverts
+    assert reader.call(fns) == [w3.eth.accounts[1], None]
+
+    if http:
+        # A node error isn't a revert
+        pruned.add(reader.block_number)
+        with pytest.raises(ValueError, match='missing trie node'):
+            reader.call(fns)
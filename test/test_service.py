@@ -0,0 +1,89 @@
+import json
+import random
+
+from eth_utils import to_checksum_address
+
+from daemon import BranchService
+from smt import SparseMerkleTree
+
+
+class MirrorOnly:
+    # The service only needs the listener's mirrored tree
+    def __init__(self, tree):
+        self.tree = tree
+
+
+def get(service, path):
+    header, body = service.respond(path).split(b'\r\n\r\n', 1)
+    return int(header.split(b' ')[1]), json.loads(body.decode())
+
+
+def test_routes():
+    smt = SparseMerkleTree()
+    rng = random.Random(0)
+    keys = [rng.getrandbits(160).to_bytes(20, 'big') for _ in range(10)]
+    smt.set_many((k, (1).to_bytes(32, 'big')) for k in keys)
+    service = BranchService(MirrorOnly(smt))
+
+    code, body = get(service, '/root')
+    assert code == 200 and body['root'] == '0x' + smt.root_hash.hex()
+
+    acct = to_checksum_address(keys[0])
+    code, body = get(service, '/branch/' + acct)
+    assert code == 200
+    assert body['branch'] == ['0x' + n.hex() for n in smt.branch(keys[0])]
+    code, body = get(service, '/branch/{}?compressed'.format(acct))
+    assert len(body['siblings']) == 160 - bin(int(body['bitmap'], 16)).count('1')
+    assert get(service, '/status/' + acct)[1]['status'] == 1
+
+    # Unknown accounts are just empty
+    code, body = get(service, '/status/0x' + '00' * 20)
+    assert code == 200 and body['status'] == 0
+    assert get(service, '/branch/0x' + '00' * 20)[1]['branch'] == ['0x' + n.hex() for n in smt.branch(b'\x00' * 20)]
+
+    assert get(service, '/branch/nope')[0] == 400
+    assert get(service, '/nope')[0] == 404
+
+
+def test_stats():
+    smt = SparseMerkleTree(keep_roots=1)
+    service = BranchService(MirrorOnly(smt))
+    key = b'\x01' * 20
+    smt.set(key, (1).to_bytes(32, 'big'))
+    assert get(service, '/stats')[1]['reclaimed_bytes'] == 0
+    # Only the last root is kept, so the old path is pruned
+    smt.set(key, (2).to_bytes(32, 'big'))
+    code, body = get(service, '/stats')
+    assert code == 200
+    assert body['nodes'] == len(smt.db) == 161
+    assert body['pruned_nodes'] == 161
+    assert body['reclaimed_bytes'] == 32 * 161 + 64 * 160 + 32
+
+
+def test_earlier_root():
+    smt = SparseMerkleTree()
+    service = BranchService(MirrorOnly(smt))
+    key = b'\x01' * 20
+    acct = to_checksum_address(key)
+    smt.set(key, (1).to_bytes(32, 'big'))
+    root = '0x' + smt.root_hash.hex()
+    smt.set(key, (2).to_bytes(32, 'big'))
+
+    code, body = get(service, '/status/{}?root={}'.format(acct, root))
+    assert code == 200 and body['status'] == 1 and body['root'] == root
+    code, body = get(service, '/branch/{}?compressed&root={}'.format(acct, root))
+    assert code == 200 and body['root'] == root
+    assert get(service, '/status/' + acct)[1]['status'] == 2
+
+    assert get(service, '/status/{}?root=0x{}'.format(acct, '01' * 32))[0] == 404
+    assert get(service, '/status/{}?root=0x01'.format(acct))[0] == 400
+
+
+def test_cache_follows_root():
+    smt = SparseMerkleTree()
+    service = BranchService(MirrorOnly(smt))
+    key = b'\x01' * 20
+    assert get(service, '/status/' + to_checksum_address(key))[1]['status'] == 0
+    smt.set(key, (2).to_bytes(32, 'big'))
+    # The cached answer is dropped once the root moves
+    assert get(service, '/status/' + to_checksum_address(key))[1]['status'] == 2
@@ -0,0 +1,573 @@
+import random
+
+import pytest
+
+import hashing
+from smt import (
+        SparseMerkleTree,
+        SparseMerkleProof,
+        SqliteDB,
+        ValidationError,
+        calc_multiroot,
+        calc_node_updates,
+        calc_leaves_root,
+        calc_root,
+        expand_branch,
+        verify_many,
+        EMPTY_VALUE,
+        EMPTY_NODE_HASHES,
+        EMPTY_ROOT_HASH,
+        EMPTY_SUBTREE_HASHES,
+    )
+
+
+def random_items(n, seed=0):
+    rng = random.Random(seed)
+    return [
+            (rng.getrandbits(160).to_bytes(20, 'big'), rng.getrandbits(256).to_bytes(32, 'big'))
+            for _ in range(n)
+        ]
+
+
+def test_set_many_single():
+    items = random_items(1)
+    smt1, smt2 = SparseMerkleTree(db={}), SparseMerkleTree(db={})
+    key, value = items[0]
+    updates = smt1.set(key, value)
+    root, batch_updates = smt2.set_many(items)
+    # A batch of one is the same as a regular update
+    assert root == smt1.root_hash == smt2.root_hash
+    assert batch_updates[key] == updates
+
+
+def test_set_many_matches_set():
+    items = random_items(50)
+    # Repeated keys should take the last value
+    items += [(items[3][0], EMPTY_VALUE), (items[7][0], b'\x01' * 32)]
+    smt1, smt2 = SparseMerkleTree(db={}), SparseMerkleTree(db={})
+    for key, value in items:
+        last_updates = smt1.set(key, value)
+    root, updates = smt2.set_many(items)
+    assert root == smt1.root_hash
+    assert updates[items[-1][0]] == last_updates
+    for key, value in items:
+        assert smt2.get(key) == smt1.get(key)
+        assert smt2.branch(key) == smt1.branch(key)
+        # Updates are the final node hashes in root->leaf order
+        assert len(updates[key]) == 160
+
+
+def test_set_many_existing_tree():
+    items = random_items(20)
+    smt1, smt2 = SparseMerkleTree(db={}), SparseMerkleTree(db={})
+    for key, value in items[:10]:
+        smt1.set(key, value)
+        smt2.set(key, value)
+    for key, value in items[10:]:
+        smt1.set(key, value)
+    root, _ = smt2.set_many(items[10:])
+    assert root == smt1.root_hash
+    # An empty batch is a no-op
+    assert smt2.set_many([])[0] == root
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 300])
+def test_from_leaves(n):
+    items = sorted(random_items(n))
+    expected = SparseMerkleTree()
+    expected.set_many(items)
+
+    # Streams from a generator
+    smt = SparseMerkleTree.from_leaves(item for item in items)
+    assert smt.root_hash == expected.root_hash
+    # Every node is there, and nothing else
+    assert smt.db == expected.db
+    for key, value in items[:10]:
+        assert smt.branch(key) == expected.branch(key)
+
+
+def test_from_leaves_order(tmp_path):
+    items = random_items(100)
+    # Neighbouring keys, and a default value that doesn't need any nodes
+    items += [(b'\x00' * 20, b'\x01' * 32), (b'\x00' * 19 + b'\x01', b'\x02' * 32)]
+    items += [(b'\xff' * 20, EMPTY_VALUE)]
+    expected = SparseMerkleTree()
+    expected.set_many(items)
+
+    with pytest.raises(ValidationError):
+        SparseMerkleTree.from_leaves(items)
+    smt = SparseMerkleTree.from_leaves(items, sort=True)
+    assert smt.root_hash == expected.root_hash
+
+    # Last value wins, like `set_many`
+    key, value = items[0]
+    repeated = sorted(items + [(key, b'\x03' * 32)], key=lambda item: item[0])
+    smt = SparseMerkleTree.from_leaves(repeated)
+    assert smt.get(key) == b'\x03' * 32
+    expected.set(key, b'\x03' * 32)
+    assert smt.root_hash == expected.root_hash
+
+    # Written to the db in batches
+    db = SqliteDB(tmp_path / 'smt.db')
+    smt = SparseMerkleTree.from_leaves(repeated, db=db, flush_every=50)
+    assert smt.root_hash == expected.root_hash
+    assert SparseMerkleTree(db).get(key) == b'\x03' * 32
+
+
+def reachable(smt, root_hash):
+    # All the nodes under a root
+    nodes = set()
+    stack = [(root_hash, 0)]
+    while stack:
+        node_hash, depth = stack.pop()
+        if node_hash == EMPTY_SUBTREE_HASHES[depth]:
+            continue
+        nodes.add(node_hash)
+        if depth < 160:
+            node = smt.db[node_hash]
+            stack.extend([(node[:32], depth+1), (node[32:], depth+1)])
+    return nodes
+
+
+@pytest.mark.parametrize('db', ['dict', 'sqlite'])
+def test_pruning(tmp_path, db):
+    db = {} if db == 'dict' else SqliteDB(tmp_path / 'smt.db')
+    smt = SparseMerkleTree(db, keep_roots=4)
+    unpruned = SparseMerkleTree()
+    rng = random.Random(0)
+    keys = [key for key, _ in random_items(30)]
+    roots = []
+    for i in range(100):
+        # Few keys, many updates (some back to old values, or removed)
+        key, value = rng.choice(keys), rng.choice([EMPTY_VALUE, b'\x01' * 32, b'\x02' * 32])
+        assert smt.set(key, value) == unpruned.set(key, value)
+        roots.append(smt.root_hash)
+        if i % 10 == 0:
+            # The last roots are all still there
+            for root_hash in roots[-4:]:
+                assert all(h in smt.db for h in reachable(unpruned, root_hash))
+
+    smt.prune()
+    assert smt.prunable_nodes == 0
+    # Only the nodes of the last 4 roots are left
+    live = set(h for r in roots[-4:] for h in reachable(unpruned, r))
+    assert all(h in smt.db for h in live)
+    assert len(smt.db) == len(live)
+    assert smt.reclaimed_bytes > 0
+    # Some nodes were removed more than once, when a value came back
+    assert smt.pruned_nodes >= len(unpruned.db) - len(smt.db)
+
+
+def test_pruning_existing_tree(tmp_path):
+    items = random_items(50)
+    smt = SparseMerkleTree.from_leaves(sorted(items), keep_roots=2)
+    before = len(smt.db)
+    # Overwriting everything twice leaves nothing from the original tree
+    for value in (b'\x01' * 32, b'\x02' * 32):
+        smt.set_many((key, value) for key, _ in items)
+    smt.prune()
+    assert len(smt.db) <= 2 * before
+    expected = SparseMerkleTree()
+    expected.set_many((key, b'\x02' * 32) for key, _ in items)
+    assert smt.root_hash == expected.root_hash
+    assert all(smt.get(key) == b'\x02' * 32 for key, _ in items)
+
+
+def test_pruning_reopened(tmp_path):
+    path = tmp_path / 'smt.db'
+    unpruned = SparseMerkleTree()
+    items = random_items(20)
+    # History from before pruning was enabled is dropped
+    smt = SparseMerkleTree(SqliteDB(path))
+    for key, value in items[:10]:
+        assert smt.set(key, value) == unpruned.set(key, value)
+    smt = SparseMerkleTree(SqliteDB(path), keep_roots=4)
+    assert len(smt.db) == len(reachable(unpruned, smt.root_hash))
+
+    roots = [smt.root_hash]
+    for key, value in items[10:15]:
+        smt.set(key, value)
+        unpruned.set(key, value)
+        roots.append(smt.root_hash)
+    # Counts are kept in the db, so the older roots are still released later
+    smt = SparseMerkleTree(SqliteDB(path), keep_roots=4)
+    assert smt._refs is None and list(smt._roots) == roots[-4:]
+    for key, value in items[15:]:
+        smt.set(key, b'\x01' * 32)
+        unpruned.set(key, b'\x01' * 32)
+        roots.append(smt.root_hash)
+    smt.prune()
+    live = set(h for r in roots[-4:] for h in reachable(unpruned, r))
+    assert len(smt.db) == len(live) and all(h in smt.db for h in live)
+
+    # Fewer roots to keep than before
+    smt = SparseMerkleTree(SqliteDB(path), keep_roots=1)
+    smt.prune()
+    assert len(smt.db) == len(reachable(unpruned, smt.root_hash))
+    assert all(smt.get(key) == b'\x01' * 32 for key, _ in items[15:])
+
+
+def test_at(tmp_path):
+    smt = SparseMerkleTree(SqliteDB(tmp_path / 'smt.db'))
+    items = random_items(20)
+    versions = [(smt.root_hash, {})]
+    for key, value in items:
+        smt.set(key, value)
+        state = dict(versions[-1][1])
+        state[key] = value
+        versions.append((smt.root_hash, state))
+    smt.delete(items[0][0])
+
+    # Every earlier root answers as if no update came after it
+    for root_hash, state in versions:
+        version = smt.at(root_hash)
+        for key, _ in items:
+            value = state.get(key, EMPTY_VALUE)
+            assert version.get(key) == value
+            assert calc_root(key, value, version.branch(key)) == root_hash
+    # Updates go through a copy
+    copy = smt.at(versions[1][0]).overlay()
+    copy.set(items[1][0], items[1][1])
+    assert copy.root_hash == versions[2][0]
+
+    with pytest.raises(ValidationError):
+        smt.at(versions[1][0]).set(items[1][0], EMPTY_VALUE)
+    with pytest.raises(KeyError):
+        smt.at(b'\x01' * 32)
+    # Stored nodes that were never a root aren't either
+    interior = smt.db[smt.root_hash][:32]
+    assert interior in smt.db
+    with pytest.raises(KeyError):
+        smt.at(interior)
+    # Snapshots don't touch the stored root pointer
+    assert smt.db.root == smt.root_hash
+    # The roots are recorded in the db, in memory they are kept by the tree
+    assert SparseMerkleTree(smt.db).at(versions[1][0]).get(items[0][0]) == items[0][1]
+    memory = SparseMerkleTree()
+    memory.set_many(items)
+    root_hash = memory.root_hash
+    memory.delete(items[0][0])
+    assert memory.at(root_hash).get(items[0][0]) == items[0][1]
+    with pytest.raises(KeyError):
+        memory.at(memory.db[memory.root_hash][32:])
+
+
+def test_at_pruned():
+    smt = SparseMerkleTree(keep_roots=2)
+    key = b'\x01' * 20
+    for i in range(1, 4):
+        smt.set(key, i.to_bytes(32, 'big'))
+    roots = list(smt._roots)
+    assert smt.at(roots[0]).get(key) == (2).to_bytes(32, 'big')
+    # Older roots may not be fully stored anymore
+    smt.set(key, EMPTY_VALUE)
+    with pytest.raises(KeyError):
+        smt.at(roots[0])
+    assert smt.at(roots[1]).get(key) == (3).to_bytes(32, 'big')
+
+
+@pytest.mark.parametrize('db', ['dict', 'sqlite'])
+def test_pruning_by_age(tmp_path, db):
+    path = tmp_path / 'smt.db'
+    smt = SparseMerkleTree({} if db == 'dict' else SqliteDB(path), keep_age=10)
+    unpruned = SparseMerkleTree()
+    items = random_items(20)
+    roots = []
+    # Several updates in some blocks, none in others
+    blocks = [0, 0, 1, 5, 5, 5, 12, 14, 14, 20]
+    for (key, value), block in zip(items, blocks):
+        overlay = smt.overlay()
+        overlay.set(key, value)
+        smt.merge(overlay, [overlay.root_hash], [block])
+        unpruned.set(key, value)
+        roots.append(smt.root_hash)
+    # Roots replaced before block 10 are gone, the one current then is kept
+    assert list(smt._roots) == roots[5:]
+    for root_hash in roots[:5]:
+        with pytest.raises(KeyError):
+            smt.at(root_hash)
+    smt.prune()
+    live = set(h for r in roots[5:] for h in reachable(unpruned, r))
+    assert len(smt.db) == len(live) and all(h in smt.db for h in live)
+
+    if db == 'sqlite':
+        # Stamps are kept with the retained roots
+        smt = SparseMerkleTree(SqliteDB(path), keep_age=10)
+        assert list(smt._stamps) == blocks[5:]
+        overlay = smt.overlay()
+        overlay.set(*items[10])
+        smt.merge(overlay, [overlay.root_hash], [23])
+        assert list(smt._roots) == roots[6:] + [smt.root_hash]
+
+    # Unstamped updates don't age the tree
+    smt.set(*items[11])
+    assert smt._stamps[-1] == smt._stamps[-2]
+    with pytest.raises(ValidationError):
+        smt.merge(smt.overlay(), [smt.root_hash], [])
+
+
+def test_sqlite_reopen(tmp_path):
+    items = random_items(20)
+    db = SqliteDB(tmp_path / 'smt.db')
+    smt = SparseMerkleTree(db)
+    for key, value in items[:10]:
+        smt.set(key, value)
+    smt.set_many(items[10:])
+    root = smt.root_hash
+    db.close()
+
+    # Reopening resumes from the stored root without replaying anything
+    smt = SparseMerkleTree(SqliteDB(tmp_path / 'smt.db'))
+    assert smt.root_hash == root
+    for key, value in items:
+        assert smt.get(key) == value
+
+
+def test_sqlite_transaction(tmp_path):
+    db = SqliteDB(tmp_path / 'smt.db')
+    key, value = random_items(1)[0]
+    # Other writes can be committed with an update, or rolled back with it
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.set_meta('block', b'\x01')
+            SparseMerkleTree(db).set(key, value)
+            raise ValueError("Failed before the end")
+    assert db.get_meta('block') is None and db.root is None
+    with db.transaction():
+        db.set_meta('block', b'\x02')
+        smt = SparseMerkleTree(db)
+        smt.set(key, value)
+    db.close()
+
+    db = SqliteDB(tmp_path / 'smt.db')
+    assert db.get_meta('block') == b'\x02'
+    assert SparseMerkleTree(db).root_hash == smt.root_hash
+
+
+def test_default_db_not_shared():
+    smt1, smt2 = SparseMerkleTree(), SparseMerkleTree()
+    key, value = random_items(1)[0]
+    smt1.set(key, value)
+    assert smt1.db is not smt2.db
+    assert key not in smt2
+
+
+def test_empty_subtrees_not_stored():
+    smt = SparseMerkleTree()
+    key, value = random_items(1)[0]
+    # An empty tree needs no nodes at all
+    assert len(smt.db) == 0
+    assert smt.get(key) == EMPTY_VALUE
+    assert smt.branch(key) == EMPTY_NODE_HASHES
+    # Only the nodes on the updated path are written
+    smt.set(key, value)
+    assert len(smt.db) == 160 + 1
+    # Removing the only value brings back the empty root
+    smt.delete(key)
+    assert smt.root_hash == EMPTY_ROOT_HASH
+    assert smt.branch(key) == EMPTY_NODE_HASHES
+
+
+def test_overlay(tmp_path):
+    smt = SparseMerkleTree(SqliteDB(tmp_path / 'smt.db'))
+    items = random_items(20)
+    smt.set_many(items[:10])
+    root_hash = smt.root_hash
+
+    overlay = smt.overlay()
+    assert overlay.branch(items[0][0]) == smt.branch(items[0][0])
+    overlay.set_many(items[10:])
+    # Updates only go to the overlay
+    assert smt.root_hash == root_hash
+    assert all(not smt.exists(k) for k, _ in items[10:])
+    assert all(overlay.get(k) == v for k, v in items)
+
+    expected = SparseMerkleTree()
+    expected.set_many(items)
+    assert overlay.root_hash == expected.root_hash
+
+    # Or start over from another root
+    empty = smt.overlay(EMPTY_ROOT_HASH)
+    assert all(not empty.exists(k) for k, _ in items)
+    empty.set_many(items[:10])
+    assert empty.root_hash == root_hash
+
+
+@pytest.mark.parametrize('keep_roots', [None, 3])
+def test_merge(tmp_path, keep_roots):
+    smt = SparseMerkleTree(SqliteDB(tmp_path / 'smt.db'), keep_roots=keep_roots)
+    items = random_items(20)
+    smt.set_many(items[:10])
+
+    overlay = smt.overlay()
+    roots = []
+    for key, value in items[10:]:
+        overlay.set(key, value)
+        roots.append(overlay.root_hash)
+    # Every other root is skipped, its nodes don't have to be kept
+    smt.merge(overlay, roots[1::2])
+    assert smt.root_hash == overlay.root_hash
+    assert all(smt.get(k) == v for k, v in items)
+
+    # The merged roots open like the roots of updates made here
+    kept = roots[1::2] if keep_roots is None else roots[1::2][-keep_roots:]
+    for i, root_hash in enumerate(roots):
+        if root_hash not in kept:
+            with pytest.raises(KeyError):
+                smt.at(root_hash)
+            continue
+        assert smt.at(root_hash).get(items[10 + i][0]) == items[10 + i][1]
+    if keep_roots is not None:
+        smt.prune()
+        live = set(h for r in kept for h in reachable(smt, r))
+        assert len(smt.db) == len(live)
+
+    with pytest.raises(ValidationError):
+        smt.merge(SparseMerkleTree().overlay(), [EMPTY_ROOT_HASH])
+    with pytest.raises(ValidationError):
+        smt.merge(smt.overlay(), [roots[0]])
+
+
+def test_compressed_branch():
+    smt = SparseMerkleTree()
+    items = random_items(100)
+    smt.set_many(items)
+    for key, _ in items:
+        branch = smt.branch(key)
+        bitmap, siblings = smt.compressed_branch(key)
+        # Sparse trees have very few non-default siblings
+        assert len(siblings) < 20
+        assert bin(bitmap).count('1') == 160 - len(siblings)
+        assert expand_branch(bitmap, siblings) == branch
+    # Bitmap and siblings must agree
+    with pytest.raises(ValidationError):
+        expand_branch(bitmap, siblings[1:])
+    with pytest.raises(ValidationError):
+        expand_branch(bitmap, siblings + [siblings[0]])
+
+
+def test_calc_root():
+    smt = SparseMerkleTree()
+    items = random_items(10)
+    smt.set_many(items)
+    for key, value in items:
+        assert calc_root(key, value, smt.branch(key)) == smt.root_hash
+
+
+def test_calc_node_updates():
+    smt = SparseMerkleTree()
+    smt.set_many(random_items(10))
+    # Compact updates only carry the compressed branch before the update
+    for key, value in random_items(10):
+        branch = expand_branch(*smt.compressed_branch(key))
+        assert calc_node_updates(key, value, branch) == smt.set(key, value)
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_verify_many(workers):
+    smt = SparseMerkleTree()
+    items = random_items(200)
+    smt.set_many(items)
+    proofs = [(key, value, smt.branch(key)) for key, value in items]
+    # Keys that aren't set have valid proofs too
+    key = b'\x00' * 20
+    proofs.append((key, EMPTY_VALUE, smt.branch(key)))
+
+    results, saved = verify_many(smt.root_hash, proofs, workers=workers)
+    assert all(results)
+    assert saved > 0
+    # Only hashes skipped by reusing another proof count as saved
+    assert verify_many(smt.root_hash, proofs[:1])[1] == 0
+    short = [(k, v, b[1:]) for k, v, b in proofs]
+    assert verify_many(smt.root_hash, short, workers=workers) == ([False] * len(short), 0)
+
+    # Wrong value, a bad sibling at the leaf, one near the root, and bad lengths
+    bad = list(proofs)
+    bad[0] = (bad[0][0], b'\x00' * 32, bad[0][2])
+    bad[1] = (bad[1][0], bad[1][1], bad[1][2][:-1] + [b'\x00' * 32])
+    bad[2] = (bad[2][0], bad[2][1], [b'\x00' * 32] + bad[2][2][1:])
+    bad[3] = (bad[3][0], bad[3][1], bad[3][2][1:])
+    results, _ = verify_many(smt.root_hash, bad, workers=workers)
+    assert results == [False] * 4 + [True] * (len(bad) - 4)
+    # Same answers as checking them one by one
+    assert results == [
+            len(b) == 160 and calc_root(k, v, b) == smt.root_hash
+            for k, v, b in bad
+        ]
+
+
+def test_proof_updates():
+    smt = SparseMerkleTree()
+    items = random_items(50)
+    key = items[0][0]
+    proof = SparseMerkleProof(key, smt.get(key), smt.branch(key))
+    # Following along with every update keeps the proof valid
+    for k, v in items:
+        proof.update(k, v, smt.set(k, v))
+        assert proof.root_hash == smt.root_hash
+    assert proof.value == smt.get(key)
+    assert proof.branch == smt.branch(key)
+
+
+@pytest.mark.parametrize('shard_bits', [1, 4, None])
+def test_from_leaves_sharded(tmp_path, shard_bits):
+    items = sorted(random_items(300))
+    # Repeated keys, and a subtree that only holds a default value
+    items.insert(11, (items[10][0], b'\x03' * 32))
+    items.append((b'\xff' * 20, EMPTY_VALUE))
+    serial = SparseMerkleTree.from_leaves(items)
+
+    # Same root and nodes, whichever way the keys are split
+    smt = SparseMerkleTree.from_leaves(items, workers=2, shard_bits=shard_bits)
+    assert smt.root_hash == serial.root_hash
+    assert smt.db == serial.db
+    assert calc_leaves_root(items) == calc_leaves_root(items, workers=2, shard_bits=shard_bits) == serial.root_hash
+    db = SqliteDB(tmp_path / 'smt.db')
+    assert SparseMerkleTree.from_leaves(items, db=db, workers=2).root_hash == serial.root_hash
+    assert SparseMerkleTree(db).get(items[10][0]) == b'\x03' * 32
+
+    with pytest.raises(ValidationError):
+        SparseMerkleTree.from_leaves(reversed(items), workers=2, shard_bits=shard_bits)
+    assert SparseMerkleTree.from_leaves([], workers=2).root_hash == EMPTY_ROOT_HASH
+
+
+def test_empty_subtree_hashes():
+    # The precomputed table must match the contract's empty tree
+    node = hashing.keccak(EMPTY_VALUE)
+    for depth in reversed(range(161)):
+        assert EMPTY_SUBTREE_HASHES[depth] == node
+        node = hashing.keccak(node + node)
+    assert EMPTY_ROOT_HASH == hashing.CONTRACT_EMPTY_ROOT
+    assert EMPTY_NODE_HASHES == EMPTY_SUBTREE_HASHES[1:]
+
+
+@pytest.mark.parametrize('backend', [b for b, _ in hashing.BACKENDS])
+def test_hash_backends(backend):
+    try:
+        _, keccak = hashing._load_backend(backend)
+    except ImportError:
+        pytest.skip("'{}' is not installed".format(backend))
+    # Keccak-256, not SHA3-256
+    assert keccak(b'') == hashing.KECCAK_EMPTY
+    assert keccak(b'\x00' * 64) == hashing.keccak(b'\x00' * 64)
+
+
+@pytest.mark.parametrize('n', [1, 2, 17, 256])
+def test_multiproof(n):
+    smt = SparseMerkleTree()
+    smt.set_many(random_items(300, seed=1))
+    batch = [(b'\x00' * 20, b'\x01' * 32)] + sorted(random_items(n - 1, seed=2))
+    # Include a pair of keys that are siblings at the leaf
+    if n > 1:
+        batch[1] = (b'\x00' * 19 + b'\x01', b'\x02' * 32)
+    keys = [k for k, _ in batch]
+    defaults, siblings = smt.multiproof(keys)
+    # Proves the current values...
+    assert calc_multiroot(keys, [smt.get(k) for k in keys], defaults, siblings) == smt.root_hash
+    # ...and gives the root after updating all of them
+    root, _ = smt.set_many(batch)
+    assert calc_multiroot(keys, [v for _, v in batch], defaults, siblings) == root
+    # Siblings shared by several keys are only included once
+    assert len(siblings) <= sum(len(smt.compressed_branch(k)[1]) for k in keys)
+    with pytest.raises(ValidationError):
+        calc_multiroot(keys, [v for _, v in batch], defaults, siblings + [b'\x00' * 32])
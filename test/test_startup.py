@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Cumulative import time budgets (microseconds), with plenty of headroom:
+# these are ~40ms on a laptop, web3 + IPython alone take seconds
+BUDGETS = {
+        'smt': 250000,
+        'daemon': 300000,
+    }
+
+
+def import_time(module):
+    """
+    Returns the cumulative import time of `module` from `python -X importtime`,
+    and the modules that were imported along with it
+    """
+    result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+            cwd=str(ROOT), stderr=subprocess.PIPE, check=True,
+        )
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times[module], set(times)
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_budget(module):
+    elapsed, imported = import_time(module)
+    # Only the console and node-facing modes need these
+    assert not {'web3', 'IPython', 'eth_account'} & imported
+    assert elapsed < BUDGETS[module]
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from token_index import TokenIndex
+
+
+@pytest.fixture
+def token(vy_deployer):
+    # We don't need the address...
+    package, _ = vy_deployer.deploy('gun-token')
+    return package.deployments.get_contract_instance('gun-token')
+
+
+def test_index(w3, token, tmp_path):
+    authority, *users = w3.eth.accounts[:5]
+    rng = random.Random(0)
+    owners = {}
+    for token_id in range(1, 21):
+        owners[token_id] = rng.choice(users)
+        token.functions.mint(owners[token_id], token_id).transact({'from':authority})
+
+    checkpoint = tmp_path / 'tokens.json'
+    index = TokenIndex(w3, token.address, checkpoint=checkpoint)
+    assert len(index) == 20
+
+    # Transfers and burns are picked up by the next sync
+    for token_id in rng.sample(sorted(owners), 10):
+        to = rng.choice([u for u in users if u != owners[token_id]])
+        token.functions.safeTransferFrom(owners[token_id], to, token_id).\
+                transact({'from':owners[token_id]})
+        owners[token_id] = to
+    for token_id in rng.sample(sorted(owners), 5):
+        token.functions.burn(token_id).transact({'from':owners.pop(token_id)})
+    index.sync()
+
+    for token_id in range(1, 21):
+        assert index.owner_of(token_id) == owners.get(token_id)
+    for user in users:
+        assert index.tokens_of(user) == sorted(t for t, o in owners.items() if o == user)
+        assert index.balance_of(user) == token.functions.balanceOf(user).call()
+    assert index.reconcile(samples=100) == []
+
+    # Resumes from the checkpoint without replaying anything
+    resumed = TokenIndex(w3, token.address, checkpoint=checkpoint)
+    assert resumed.backfill.logs == 0
+    assert dict((t, resumed.owner_of(t)) for t in owners) == owners
+
+
+def test_reconcile_mismatch(w3, token):
+    authority, user = w3.eth.accounts[:2]
+    token.functions.mint(user, 1).transact({'from':authority})
+    index = TokenIndex(w3, token.address)
+    # Corrupt the local index
+    index._remove(1, index._owners[1])
+    index._add(1, b'\x01' * 20)
+    assert sorted(m[0] for m in index.reconcile()) == ['balanceOf', 'ownerOf']
@@ -0,0 +1,235 @@
+import os
+import json
+import random
+from pathlib import Path
+
+from eth_typing import (
+        Address,
+    )
+
+from eth_utils import (
+        event_abi_to_log_topic,
+        to_bytes,
+        to_canonical_address,
+        to_checksum_address,
+    )
+
+from web3 import Web3
+from web3.utils.events import get_event_data
+
+from backfill import Backfill
+from reader import BatchReader
+
+
+ZERO_ADDRESS = b'\x00' * 20
+
+
+token_abi = [
+        {
+            'name': 'Transfer',
+            'inputs': [
+                {'type': 'address', 'name': '_from', 'indexed': True},
+                {'type': 'address', 'name': '_to', 'indexed': True},
+                {'type': 'uint256', 'name': '_tokenId', 'indexed': True},
+            ],
+            'anonymous': False,
+            'type': 'event',
+        },{
+            'name': 'balanceOf',
+            'outputs': [{'type': 'uint256', 'name': 'out'}],
+            'inputs': [{'type': 'address', 'name': '_owner'}],
+            'constant': True,
+            'payable': False,
+            'type': 'function',
+        },{
+            'name': 'ownerOf',
+            'outputs': [{'type': 'address', 'name': 'out'}],
+            'inputs': [{'type': 'uint256', 'name': '_tokenId'}],
+            'constant': True,
+            'payable': False,
+            'type': 'function',
+        }
+    ]
+
+
+TRANSFER_TOPIC = '0x' + event_abi_to_log_topic(token_abi[0]).hex()
+
+
+def _decode(log):
+    return get_event_data(token_abi[0], log)
+
+
+class TokenIndex:
+    """
+    Local index of token ownership, built from the token's `Transfer` logs
+    (mints are transfers from the zero address, burns transfers to it)
+
+    Tokens are indexed by id and by owner, so `owner_of`, `balance_of` and
+    `tokens_of` are answered from memory, as of the last `sync`.
+
+    If a checkpoint file is given, the index and the last processed block are
+    saved to it after every sync, and a new TokenIndex resumes from there
+    instead of replaying the whole history
+
+    Logs are fetched in parallel chunks of blocks (see `Backfill`). Like the
+    `Listener`, a sync fetches and checks its whole range before changing the
+    index, stays `confirmations` blocks behind the head, and starts over if
+    the last synced block was re-organized away.
+    """
+    def __init__(self, w3: Web3, token_address: Address, checkpoint: Path=None,
+            chunk_size: int=5000, workers: int=4, confirmations: int=0):
+        self._w3 = w3
+        self.confirmations = confirmations
+        self._token = w3.eth.contract(token_address, abi=token_abi)
+        self._owners = {}  # Token id -> owner
+        self._tokens = {}  # Owner -> set of token ids
+        self.backfill = Backfill(
+                w3,
+                {
+                    'address': self._token.address,
+                    'topics': [TRANSFER_TOPIC],
+                },
+                decode=_decode,
+                chunk_size=chunk_size,
+                workers=workers,
+            )
+        self._checkpoint = None if checkpoint is None else Path(checkpoint)
+        # Last block that has been processed
+        self.block_number = -1
+        self.block_hash = None
+        if self._checkpoint is not None and self._checkpoint.exists():
+            self._load()
+        # Iterate over all logged transfers since the checkpoint
+        self.sync()
+
+    def _load(self):
+        with open(self._checkpoint, 'r') as f:
+            checkpoint = json.loads(f.read())
+
+        # Chain was re-organized from under the checkpoint, start over
+        block_hash = to_bytes(hexstr=checkpoint['block_hash'])
+        if self._w3.eth.getBlock(checkpoint['block_number'])['hash'] != block_hash:
+            return
+
+        for token_id, owner in checkpoint['owners'].items():
+            self._add(int(token_id, 16), to_canonical_address(owner))
+        self.block_number = checkpoint['block_number']
+        self.block_hash = block_hash
+
+    def _save(self):
+        checkpoint = {
+            'block_number': self.block_number,
+            'block_hash': '0x' + bytes(self.block_hash).hex(),
+            'owners': dict(
+                    (hex(token_id), to_checksum_address(owner))
+                    for token_id, owner in self._owners.items()
+                ),
+        }
+        # Write to the side and swap in, so a crash never leaves half a file
+        tmp = self._checkpoint.with_name(self._checkpoint.name + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(checkpoint))
+        os.replace(tmp, self._checkpoint)
+
+    def _add(self, token_id, owner):
+        self._owners[token_id] = owner
+        self._tokens.setdefault(owner, set()).add(token_id)
+
+    def _remove(self, token_id, owner):
+        del self._owners[token_id]
+        tokens = self._tokens[owner]
+        tokens.remove(token_id)
+        if not tokens:
+            del self._tokens[owner]
+
+    def _process(self, logs) -> dict:
+        """
+        Checks every transfer against the owner before it, and returns the
+        new owner of every token that moved (zero address if burned)
+        """
+        changes = {}
+        for log in logs:
+            token_id = log.args._tokenId
+            sender = to_canonical_address(log.args._from)
+            # Index must agree with the owner the contract checked
+            owner = changes.get(token_id, self._owners.get(token_id, ZERO_ADDRESS))
+            assert owner == sender, "Index doesn't match transfer of token {}!".format(token_id)
+            changes[token_id] = to_canonical_address(log.args._to)
+        return changes
+
+    def _reset(self):
+        self._owners = {}
+        self._tokens = {}
+        self.block_number = -1
+        self.block_hash = None
+
+    def sync(self):
+        # Chain was re-organized from under the last sync, start over
+        if self.block_number >= 0:
+            block = self._w3.eth.getBlock(self.block_number)
+            if block is None or block['hash'] != self.block_hash:
+                self._reset()
+
+        latest = self._w3.eth.blockNumber - self.confirmations
+        if latest <= self.block_number:
+            return
+
+        # Fetch and check the whole range before touching the index
+        changes = self._process(list(self.backfill.run(self.block_number + 1, latest)))
+        for token_id, owner in changes.items():
+            if token_id in self._owners:
+                self._remove(token_id, self._owners[token_id])
+            if owner != ZERO_ADDRESS:
+                self._add(token_id, owner)
+
+        self.block_number = latest
+        self.block_hash = self._w3.eth.getBlock(latest)['hash']
+        if self._checkpoint is not None:
+            self._save()
+
+    def owner_of(self, token_id: int) -> Address:
+        """
+        Owner of the token, or None if it was never minted (or was burned)
+        """
+        owner = self._owners.get(token_id)
+        return None if owner is None else to_checksum_address(owner)
+
+    def balance_of(self, owner: Address) -> int:
+        return len(self._tokens.get(to_canonical_address(owner), ()))
+
+    def tokens_of(self, owner: Address) -> list:
+        return sorted(self._tokens.get(to_canonical_address(owner), ()))
+
+    def __len__(self):
+        return len(self._owners)
+
+    def reconcile(self, samples: int=100, rng=None, **kwargs) -> list:
+        """
+        Checks a random sample of tokens (`ownerOf`) and owners (`balanceOf`)
+        against the contract, as of the last synced block, in batched reads
+        (see `BatchReader`)
+
+        Returns the mismatches as (function, argument, indexed, on-chain)
+        """
+        rng = random.Random() if rng is None else rng
+        token_ids = rng.sample(sorted(self._owners), min(samples, len(self._owners)))
+        owners = [
+                to_checksum_address(owner)
+                for owner in rng.sample(sorted(self._tokens), min(samples, len(self._tokens)))
+            ]
+
+        reader = BatchReader(self._w3, block_number=self.block_number, **kwargs)
+        functions = self._token.functions
+        results = reader.call(
+                [functions.ownerOf(token_id) for token_id in token_ids] +
+                [functions.balanceOf(owner) for owner in owners]
+            )
+
+        mismatches = []
+        for token_id, owner in zip(token_ids, results):
+            if owner != self.owner_of(token_id):
+                mismatches.append(('ownerOf', token_id, self.owner_of(token_id), owner))
+        for owner, balance in zip(owners, results[len(token_ids):]):
+            if balance != self.balance_of(owner):
+                mismatches.append(('balanceOf', owner, self.balance_of(owner), balance))
+        return mismatches